@@ -0,0 +1,88 @@
+"""
+Model fields.
+
+CompressedTextField stores text compressed (see services/compression.py)
+in a binary column. Loaded values stay compressed until the attribute is
+first read, so queries that never touch the text never decompress it.
+values() and values_list() return the CompressedText markers themselves;
+use str() on them to get the text.
+"""
+
+from django.db import models
+from django.db.models.query_utils import DeferredAttribute
+
+from .services import compression
+
+
+class CompressedText:
+    """A value loaded from a CompressedTextField, not yet decompressed"""
+
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return compression.decompress(self.data)
+
+    def prefix(self, length):
+        return compression.decompress_prefix(self.data, length)
+
+
+class CompressedTextDescriptor(DeferredAttribute):
+    """Decompress a loaded value on first access and keep the text"""
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        value = super().__get__(instance, cls)
+        if isinstance(value, CompressedText):
+            value = instance.__dict__[self.field.attname] = str(value)
+        return value
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = value
+
+
+class CompressedTextField(models.TextField):
+
+    descriptor_class = CompressedTextDescriptor
+
+    def get_internal_type(self):
+        return 'BinaryField'
+
+    def from_db_value(self, value, expression, connection):
+        if value is None or isinstance(value, str):
+            return value
+        return CompressedText(bytes(value))
+
+    def pre_save(self, model_instance, add):
+        # Read the stored value as is, so unchanged text is not decompressed and recompressed
+        return model_instance.__dict__.get(self.attname)
+
+    def get_prep_value(self, value):
+        if value is None:
+            return None
+        if isinstance(value, CompressedText):
+            return value.data
+        return compression.compress(str(value))
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        value = self.get_prep_value(value) if not prepared else value
+        return connection.Database.Binary(value) if value is not None else None
+
+
+def text_prefix(instance, field_name, length):
+    """
+    The first length characters of a CompressedTextField value.
+
+    Only as much of the value as needed is decompressed, unless the full
+    text has been read already.
+    """
+    field = instance._meta.get_field(field_name)
+    value = instance.__dict__.get(field.attname)
+    if value is None:
+        value = getattr(instance, field.attname)
+    if isinstance(value, CompressedText):
+        return value.prefix(length)
+    return (value or '')[:length]
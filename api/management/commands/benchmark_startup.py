@@ -0,0 +1,73 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+SDK_MODULES = ('anthropic', 'google.generativeai')
+# Needed only to straighten uploaded images
+IMAGE_MODULES = ('cv2', 'numpy')
+
+# Runs in a fresh interpreter so earlier imports cannot hide the cost
+PROBE = """
+import json, sys, time
+import django
+django.setup()
+
+started = time.perf_counter()
+from api.services.ai_service import ai_service
+imported = time.perf_counter() - started
+loaded = [name for name in {sdks!r} + {images!r} if name in sys.modules]
+
+started = time.perf_counter()
+for provider in ai_service.router.providers.values():
+    try:
+        getattr(provider, 'client', None)
+    except Exception:
+        pass
+connected = time.perf_counter() - started
+
+started = time.perf_counter()
+for name in {sdks!r}:
+    __import__(name)
+eager = time.perf_counter() - started
+
+started = time.perf_counter()
+for name in {images!r}:
+    __import__(name)
+images = time.perf_counter() - started
+
+print(json.dumps({{'import': imported, 'loaded': loaded, 'connect': connected, 'eager': eager, 'images': images}}))
+"""
+
+
+class Command(BaseCommand):
+    help = 'Measure how long the AI service takes to import, to create its provider clients, and what its lazy imports save'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters to sample')
+
+    def handle(self, *args, **options):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get(
+            'DJANGO_SETTINGS_MODULE', 'booksbuddy_backend.settings'
+        ))
+        samples = []
+        for _ in range(options['runs']):
+            result = subprocess.run(
+                [sys.executable, '-W', 'ignore', '-c', PROBE.format(sdks=SDK_MODULES, images=IMAGE_MODULES)],
+                capture_output=True, text=True, env=env, cwd=settings.BASE_DIR, check=True
+            )
+            samples.append(json.loads(result.stdout.strip().splitlines()[-1]))
+
+        def median_ms(field):
+            return statistics.median(sample[field] for sample in samples) * 1000
+
+        self.stdout.write(f"Runs: {len(samples)}")
+        self.stdout.write(f"Import ai_service: {median_ms('import'):.1f} ms")
+        self.stdout.write(f"SDKs and image libraries loaded at import: {', '.join(samples[0]['loaded']) or 'none'}")
+        self.stdout.write(f"First use of configured providers: {median_ms('connect'):.1f} ms")
+        self.stdout.write(f"Importing every SDK up front would add: {median_ms('eager'):.1f} ms")
+        self.stdout.write(f"Importing {', '.join(IMAGE_MODULES)} up front would add: {median_ms('images'):.1f} ms")
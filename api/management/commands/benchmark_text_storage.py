@@ -0,0 +1,111 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection
+
+from api.services import compression
+from api.services.search_index import TABLE as SEARCH_TABLE
+from .train_text_dictionary import stored_texts
+
+# Tables holding text, by label; the search index keeps its own uncompressed
+# copy of book and page text next to the inverted index
+TEXT_TABLES = [
+    ('books', 'api_book'),
+    ('pages', 'api_page'),
+    ('text blocks', 'api_textblock'),
+    ('search index', SEARCH_TABLE),
+]
+
+
+def table_sizes():
+    """
+    Bytes each of TEXT_TABLES takes in the database, including its indexes.
+
+    Returns:
+        list: (label, bytes) pairs, or None if the database cannot report sizes
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                'SELECT ' + ', '.join(['pg_total_relation_size(%s)'] * len(TEXT_TABLES)),
+                [table for _, table in TEXT_TABLES]
+            )
+            return list(zip([label for label, _ in TEXT_TABLES], cursor.fetchone()))
+        if connection.vendor != 'sqlite':
+            return None
+        sizes = []
+        try:
+            for label, table in TEXT_TABLES:
+                # tbl_name covers a table's indexes; FTS5 also keeps its rows
+                # in <table>_content, _data, _idx and _docsize shadow tables
+                cursor.execute(
+                    "SELECT COALESCE(SUM(payload), 0) FROM dbstat WHERE name IN "
+                    "(SELECT name FROM sqlite_master WHERE tbl_name IN (%s, %s, %s, %s, %s))",
+                    [table] + [f'{table}_{shadow}' for shadow in ('content', 'data', 'idx', 'docsize')]
+                )
+                sizes.append((label, cursor.fetchone()[0]))
+        except DatabaseError:
+            # SQLite built without SQLITE_ENABLE_DBSTAT_VTAB
+            return None
+        return sizes
+
+
+class Command(BaseCommand):
+    help = 'Compare stored size and encode/decode time of the text compression options'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--samples', type=int, default=1000, help='Stored texts to measure')
+        parser.add_argument('--size', type=int, default=32 * 1024, help='Dictionary size in bytes')
+
+    def handle(self, *args, **options):
+        texts = [text for text in stored_texts(options['samples']) if text]
+        if len(texts) < 20:
+            raise CommandError(f'Need at least 20 stored texts to benchmark, found {len(texts)}')
+        # Dictionaries are trained on one half and measured on the other
+        training, texts = texts[::2], texts[1::2]
+
+        variants = [('none', None), ('zlib', None), ('zlib', 'dictionary')]
+        if compression.zstandard is not None:
+            variants += [('zstd', None), ('zstd', 'dictionary')]
+        else:
+            self.stdout.write('zstandard is not installed; skipping zstd')
+
+        sizes = table_sizes()
+        if sizes is None:
+            self.stdout.write(f'{connection.vendor} cannot report table sizes; skipping them')
+        else:
+            self.stdout.write('Stored now:')
+            for label, size in sizes:
+                self.stdout.write(f'  {label:<16}{size:>12} bytes')
+            self.stdout.write(f"  {'total':<16}{sum(size for _, size in sizes):>12} bytes")
+
+        raw_bytes = sum(len(text.encode('utf-8')) for text in texts)
+        self.stdout.write(f'{len(texts)} texts, {raw_bytes} bytes of UTF-8 '
+                          f'(trained on {len(training)} others, level {settings.TEXT_COMPRESSION_LEVEL})')
+        self.stdout.write(f"{'codec':<18}{'bytes':>12}{'ratio':>8}{'write ms':>10}{'read ms':>10}{'excerpt ms':>12}")
+        for codec, kind in variants:
+            data = compression.train_dictionary(codec, training, options['size']) if kind else None
+            dictionary = (1, data) if data else compression.NO_DICTIONARY
+
+            started = time.perf_counter()
+            stored = [compression.compress(text, codec, dictionary) for text in texts]
+            write = time.perf_counter() - started
+
+            started = time.perf_counter()
+            decoded = [compression.decompress(value, data) for value in stored]
+            read = time.perf_counter() - started
+            if decoded != texts:
+                raise CommandError(f'{codec} did not round-trip')
+
+            started = time.perf_counter()
+            for value in stored:
+                compression.decompress_prefix(value, settings.BOOK_EXCERPT_LENGTH, data)
+            excerpt = time.perf_counter() - started
+
+            size = sum(len(value) for value in stored)
+            name = f'{codec} + {len(data)} B dict' if data else codec
+            self.stdout.write(
+                f'{name:<18}{size:>12}{raw_bytes / size:>8.2f}{write * 1000:>10.1f}'
+                f'{read * 1000:>10.1f}{excerpt * 1000:>12.1f}'
+            )
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from api.services import jobs
+
+
+class Command(BaseCommand):
+    help = 'Run a foreground worker that drains the background AI job queue'
+
+    def handle(self, *args, **options):
+        requeued = jobs.requeue_stale()
+        if requeued:
+            self.stdout.write(f'Requeued {requeued} stale job(s)')
+        self.stdout.write('Processing jobs, press CTRL-C to stop')
+        try:
+            jobs.work()
+        except KeyboardInterrupt:
+            pass
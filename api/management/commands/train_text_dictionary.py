@@ -0,0 +1,69 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import Book, CompressionDictionary, Page, TextBlock
+from api.services import compression
+
+BATCH_SIZE = 500
+
+
+def stored_texts(limit):
+    """The newest book texts, pages and text blocks, about a third of each, decompressed"""
+    books = Book.objects.order_by('-id').only('original_text')[:limit // 3]
+    pages = Page.objects.order_by('-id').only('content')[:limit // 3]
+    blocks = TextBlock.objects.order_by('-id').only('simplified')[:limit - len(books) - len(pages)]
+    return (
+        [book.original_text for book in books] + [page.content for page in pages]
+        + [block.simplified for block in blocks]
+    )
+
+
+class Command(BaseCommand):
+    help = 'Train a compression dictionary on stored book, page and text block text'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--codec', default=settings.TEXT_COMPRESSION, help="'zlib' or 'zstd'")
+        parser.add_argument('--size', type=int, default=32 * 1024, help='Dictionary size in bytes')
+        parser.add_argument('--samples', type=int, default=2000, help='Texts to train on')
+        parser.add_argument('--recompress', action='store_true',
+                            help='Rewrite every stored text with the new dictionary')
+
+    def handle(self, *args, **options):
+        samples = [text for text in stored_texts(options['samples']) if text]
+        if len(samples) < 10:
+            raise CommandError(f'Need at least 10 stored texts to train on, found {len(samples)}')
+        try:
+            data = compression.train_dictionary(options['codec'], samples, options['size'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        dictionary = CompressionDictionary.objects.create(
+            codec=compression.CODECS[options['codec']], data=data, sample_count=len(samples)
+        )
+        self.stdout.write(f'Trained dictionary {dictionary.id}: {len(data)} bytes from {len(samples)} texts')
+        if options['codec'] != settings.TEXT_COMPRESSION:
+            self.stdout.write(f"TEXT_COMPRESSION is '{settings.TEXT_COMPRESSION}', so new writes will not use it")
+
+        if options['recompress']:
+            compression.forget_dictionaries()
+            for model, field in ((Book, 'original_text'), (Page, 'content'), (TextBlock, 'simplified')):
+                self.stdout.write(f'Recompressed {self.recompress(model, field)} {model._meta.verbose_name_plural}')
+        else:
+            self.stdout.write('Running processes pick up the dictionary for new writes after a restart')
+
+    def recompress(self, model, field):
+        """Rewrite field on every row; bulk_update sends no signals and leaves last_edited alone"""
+        count = 0
+        batch = []
+        for row in model.objects.only('id', field).iterator(chunk_size=BATCH_SIZE):
+            # Reading the attribute decompresses it, so saving compresses it again
+            setattr(row, field, getattr(row, field))
+            batch.append(row)
+            if len(batch) == BATCH_SIZE:
+                model.objects.bulk_update(batch, [field])
+                count += len(batch)
+                batch = []
+        if batch:
+            model.objects.bulk_update(batch, [field])
+            count += len(batch)
+        return count
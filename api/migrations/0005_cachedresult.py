@@ -0,0 +1,26 @@
+# Generated by Django 5.1.3 on 2026-10-17 15:54
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_book_user_id_book_api_book_user_id_5591a4_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CachedResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('operation', models.CharField(max_length=20)),
+                ('value', models.TextField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_accessed', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('hits', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
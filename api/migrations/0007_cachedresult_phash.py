@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-17 17:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cachedresult',
+            name='phash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,70 @@
+from django.db import migrations
+
+CREATE = {
+    'sqlite': [
+        """
+        CREATE VIRTUAL TABLE api_search_index USING fts5(
+            title, body, user_id UNINDEXED, book_id UNINDEXED, page_id UNINDEXED,
+            tokenize = 'porter unicode61 remove_diacritics 2'
+        )
+        """,
+        """
+        INSERT INTO api_search_index (rowid, title, body, user_id, book_id, page_id)
+        SELECT -id, COALESCE(title, ''), original_text, user_id, id, NULL FROM api_book
+        """,
+        """
+        INSERT INTO api_search_index (rowid, title, body, user_id, book_id, page_id)
+        SELECT p.id, '', p.content, b.user_id, p.book_id, p.id
+        FROM api_page p JOIN api_book b ON b.id = p.book_id
+        """,
+    ],
+    # Untested: the test suite runs on SQLite
+    'postgresql': [
+        """
+        CREATE TABLE api_search_index (
+            id bigint PRIMARY KEY,
+            title text NOT NULL,
+            body text NOT NULL,
+            user_id varchar(100) NOT NULL,
+            book_id bigint NOT NULL,
+            page_id bigint,
+            document tsvector GENERATED ALWAYS AS (
+                setweight(to_tsvector('english', title), 'A') ||
+                setweight(to_tsvector('english', body), 'B')
+            ) STORED
+        )
+        """,
+        "CREATE INDEX api_search_index_document ON api_search_index USING gin (document)",
+        "CREATE INDEX api_search_index_user_id ON api_search_index (user_id)",
+        """
+        INSERT INTO api_search_index (id, title, body, user_id, book_id, page_id)
+        SELECT -id, COALESCE(title, ''), original_text, user_id, id, NULL FROM api_book
+        """,
+        """
+        INSERT INTO api_search_index (id, title, body, user_id, book_id, page_id)
+        SELECT p.id, '', p.content, b.user_id, p.book_id, p.id
+        FROM api_page p JOIN api_book b ON b.id = p.book_id
+        """,
+    ],
+}
+
+
+def create_index(apps, schema_editor):
+    for statement in CREATE.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor in CREATE:
+        schema_editor.execute("DROP TABLE api_search_index")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_cachedresult_phash'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.3 on 2026-10-17 17:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TextBlock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.IntegerField()),
+                ('digest', models.CharField(max_length=64)),
+                ('simplified', models.TextField()),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='blocks', to='api.book')),
+                ('page', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='blocks', to='api.page')),
+            ],
+            options={
+                'ordering': ['position'],
+                'unique_together': {('book', 'position')},
+            },
+        ),
+    ]
@@ -0,0 +1,116 @@
+import api.fields
+from django.db import migrations, models
+
+from api.fields import CompressedText
+from api.services import compression
+
+BATCH_SIZE = 500
+
+# (model, text column, compressed column)
+COLUMNS = [
+    ('Book', 'original_text', 'compressed_original_text'),
+    ('Page', 'content', 'compressed_content'),
+]
+
+
+def _copy(apps, read, write, convert):
+    for model_name, text_column, compressed_column in COLUMNS:
+        model = apps.get_model('api', model_name)
+        source, target = read(text_column, compressed_column), write(text_column, compressed_column)
+        batch = []
+        for row in model.objects.only('id', source).iterator(chunk_size=BATCH_SIZE):
+            setattr(row, target, convert(getattr(row, source)))
+            batch.append(row)
+            if len(batch) == BATCH_SIZE:
+                model.objects.bulk_update(batch, [target])
+                batch = []
+        if batch:
+            model.objects.bulk_update(batch, [target])
+
+
+def compress_text(apps, schema_editor):
+    # No dictionary exists yet; train_text_dictionary can recompress later
+    _copy(
+        apps,
+        read=lambda text, compressed: text,
+        write=lambda text, compressed: compressed,
+        convert=lambda value: CompressedText(compression.compress(value, dictionary=compression.NO_DICTIONARY)),
+    )
+
+
+def decompress_text(apps, schema_editor):
+    _copy(
+        apps,
+        read=lambda text, compressed: compressed,
+        write=lambda text, compressed: text,
+        convert=str,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_textblock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompressionDictionary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('codec', models.PositiveSmallIntegerField()),
+                ('data', models.BinaryField()),
+                ('sample_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='compressed_original_text',
+            field=api.fields.CompressedTextField(null=True),
+        ),
+        migrations.AddField(
+            model_name='page',
+            name='compressed_content',
+            field=api.fields.CompressedTextField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='book',
+            name='original_text',
+            field=models.TextField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='page',
+            name='content',
+            field=models.TextField(null=True),
+        ),
+        migrations.RunPython(compress_text, decompress_text),
+        migrations.RemoveField(
+            model_name='book',
+            name='original_text',
+        ),
+        migrations.RemoveField(
+            model_name='page',
+            name='content',
+        ),
+        migrations.RenameField(
+            model_name='book',
+            old_name='compressed_original_text',
+            new_name='original_text',
+        ),
+        migrations.RenameField(
+            model_name='page',
+            old_name='compressed_content',
+            new_name='content',
+        ),
+        migrations.AlterField(
+            model_name='book',
+            name='original_text',
+            field=api.fields.CompressedTextField(),
+        ),
+        migrations.AlterField(
+            model_name='page',
+            name='content',
+            field=api.fields.CompressedTextField(),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.3 on 2026-10-17 17:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_compressed_text'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cachedresult',
+            name='user_id',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.CreateModel(
+            name='ImageHashBand',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.CharField(max_length=100)),
+                ('band', models.PositiveSmallIntegerField()),
+                ('value', models.CharField(max_length=16)),
+                ('result', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bands', to='api.cachedresult')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['band', 'value', 'user_id'], name='api_imageha_band_dfffc1_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,66 @@
+import api.fields
+from django.db import migrations, models
+
+from api.fields import CompressedText
+from api.services import compression
+
+BATCH_SIZE = 500
+
+
+def _copy(apps, source, target, convert):
+    model = apps.get_model('api', 'TextBlock')
+    batch = []
+    for row in model.objects.only('id', source).iterator(chunk_size=BATCH_SIZE):
+        setattr(row, target, convert(getattr(row, source)))
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            model.objects.bulk_update(batch, [target])
+            batch = []
+    if batch:
+        model.objects.bulk_update(batch, [target])
+
+
+def compress_text(apps, schema_editor):
+    _copy(
+        apps, 'simplified', 'compressed_simplified',
+        lambda value: CompressedText(compression.compress(value, dictionary=compression.NO_DICTIONARY)),
+    )
+
+
+def decompress_text(apps, schema_editor):
+    _copy(apps, 'compressed_simplified', 'simplified', str)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_shared_counter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='textblock',
+            name='compressed_simplified',
+            field=api.fields.CompressedTextField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='textblock',
+            name='simplified',
+            field=models.TextField(null=True),
+        ),
+        migrations.RunPython(compress_text, decompress_text),
+        migrations.RemoveField(
+            model_name='textblock',
+            name='simplified',
+        ),
+        migrations.RenameField(
+            model_name='textblock',
+            old_name='compressed_simplified',
+            new_name='simplified',
+        ),
+        migrations.AlterField(
+            model_name='textblock',
+            name='simplified',
+            field=api.fields.CompressedTextField(),
+        ),
+    ]
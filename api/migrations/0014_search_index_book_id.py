@@ -0,0 +1,36 @@
+from django.db import migrations
+
+# FTS5 columns cannot be indexed, so SQLite needs nothing here. Untested:
+# the test suite runs on SQLite
+CREATE = {
+    'postgresql': [
+        "CREATE INDEX api_search_index_book_id ON api_search_index (book_id)",
+    ],
+}
+
+DROP = {
+    'postgresql': [
+        "DROP INDEX api_search_index_book_id",
+    ],
+}
+
+
+def create_index(apps, schema_editor):
+    for statement in CREATE.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+def drop_index(apps, schema_editor):
+    for statement in DROP.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_compressed_textblock'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.3 on 2026-10-17 18:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_search_index_book_id'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='page',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='jobs', to='api.page'),
+        ),
+    ]
@@ -1,13 +1,16 @@
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
 from django.utils import timezone
 import logging
+from .fields import CompressedTextField, text_prefix
+from .services import search_index
 
 logger = logging.getLogger(__name__)
 
 class Book(models.Model):
     user_id = models.CharField(max_length=100)
     title = models.CharField(max_length=200, blank=True, null=True, default="Untitled Book")
-    original_text = models.TextField()
+    original_text = CompressedTextField()
     created_at = models.DateTimeField(auto_now_add=True)
     last_edited = models.DateTimeField(auto_now=True)
     is_processed = models.BooleanField(default=False)
@@ -21,30 +24,70 @@ class Book(models.Model):
 
     def add_page(self, text):
         """Add a new page to the book"""
+        return self.add_pages([text])[0]
+
+    def add_pages(self, texts):
+        """
+        Append pages to the book in a single transaction.
+
+        The book row is locked while the next page numbers are reserved, so
+        concurrent appends get consecutive numbers instead of colliding on
+        (book, page_number). All pages are inserted with one bulk_create
+        and added to the search index here; pages have no signal receivers.
+        """
         try:
-            new_page = Page.objects.create(
-                book=self,
-                page_number=self.total_pages + 1,
-                content=text
-            )
-            
-            self.total_pages += 1
-            self.last_edited = timezone.now()
-            self.save()
-            
-            return new_page
-            
+            with transaction.atomic():
+                total_pages = Book.objects.select_for_update().values_list(
+                    'total_pages', flat=True
+                ).get(pk=self.pk)
+                new_pages = Page.objects.bulk_create([
+                    Page(book=self, page_number=total_pages + number, content=text)
+                    for number, text in enumerate(texts, start=1)
+                ])
+
+                self.total_pages = total_pages + len(new_pages)
+                self.save(update_fields=['total_pages', 'last_edited'])
+                search_index.index_pages(new_pages, self.user_id)
+
+            return new_pages
+
         except Exception as e:
             logger.error(f"Error adding page: {str(e)}")
             raise
 
+    def remove_pages(self, page_ids):
+        """
+        Delete pages of the book and close the gaps they leave in the numbering.
+
+        Like add_pages, this locks the book row, so a concurrent append
+        reserves numbers after the renumbered pages. The pages are also
+        dropped from the search index.
+        """
+        with transaction.atomic():
+            Book.objects.select_for_update().filter(pk=self.pk).exists()
+            Page.objects.filter(book=self, id__in=page_ids).delete()
+            search_index.remove_pages(page_ids)
+            pages = list(self.pages.order_by('page_number').values_list('id', 'page_number'))
+            # One row at a time to respect (book, page_number)
+            for number, (page_id, page_number) in enumerate(pages, start=1):
+                if page_number != number:
+                    Page.objects.filter(id=page_id).update(page_number=number)
+
+            self.total_pages = len(pages)
+            self.save(update_fields=['total_pages', 'last_edited'])
+
+    @property
+    def excerpt(self):
+        """The start of the original text, decompressing no more of it than needed"""
+        return text_prefix(self, 'original_text', settings.BOOK_EXCERPT_LENGTH)
+
     def __str__(self):
         return f"{self.title} (User: {self.user_id})"
 
 class Page(models.Model):
     book = models.ForeignKey(Book, related_name='pages', on_delete=models.CASCADE)
     page_number = models.IntegerField()
-    content = models.TextField()
+    content = CompressedTextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -52,4 +95,118 @@ class Page(models.Model):
         unique_together = ['book', 'page_number']
 
     def __str__(self):
-        return f"Page {self.page_number} in {self.book.title}"
\ No newline at end of file
+        return f"Page {self.page_number} in {self.book.title}"
+
+class TextBlock(models.Model):
+    """One chunk of a book's original text and its simplification, placed on a page"""
+    book = models.ForeignKey(Book, related_name='blocks', on_delete=models.CASCADE)
+    page = models.ForeignKey(Page, related_name='blocks', on_delete=models.CASCADE)
+    position = models.IntegerField()
+    digest = models.CharField(max_length=64)
+    simplified = CompressedTextField()
+
+    class Meta:
+        ordering = ['position']
+        unique_together = ['book', 'position']
+
+    def __str__(self):
+        return f"Block {self.position} of book {self.book_id}"
+
+class CompressionDictionary(models.Model):
+    """A dictionary trained on stored texts; compressed values refer to it by id"""
+    codec = models.PositiveSmallIntegerField()
+    data = models.BinaryField()
+    sample_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Compression dictionary {self.id} ({len(self.data)} bytes)"
+
+class CachedResult(models.Model):
+    key = models.CharField(max_length=64, unique=True)
+    operation = models.CharField(max_length=20)
+    value = models.TextField()
+    phash = models.CharField(max_length=64, blank=True, default='')
+    # Only results stored for this user are offered as near matches
+    user_id = models.CharField(max_length=100, blank=True, default='')
+    created_at = models.DateTimeField(default=timezone.now)
+    last_accessed = models.DateTimeField(default=timezone.now, db_index=True)
+    hits = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.operation} result {self.key[:12]}"
+
+
+class ImageHashBand(models.Model):
+    """One slice of a cached result's perceptual hash, indexed to find near matches"""
+    result = models.ForeignKey(CachedResult, related_name='bands', on_delete=models.CASCADE)
+    user_id = models.CharField(max_length=100)
+    band = models.PositiveSmallIntegerField()
+    value = models.CharField(max_length=16)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['band', 'value', 'user_id']),
+        ]
+
+    def __str__(self):
+        return f"Band {self.band} of {self.result_id}"
+
+
+class SharedCounter(models.Model):
+    """A rate limit or token counter shared by every worker process"""
+    key = models.CharField(max_length=200, unique=True)
+    value = models.BigIntegerField(default=0)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.key} = {self.value}"
+
+
+class Job(models.Model):
+    PROCESS_TEXT = 'process_text'
+    ADD_PAGE = 'add_page'
+    UPLOAD_IMAGE = 'upload_image'
+    KIND_CHOICES = [
+        (PROCESS_TEXT, 'Process text'),
+        (ADD_PAGE, 'Add page'),
+        (UPLOAD_IMAGE, 'Upload image'),
+    ]
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    user_id = models.CharField(max_length=100)
+    book = models.ForeignKey(Book, related_name='jobs', null=True, blank=True, on_delete=models.CASCADE)
+    # A failed job deletes its placeholder page but keeps its error
+    page = models.ForeignKey(Page, related_name='jobs', null=True, blank=True, on_delete=models.SET_NULL)
+    text = models.TextField(blank=True)
+    attachment = models.BinaryField(null=True, blank=True)
+    result = models.TextField(blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+
+    @property
+    def is_finished(self):
+        return self.status in (self.DONE, self.FAILED)
+
+    def __str__(self):
+        return f"{self.kind} job {self.id} ({self.status})"
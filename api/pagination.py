@@ -0,0 +1,10 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class BookCursorPagination(CursorPagination):
+    """Cursor pagination over the (user_id, -last_edited) index"""
+    ordering = '-last_edited'
+    page_size = settings.BOOK_LIST_PAGE_SIZE
+    page_size_query_param = 'limit'
+    max_page_size = settings.BOOK_LIST_MAX_PAGE_SIZE
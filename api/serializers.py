@@ -1,23 +1,50 @@
 from rest_framework import serializers
 from .models import Book, Page
 
+class DynamicFieldsMixin:
+    """
+    Keep only the fields named in the optional `fields` argument.
+
+    Without it, serializers that only read fall back to their default_fields;
+    serializers given data keep every field so any of them can be written.
+    """
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is None and 'data' not in kwargs:
+            fields = getattr(self, 'default_fields', None)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
 class PageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Page
         fields = ['id', 'page_number', 'content', 'created_at']
 
-class BookSerializer(serializers.ModelSerializer):
+class BookSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     pages = PageSerializer(many=True, read_only=True)
-    
+
+    # The original text is the largest column and most clients never show
+    # it, so it is only loaded and returned when asked for
+    default_fields = ['id', 'title', 'created_at', 'last_edited',
+                      'is_processed', 'total_pages', 'pages']
+    # Fields added to the defaults with `include=<name>`
+    includes = {'original': 'original_text'}
+
     class Meta:
         model = Book
         fields = ['id', 'title', 'original_text', 'created_at', 'last_edited',
                   'is_processed', 'total_pages', 'pages']
-        
-    def to_representation(self, instance):
-        representation = super().to_representation(instance)
-        representation['pages'] = sorted(
-            representation['pages'],
-            key=lambda x: x['page_number']
-        )
-        return representation
\ No newline at end of file
+
+class BookSummarySerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    excerpt = serializers.CharField(read_only=True)
+
+    # Fields returned when the client does not ask for specific ones
+    default_fields = ['id', 'title', 'total_pages', 'last_edited']
+
+    class Meta:
+        model = Book
+        fields = ['id', 'title', 'created_at', 'last_edited', 'is_processed',
+                  'total_pages', 'excerpt']
@@ -1,25 +1,156 @@
 """
 AI Service provider for text processing and image analysis.
 Supports both Claude and Gemini AI models through environment-based configuration.
+When both are configured, requests are routed between them per operation.
+Methods prefixed with `a` are the async counterparts used by async views.
 """
 
-import anthropic
-import google.generativeai as genai
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.db import close_old_connections
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import contextvars
 import re
-import base64
+import hashlib
+from .cache import ImageResultCache, ResultCache
+from .chunking import split_text
+from .images import perceptual_hash
+from .providers import ClaudeProvider, GeminiProvider, StubProvider
+from .routing import ProviderBusy, Router
+from . import usage
+
+# Bump whenever a prompt below changes so cached results are not reused.
+PROMPT_VERSION = '1'
+
+SIMPLIFY_PROMPT = """Simplify this text to make it easier to understand. Replace hard or complicated words with simple easy to understand words. Use clear, simple language while keeping the important information without removing anything or adding extra things. Just modify the sentences in easy to understand format and do not remove any sentence. Make it more readable but maintain the key points. If the text is too short or doesn't make sense, say it's not a correct word, do not make up a sentence. If the input is in another language, translate it to English without modifying the context and meaning, the output should be grammatically correct, and then simplify, do not add any prefixes such as [TextBlock(text= and any other prefixes:
+
+            {text}"""
+
+TITLE_PROMPT = """Generate a short, descriptive title (2-4 words) for this text. The title should be concise but meaningful. Just return the title directly without any explanation or prefix:
+
+            {text}"""
+
+OCR_PROMPT = "Extract the text from this image without any formatting or prefixes."
+
+OCR_BATCH_PROMPT = """Extract the text from each of the {count} images below without any formatting or prefixes. For every image, write a line "=== IMAGE <number> ===" followed by the text of that image, in the same order as the images."""
+
+OCR_BATCH_MARKER = re.compile(r'^\s*=== IMAGE (\d+) ===\s*$', re.MULTILINE)
+
+def configured_providers():
+    """Build a backend for every provider with credentials, in preference order"""
+    providers = []
+    if settings.AI_STUB_PROVIDER:
+        providers.append(StubProvider(latency=settings.AI_STUB_LATENCY))
+    if settings.GEMINI_API_KEY:
+        providers.append(GeminiProvider(settings.GEMINI_API_KEY))
+    if settings.ANTHROPIC_API_KEY or not providers:
+        providers.append(ClaudeProvider(settings.ANTHROPIC_API_KEY))
+    return providers
 
 class AIServiceProvider:
 
-    def __init__(self):
-        """Initialize the AI service with the configured provider"""
-        self.provider = 'gemini' if settings.GEMINI_API_KEY else 'claude'
-        if self.provider == 'gemini':
-            genai.configure(api_key=settings.GEMINI_API_KEY)
-            self.model = genai.GenerativeModel('gemini-1.5-flash')
-            self.vision_model = genai.GenerativeModel('gemini-1.5-flash')
-        else:
-            self.client = anthropic.Client(api_key=settings.ANTHROPIC_API_KEY)
+    def __init__(self, providers=None, routes=None):
+        """
+        Initialize the AI service.
+
+        Args:
+            providers (list): Provider backends in preference order; defaults
+                to every provider configured in settings
+            routes (dict): Operation to provider names; defaults to AI_ROUTES
+        """
+        self.router = Router(
+            providers if providers is not None else configured_providers(),
+            routes if routes is not None else settings.AI_ROUTES
+        )
+        # Named in error messages; cache keys use each operation's route
+        primary = self.router.providers[self.router.default_order[0]]
+        self.provider = primary.name
+        self.model_name = primary.model_name
+        self.cache = ResultCache() if settings.AI_CACHE_ENABLED else None
+        self.image_cache = ImageResultCache() if settings.AI_CACHE_ENABLED else None
+        self.executor = ThreadPoolExecutor(
+            max_workers=settings.AI_MAX_WORKERS,
+            thread_name_prefix='ai-service'
+        )
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Run fn on the shared, bounded worker pool.
+
+        Database connections opened by the worker thread are released when
+        they expire, the same way Django does at the end of a request. fn
+        runs in a copy of the caller's context, so its provider calls are
+        charged to the caller's user.
+
+        Returns:
+            concurrent.futures.Future: Future for the result of fn
+        """
+        def run():
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                close_old_connections()
+
+        return self.executor.submit(contextvars.copy_context().run, run)
+
+    def cache_key(self, operation, text):
+        """
+        Cache key for operation on text.
+
+        Any provider routed for the operation may have produced a result,
+        so the key names all of them and their models. A result is reused
+        only while the same providers are routed, whichever one answered.
+        """
+        names = self.router.route(operation)
+        return ResultCache.make_key(
+            ','.join(names),
+            ','.join(self.router.providers[name].model_name for name in names),
+            PROMPT_VERSION, operation, text
+        )
+
+    def cached(self, operation, text, compute):
+        """
+        Return the cached result for text, computing and storing it on a miss.
+
+        Args:
+            operation (str): Name of the operation, part of the cache key
+            text (str): Input text
+            compute (callable): Produces the result on a cache miss
+
+        Returns:
+            str: Cached or freshly computed result
+        """
+        if self.cache is None:
+            return compute()
+        key = self.cache_key(operation, text)
+        result = self.cache.get(key)
+        if result is None:
+            result = compute()
+            self.cache.set(key, operation, result)
+        return result
+
+    def peek(self, operation, text):
+        """Return the cached result for text without computing it, or None"""
+        if self.cache is None:
+            return None
+        return self.cache.get(self.cache_key(operation, text))
+
+    async def acached(self, operation, text, compute):
+        """
+        Async counterpart of cached().
+
+        Args:
+            compute (callable): Returns an awaitable for the result on a cache miss
+        """
+        if self.cache is None:
+            return await compute()
+        key = self.cache_key(operation, text)
+        result = await sync_to_async(self.cache.get)(key)
+        if result is None:
+            result = await compute()
+            await sync_to_async(self.cache.set)(key, operation, result)
+        return result
 
     def clean_response(self, response):
         """Clean response text from any TextBlock prefixes/suffixes"""
@@ -31,12 +162,17 @@ class AIServiceProvider:
         text = text.replace('\\n', '\n').strip()
         return text
 
-    def extract_text_from_image(self, image_data):
+    def extract_text_from_image(self, image, media_type='image/jpeg'):
         """
         Extract text from image using selected AI provider.
+
+        The image is base64 encoded only for providers that need it.
+        Results are cached by image content, and near-identical images the
+        same user uploaded before are matched by perceptual hash.
         
         Args:
-            image_data (str): Base64 encoded image data
+            image (bytes): Image data
+            media_type (str): MIME type of the image
             
         Returns:
             str: Extracted text from the image
@@ -45,44 +181,192 @@ class AIServiceProvider:
             Exception: If there's an error in API processing
         """
         try:
-            if self.provider == 'gemini':
-                image_bytes = base64.b64decode(image_data)
-                response = self.vision_model.generate_content(
-                    ["Extract the text from this image without any formatting or prefixes.",
-                     {"mime_type": "image/jpeg", "data": image_bytes}]
-                )
-                return self.clean_response(response.text)
-            else:
-                message = self.client.messages.create(
-                    model="claude-3-sonnet-20240229",
-                    max_tokens=1024,
-                    messages=[{
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": "Extract the text from this image without any formatting or prefixes."
-                            },
-                            {
-                                "type": "image",
-                                "source": {
-                                    "type": "base64",
-                                    "media_type": "image/jpeg",
-                                    "data": image_data
-                                }
-                            }
-                        ]
-                    }]
-                )
-                return str(message.content).strip()
+            if self.image_cache is None:
+                return self._extract_one(image, media_type)
+            key, phash = self._image_key(image)
+            user_id = usage.current_user()
+            result = self.image_cache.get_similar(key, phash, user_id)
+            if result is None:
+                result = self._extract_one(image, media_type)
+                self.image_cache.set(key, 'ocr', result, phash=phash, user_id=user_id or '')
+            return result
 
         except Exception as e:
             print(f"Error with {self.provider} API: {str(e)}")
             raise
 
+    async def aextract_text_from_image(self, image, media_type='image/jpeg'):
+        """
+        Async counterpart of extract_text_from_image().
+
+        Hashing the image runs in a worker thread so it does not block the
+        event loop.
+        """
+        try:
+            if self.image_cache is None:
+                return await self._aextract_one(image, media_type)
+            key, phash = await sync_to_async(self._image_key, thread_sensitive=False)(image)
+            user_id = usage.current_user()
+            result = await sync_to_async(self.image_cache.get_similar)(key, phash, user_id)
+            if result is None:
+                result = await self._aextract_one(image, media_type)
+                await sync_to_async(self.image_cache.set)(key, 'ocr', result, phash=phash, user_id=user_id or '')
+            return result
+
+        except Exception as e:
+            print(f"Error with {self.provider} API: {str(e)}")
+            raise
+
+    def extract_text_from_images(self, images):
+        """
+        Extract text from several images with as few provider calls as possible.
+
+        Cached images are answered from the cache. The rest are sent in
+        groups of up to OCR_BATCH_SIZE images per request, and the groups
+        run in parallel on the worker pool.
+
+        Args:
+            images (list): (image bytes, media type) pairs
+
+        Returns:
+            list: Extracted text for each image, in order
+
+        Raises:
+            Exception: If there's an error in API processing
+        """
+        results = [None] * len(images)
+        keys = [None] * len(images)
+        user_id = usage.current_user()
+        if self.image_cache is not None:
+            for index, (image, _) in enumerate(images):
+                keys[index] = self._image_key(image)
+                results[index] = self.image_cache.get_similar(*keys[index], user_id)
+
+        pending = [index for index, result in enumerate(results) if result is None]
+        size = max(settings.OCR_BATCH_SIZE, 1)
+        batches = [pending[start:start + size] for start in range(0, len(pending), size)]
+        try:
+            extracted = self.map(
+                lambda batch: self._extract_batch([images[index] for index in batch]),
+                batches
+            )
+        except Exception as e:
+            print(f"Error with {self.provider} API: {str(e)}")
+            raise
+
+        for batch, texts in zip(batches, extracted):
+            for index, text in zip(batch, texts):
+                results[index] = text
+                if self.image_cache is not None:
+                    key, phash = keys[index]
+                    self.image_cache.set(key, 'ocr', text, phash=phash, user_id=user_id or '')
+        return results
+
+    def _image_key(self, image):
+        """Return the (cache key, perceptual hash) pair for an image"""
+        return self.cache_key('ocr', hashlib.sha256(image).hexdigest()), perceptual_hash(image)
+
+    def _extract_one(self, image, media_type):
+        """Extract text from a single image in one provider request"""
+        text = self.router.call('ocr', lambda provider: provider.read_images(
+            [OCR_PROMPT, (image, media_type)], 1024, settings.AI_OCR_TIMEOUT
+        ))
+        return self.clean_response(text)
+
+    async def _aextract_one(self, image, media_type):
+        text = await self.router.acall('ocr', lambda provider: provider.aread_images(
+            [OCR_PROMPT, (image, media_type)], 1024, settings.AI_OCR_TIMEOUT
+        ))
+        return self.clean_response(text)
+
+    def _extract_batch(self, images):
+        """
+        Extract text from several images in one provider request.
+
+        Falls back to one request per image when the response cannot be
+        split into exactly one section per image.
+        """
+        if len(images) == 1:
+            return [self._extract_one(*images[0])]
+
+        content = [OCR_BATCH_PROMPT.format(count=len(images))]
+        for number, image in enumerate(images, start=1):
+            content += [f"Image {number}:", image]
+        text = self.router.call('ocr', lambda provider: provider.read_images(
+            content, min(1024 * len(images), 4096), settings.AI_OCR_TIMEOUT * len(images)
+        ))
+
+        sections = OCR_BATCH_MARKER.split(text)
+        numbers = [int(number) for number in sections[1::2]]
+        if numbers != list(range(1, len(images) + 1)):
+            return [self._extract_one(image, media_type) for image, media_type in images]
+        return [self.clean_response(section) for section in sections[2::2]]
+
+    def map(self, fn, items):
+        """
+        Apply fn to every item on the worker pool.
+
+        Must not be called from inside a pool task, as nested submissions
+        can exhaust the pool.
+
+        Returns:
+            list: Results in the same order as items
+        """
+        futures = [self.submit(fn, item) for item in items]
+        return [future.result() for future in futures]
+
+    def simplify_chunks(self, text):
+        """
+        Simplify text chunk by chunk.
+
+        Long inputs are split on paragraph and sentence boundaries into
+        chunks of at most AI_CHUNK_TOKENS, which are simplified in parallel.
+
+        Args:
+            text (str): Text to simplify
+
+        Returns:
+            list: Simplified chunks in their original order
+        """
+        chunks = split_text(text, settings.AI_CHUNK_TOKENS)
+        if len(chunks) == 1:
+            return [self.simplify_chunk(chunks[0])]
+        return self.map(self.simplify_chunk, chunks)
+
+    async def asimplify_chunks(self, text):
+        """
+        Async counterpart of simplify_chunks().
+
+        At most AI_MAX_WORKERS chunks are simplified at a time, as with the
+        thread pool, so one long text cannot flood the provider.
+        """
+        chunks = split_text(text, settings.AI_CHUNK_TOKENS)
+        slots = asyncio.Semaphore(max(settings.AI_MAX_WORKERS, 1))
+
+        async def simplify(chunk):
+            async with slots:
+                return await self.asimplify_chunk(chunk)
+
+        return list(await asyncio.gather(*(simplify(chunk) for chunk in chunks)))
+
     def simplify_text(self, text):
         """
-        Simplify text using selected AI provider.
+        Simplify text of any length using selected AI provider.
+
+        Args:
+            text (str): Text to simplify
+
+        Returns:
+            str: Simplified text
+
+        Raises:
+            Exception: If there's an error in API processing
+        """
+        return '\n\n'.join(self.simplify_chunks(text))
+
+    def simplify_chunk(self, text):
+        """
+        Simplify text in a single request to the selected AI provider.
         
         Args:
             text (str): Text to simplify
@@ -94,25 +378,85 @@ class AIServiceProvider:
             Exception: If there's an error in API processing
         """
         try:
-            prompt = """Simplify this text to make it easier to understand. Replace hard or complicated words with simple easy to understand words. Use clear, simple language while keeping the important information without removing anything or adding extra things. Just modify the sentences in easy to understand format and do not remove any sentence. Make it more readable but maintain the key points. If the text is too short or doesn't make sense, say it's not a correct word, do not make up a sentence. If the input is in another language, translate it to English without modifying the context and meaning, the output should be grammatically correct, and then simplify, do not add any prefixes such as [TextBlock(text= and any other prefixes:
+            def compute():
+                result = self.router.call('simplify', lambda provider: provider.complete(
+                    SIMPLIFY_PROMPT.format(text=text), 1024, settings.AI_SIMPLIFY_TIMEOUT
+                ))
+                return self.clean_response(result)
 
-            {text}"""
+            return self.cached('simplify', text, compute)
 
-            if self.provider == 'gemini':
-                response = self.model.generate_content(prompt.format(text=text))
-                return self.clean_response(response.text)
-            else:
-                message = self.client.messages.create(
-                    model="claude-3-sonnet-20240229",
-                    max_tokens=1024,
-                    messages=[{"role": "user", "content": prompt.format(text=text)}]
-                )
-                return str(message.content).strip()
+        except Exception as e:
+            print(f"Error with {self.provider} API: {str(e)}")
+            raise
+
+    async def asimplify_chunk(self, text):
+        """Async counterpart of simplify_chunk()"""
+        try:
+            async def compute():
+                result = await self.router.acall('simplify', lambda provider: provider.acomplete(
+                    SIMPLIFY_PROMPT.format(text=text), 1024, settings.AI_SIMPLIFY_TIMEOUT
+                ))
+                return self.clean_response(result)
+
+            return await self.acached('simplify', text, compute)
 
         except Exception as e:
             print(f"Error with {self.provider} API: {str(e)}")
             raise
 
+    def stream_simplify_text(self, text, outputs=None):
+        """
+        Simplify text, yielding the output as the provider produces it.
+
+        Chunks are streamed one after another so output stays in order.
+        Chunks already in the cache are yielded in one piece, and each
+        streamed chunk is cleaned and cached once it completes.
+
+        Args:
+            text (str): Text to simplify
+            outputs (list): If given, the simplified text of each chunk is
+                appended to it as the chunk completes
+
+        Yields:
+            str: Pieces of simplified text
+
+        Raises:
+            Exception: If there's an error in API processing
+        """
+        for index, chunk in enumerate(split_text(text, settings.AI_CHUNK_TOKENS)):
+            if index:
+                yield '\n\n'
+            key = None
+            if self.cache is not None:
+                key = self.cache_key('simplify', chunk)
+                cached = self.cache.get(key)
+                if cached is not None:
+                    if outputs is not None:
+                        outputs.append(cached)
+                    yield cached
+                    continue
+
+            parts = []
+            try:
+                for part in self._stream(SIMPLIFY_PROMPT.format(text=chunk), max_tokens=1024):
+                    parts.append(part)
+                    yield part
+            except Exception as e:
+                print(f"Error with {self.provider} API: {str(e)}")
+                raise
+            output = self.clean_response(''.join(parts))
+            if outputs is not None:
+                outputs.append(output)
+            if key is not None:
+                self.cache.set(key, 'simplify', output)
+
+    def _stream(self, prompt, max_tokens):
+        """Yield text deltas for prompt from the provider's streaming API"""
+        return self.router.stream('simplify', lambda provider: provider.stream(
+            prompt, max_tokens, settings.AI_SIMPLIFY_TIMEOUT
+        ))
+
     def suggest_title(self, text):
         """
         Generate title suggestion using selected AI provider.
@@ -127,36 +471,110 @@ class AIServiceProvider:
             Exception: If there's an error in API processing
         """
         try:
-            prompt = """Generate a short, descriptive title (2-4 words) for this text. The title should be concise but meaningful. Just return the title directly without any explanation or prefix:
+            def compute():
+                result = self.router.call('title', lambda provider: provider.complete(
+                    TITLE_PROMPT.format(text=text), 50, settings.AI_TITLE_TIMEOUT
+                ))
+                return self.clean_response(result) or "Untitled Book"
 
-            {text}"""
+            return self.cached('title', text, compute)
 
-            if self.provider == 'gemini':
-                response = self.model.generate_content(prompt.format(text=text))
-                return self.clean_response(response.text)
-            else:
-                message = self.client.messages.create(
-                    model="claude-3-sonnet-20240229",
-                    max_tokens=50,
-                    messages=[{"role": "user", "content": prompt.format(text=text)}]
-                )
-                return str(message.content).strip() or "Untitled Book"
+        except Exception as e:
+            print(f"Error generating title: {str(e)}")
+            return "Untitled Book"
+
+    async def asuggest_title(self, text):
+        """Async counterpart of suggest_title()"""
+        try:
+            async def compute():
+                result = await self.router.acall('title', lambda provider: provider.acomplete(
+                    TITLE_PROMPT.format(text=text), 50, settings.AI_TITLE_TIMEOUT
+                ))
+                return self.clean_response(result) or "Untitled Book"
+
+            return await self.acached('title', text, compute)
 
         except Exception as e:
             print(f"Error generating title: {str(e)}")
             return "Untitled Book"
 
+    def submit_title(self, text):
+        """
+        Start generating a title for text on the worker pool.
+
+        Only the first chunk is sent, which is enough for a 2-4 word title.
+
+        Returns:
+            concurrent.futures.Future: Future for the title
+        """
+        opening = split_text(text, settings.AI_CHUNK_TOKENS)[0]
+        return self.submit(self.suggest_title, opening)
+
+    def simplify_and_title(self, text):
+        """
+        Simplify text and generate its title concurrently.
+
+        The title is requested on the worker pool while the simplification
+        runs on the calling thread, so the two provider round-trips overlap.
+
+        Args:
+            text (str): Text to process
+
+        Returns:
+            tuple: (simplified text of each chunk, as from simplify_chunks, title)
+
+        Raises:
+            Exception: If simplification fails; title failures fall back to
+                "Untitled Book"
+        """
+        title_future = self.submit_title(text)
+        chunks = self.simplify_chunks(text)
+        return chunks, title_future.result()
+
+    async def asimplify_and_title(self, text):
+        """Async counterpart of simplify_and_title()"""
+        opening = split_text(text, settings.AI_CHUNK_TOKENS)[0]
+        chunks, title = await asyncio.gather(self.asimplify_chunks(text), self.asuggest_title(opening))
+        return chunks, title
 
 ai_service = AIServiceProvider()
 
-def extract_text_from_image(image_data):
+def extract_text_from_image(image, media_type='image/jpeg'):
     """Wrapper function for extract_text_from_image"""
-    return ai_service.extract_text_from_image(image_data)
+    return ai_service.extract_text_from_image(image, media_type)
+
+async def aextract_text_from_image(image, media_type='image/jpeg'):
+    """Wrapper function for aextract_text_from_image"""
+    return await ai_service.aextract_text_from_image(image, media_type)
+
+def extract_text_from_images(images):
+    """Wrapper function for extract_text_from_images"""
+    return ai_service.extract_text_from_images(images)
 
 def simplify_text(text):
     """Wrapper function for simplify_text"""
     return ai_service.simplify_text(text)
 
+def simplify_chunks(text):
+    """Wrapper function for simplify_chunks"""
+    return ai_service.simplify_chunks(text)
+
+async def asimplify_chunks(text):
+    """Wrapper function for asimplify_chunks"""
+    return await ai_service.asimplify_chunks(text)
+
+def stream_simplify_text(text, outputs=None):
+    """Wrapper function for stream_simplify_text"""
+    return ai_service.stream_simplify_text(text, outputs)
+
 def suggest_title(text):
     """Wrapper function for suggest_title"""
     return ai_service.suggest_title(text)
+
+def simplify_and_title(text):
+    """Wrapper function for simplify_and_title"""
+    return ai_service.simplify_and_title(text)
+
+async def asimplify_and_title(text):
+    """Wrapper function for asimplify_and_title"""
+    return await ai_service.asimplify_and_title(text)
@@ -0,0 +1,91 @@
+"""
+Read-through cache for serialized book payloads.
+
+Payloads live in the `books` cache alias. Each key combines the scope (one
+book or one user's library), the scope's current generation token, the
+book version the view already looked up for its ETag, and the request
+path. Writes replace the generation token, which orphans every cached
+variant of the scope at once; orphans age out after BOOK_CACHE_TTL. The
+version part keeps processes with their own local cache from serving
+stale payloads after a write made elsewhere.
+"""
+
+import hashlib
+import logging
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+CACHE_ALIAS = 'books'
+
+
+def book_scope(book_id):
+    return f'book:{book_id}'
+
+
+def user_scope(user_id):
+    return f'user:{user_id}'
+
+
+def _key(*parts):
+    digest = hashlib.sha256('\0'.join(str(part) for part in parts).encode('utf-8'))
+    return f'books:{digest.hexdigest()}'
+
+
+def _generation(cache, scope):
+    key = _key('generation', scope)
+    token = cache.get(key)
+    if token is None:
+        cache.add(key, uuid4().hex, None)
+        token = cache.get(key)
+    return token
+
+
+def read_through(scope, version, variant, build):
+    """
+    Return the cached payload for a read, building and storing it on a miss.
+
+    Args:
+        scope (str): book_scope() or user_scope() of the data read
+        version: Value that changes whenever the scope's rows change
+        variant (str): Distinguishes representations of the same data,
+            e.g. the request path with its query string
+        build (callable): Produces the payload on a miss
+
+    Returns:
+        Cached or freshly built payload
+    """
+    if settings.BOOK_CACHE_TTL <= 0 or version is None:
+        return build()
+    cache = caches[CACHE_ALIAS]
+    try:
+        key = _key(scope, _generation(cache, scope), repr(version), variant)
+        payload = cache.get(key)
+    except Exception as e:
+        logger.error(f"Error reading book cache: {str(e)}")
+        return build()
+    if payload is None:
+        payload = build()
+        try:
+            cache.set(key, payload, settings.BOOK_CACHE_TTL)
+        except Exception as e:
+            logger.error(f"Error writing book cache: {str(e)}")
+    return payload
+
+
+def invalidate(book_id=None, user_id=None):
+    """Drop every cached payload for a book and for its owner's library"""
+    tokens = {}
+    if book_id is not None:
+        tokens[_key('generation', book_scope(book_id))] = uuid4().hex
+    if user_id is not None:
+        tokens[_key('generation', user_scope(user_id))] = uuid4().hex
+    if not tokens:
+        return
+    try:
+        caches[CACHE_ALIAS].set_many(tokens, None)
+    except Exception as e:
+        logger.error(f"Error invalidating book cache: {str(e)}")
@@ -0,0 +1,79 @@
+"""
+Simplify many texts and images for a single bulk import.
+
+Images are prepared and read in parallel first. Every text is then split into chunks and
+the chunks of all items are simplified in one flat pass over the AI worker
+pool, so an import keeps the pool busy without nesting submissions.
+Failures are recorded per item and never abort the other items.
+"""
+
+import logging
+
+from django.conf import settings
+
+from .ai_service import ai_service
+from .chunking import split_text
+from .images import prepare_image
+
+logger = logging.getLogger(__name__)
+
+
+def simplify_items(items, with_title=False):
+    """
+    Simplify import items with bounded parallelism.
+
+    Args:
+        items (list): Dicts holding either 'text' or 'image' (an uploaded
+            file, read on the worker pool)
+        with_title (bool): Also suggest a title from the first usable item
+
+    Returns:
+        tuple: (list of (text, content, error) triples in input order,
+            title or None). text is the input or extracted text.
+    """
+    texts = [item.get('text') for item in items]
+    errors = [None] * len(items)
+
+    extractions = {
+        index: ai_service.submit(_extract_text, item['image'])
+        for index, item in enumerate(items) if 'image' in item
+    }
+    for index, future in extractions.items():
+        try:
+            texts[index] = future.result()
+        except Exception as e:
+            logger.error(f"Error extracting text for import item {index}: {str(e)}")
+            errors[index] = str(e)
+
+    usable = [index for index in range(len(items)) if errors[index] is None]
+    title_future = None
+    if with_title and usable:
+        title_future = ai_service.submit_title(texts[usable[0]])
+
+    chunk_futures = {
+        index: [
+            ai_service.submit(ai_service.simplify_chunk, chunk)
+            for chunk in split_text(texts[index], settings.AI_CHUNK_TOKENS)
+        ]
+        for index in usable
+    }
+
+    results = []
+    for index in range(len(items)):
+        if errors[index] is not None:
+            results.append((texts[index], None, errors[index]))
+            continue
+        try:
+            chunks = [future.result() for future in chunk_futures[index]]
+            results.append((texts[index], '\n\n'.join(chunks), None))
+        except Exception as e:
+            logger.error(f"Error simplifying import item {index}: {str(e)}")
+            results.append((texts[index], None, str(e)))
+
+    title = title_future.result() if title_future is not None else None
+    return results, title
+
+
+def _extract_text(upload):
+    image, media_type = prepare_image(upload)
+    return ai_service.extract_text_from_image(image, media_type)
@@ -0,0 +1,258 @@
+"""
+Content-addressed cache for AI results.
+
+Results are keyed by a SHA-256 of the provider, model, prompt version,
+operation and input text. Lookups go through a small in-process LRU first
+and fall back to the CachedResult table, which is shared by every worker.
+ImageResultCache additionally matches near-identical images by a
+perceptual hash stored next to each result, among the results stored for
+the same user. The hash is also stored in bands (ImageHashBand) so near
+matches are found through an index rather than by comparing every row.
+"""
+
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DatabaseError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from ..models import CachedResult, ImageHashBand
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+
+    # Operations whose rows count towards max_entries; None means all
+    operations = ('simplify', 'title')
+
+    def __init__(self, memory_entries=None, max_entries=None, ttl=None):
+        """Initialize the cache with limits taken from settings by default"""
+        self.memory_entries = memory_entries if memory_entries is not None else settings.AI_CACHE_MEMORY_ENTRIES
+        self.max_entries = max_entries if max_entries is not None else settings.AI_CACHE_MAX_ENTRIES
+        self.ttl = ttl if ttl is not None else settings.AI_CACHE_TTL
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {'memory_hits': 0, 'db_hits': 0, 'misses': 0, 'writes': 0}
+
+    @staticmethod
+    def make_key(provider, model, prompt_version, operation, text):
+        """Build the content hash used as cache key"""
+        digest = hashlib.sha256()
+        for part in (provider, model, prompt_version, operation):
+            digest.update(str(part).encode('utf-8'))
+            digest.update(b'\0')
+        digest.update(text.encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        Look up a cached result.
+
+        Args:
+            key (str): Key built with make_key
+
+        Returns:
+            str: Cached result, or None on a miss
+        """
+        value, tier = self._lookup(key)
+        self._count(f'{tier}_hits' if value is not None else 'misses')
+        return value
+
+    def _lookup(self, key):
+        """Return (value, tier) for key without touching the counters"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._memory.move_to_end(key)
+                    return value, 'memory'
+                del self._memory[key]
+
+        try:
+            entry = CachedResult.objects.filter(
+                key=key,
+                created_at__gte=timezone.now() - timedelta(seconds=self.ttl)
+            ).values_list('value', 'created_at').first()
+            if entry is not None:
+                CachedResult.objects.filter(key=key).update(
+                    last_accessed=timezone.now(),
+                    hits=F('hits') + 1
+                )
+        except DatabaseError as e:
+            logger.error(f"Error reading AI result cache: {str(e)}")
+            entry = None
+
+        if entry is None:
+            return None, None
+
+        value, created_at = entry
+        age = (timezone.now() - created_at).total_seconds()
+        self._remember(key, value, self.ttl - age)
+        return value, 'db'
+
+    def set(self, key, operation, value, **fields):
+        """
+        Store a result in both tiers and evict old entries.
+
+        Args:
+            fields: Further CachedResult columns to store, such as phash
+        """
+        self._remember(key, value, self.ttl)
+        try:
+            with transaction.atomic():
+                row, _ = CachedResult.objects.update_or_create(
+                    key=key,
+                    defaults={
+                        'operation': operation,
+                        'value': value,
+                        'created_at': timezone.now(),
+                        'last_accessed': timezone.now(),
+                        **fields,
+                    }
+                )
+                self._stored(row)
+            self._count('writes')
+            self._evict()
+        except DatabaseError as e:
+            logger.error(f"Error writing AI result cache: {str(e)}")
+
+    def stats(self):
+        """Return hit/miss counters for this process"""
+        with self._lock:
+            counters = dict(self._counters)
+            counters['memory_entries'] = len(self._memory)
+        hits = sum(count for name, count in counters.items() if name.endswith('_hits'))
+        lookups = hits + counters['misses']
+        counters['hit_rate'] = round(hits / lookups, 4) if lookups else 0.0
+        return counters
+
+    def clear(self):
+        """Drop the in-process tier"""
+        with self._lock:
+            self._memory.clear()
+
+    def _remember(self, key, value, ttl):
+        if self.memory_entries <= 0 or ttl <= 0:
+            return
+        with self._lock:
+            self._memory[key] = (value, time.monotonic() + ttl)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _stored(self, row):
+        """Called with each row written, inside the write's transaction"""
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _rows(self):
+        rows = CachedResult.objects.all()
+        if self.operations is not None:
+            rows = rows.filter(operation__in=self.operations)
+        return rows
+
+    def _evict(self):
+        """Remove expired rows, then least recently used rows over the limit"""
+        self._rows().filter(
+            created_at__lt=timezone.now() - timedelta(seconds=self.ttl)
+        ).delete()
+        excess = self._rows().count() - self.max_entries
+        if excess > 0:
+            stale = self._rows().order_by('last_accessed').values_list('id', flat=True)[:excess]
+            CachedResult.objects.filter(id__in=list(stale)).delete()
+
+
+class ImageResultCache(ResultCache):
+
+    operations = ('ocr',)
+
+    # Hashes are split into this many bands. Hashes that differ in fewer
+    # bits than there are bands agree on at least one whole band, so
+    # looking up the bands finds every match within max_distance.
+    bands = 8
+
+    def __init__(self, memory_entries=None, max_entries=None, ttl=None, max_distance=None):
+        """Initialize the cache with image limits taken from settings by default"""
+        super().__init__(
+            memory_entries=memory_entries,
+            max_entries=max_entries if max_entries is not None else settings.IMAGE_CACHE_MAX_ENTRIES,
+            ttl=ttl
+        )
+        self.max_distance = max_distance if max_distance is not None else settings.IMAGE_CACHE_MAX_DISTANCE
+        if self.max_distance >= self.bands:
+            raise ImproperlyConfigured(f"IMAGE_CACHE_MAX_DISTANCE must be below {self.bands}")
+        self._counters['similar_hits'] = 0
+
+    def get_similar(self, key, phash, user_id=None):
+        """
+        Look up a result by exact key, then by perceptual hash.
+
+        Args:
+            key (str): Key built with make_key from the image content
+            phash (str): Perceptual hash of the image as hex
+            user_id (str): User whose earlier images may be matched by
+                hash; without one only the exact key is looked up
+
+        Returns:
+            str: Cached result, or None on a miss
+        """
+        value, tier = self._lookup(key)
+        if value is None and phash and user_id and self.max_distance > 0:
+            value = self._closest(phash, user_id)
+            if value is not None:
+                tier = 'similar'
+                self._remember(key, value, self.ttl)
+        self._count(f'{tier}_hits' if value is not None else 'misses')
+        return value
+
+    def split(self, phash):
+        """The hash's bands as (band, value) pairs"""
+        width = -(-len(phash) // self.bands)
+        return [(band, phash[band * width:(band + 1) * width]) for band in range(self.bands)]
+
+    def _stored(self, row):
+        ImageHashBand.objects.filter(result=row).delete()
+        if row.phash and row.user_id and self.max_distance > 0:
+            ImageHashBand.objects.bulk_create(
+                ImageHashBand(result=row, user_id=row.user_id, band=band, value=value)
+                for band, value in self.split(row.phash)
+            )
+
+    def _closest(self, phash, user_id):
+        """Return the user's stored result whose hash is nearest, within max_distance"""
+        target = int(phash, 16)
+        best_key, best_distance = None, self.max_distance + 1
+        shared_band = Q()
+        for band, value in self.split(phash):
+            shared_band |= Q(band=band, value=value)
+        try:
+            candidates = ImageHashBand.objects.filter(
+                shared_band,
+                user_id=user_id,
+                result__created_at__gte=timezone.now() - timedelta(seconds=self.ttl)
+            ).values_list('result__key', 'result__phash').distinct()
+            for key, other in candidates:
+                distance = (target ^ int(other, 16)).bit_count()
+                if distance < best_distance:
+                    best_key, best_distance = key, distance
+            if best_key is None:
+                return None
+            CachedResult.objects.filter(key=best_key).update(
+                last_accessed=timezone.now(),
+                hits=F('hits') + 1
+            )
+            return CachedResult.objects.filter(key=best_key).values_list('value', flat=True).first()
+        except DatabaseError as e:
+            logger.error(f"Error reading AI image cache: {str(e)}")
+            return None
@@ -0,0 +1,97 @@
+"""
+Split long texts into chunks that fit a provider token budget.
+
+Chunks break on paragraph boundaries where possible, then on sentence
+boundaries, and only split inside a sentence when a single sentence is
+larger than the budget. Token counts are estimated from character length.
+
+Texts over the budget have to be split anyway, so there a chunk also
+ends after any paragraph whose hash picks it as a break point (about one
+in PARAGRAPHS_PER_BREAK). Those breaks depend only on the paragraph
+itself, so editing one paragraph changes the chunks around it but leaves
+the rest of the text chunked, and cached, exactly as before. Texts within
+the budget stay in one chunk.
+"""
+
+import hashlib
+import re
+
+CHARS_PER_TOKEN = 4
+
+PARAGRAPHS_PER_BREAK = 4
+
+PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+SENTENCE_BREAK = re.compile(r'(?<=[.!?])\s+')
+
+
+def estimate_tokens(text):
+    """Rough token count for text"""
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def is_break(paragraph):
+    """Whether a chunk should end after paragraph, decided by its content alone"""
+    digest = hashlib.sha256(paragraph.encode('utf-8')).digest()
+    return int.from_bytes(digest[:4], 'big') % PARAGRAPHS_PER_BREAK == 0
+
+
+def split_text(text, max_tokens):
+    """
+    Split text into chunks of at most max_tokens estimated tokens.
+
+    Args:
+        text (str): Text to split
+        max_tokens (int): Token budget per chunk
+
+    Returns:
+        list: Chunks in their original order
+    """
+    content_breaks = estimate_tokens(text.strip()) > max_tokens
+    units = []
+    for index, paragraph in enumerate(PARAGRAPH_BREAK.split(text.strip())):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if estimate_tokens(paragraph) <= max_tokens:
+            pieces = [paragraph]
+        else:
+            pieces = [
+                piece
+                for sentence in SENTENCE_BREAK.split(paragraph)
+                for piece in _split_words(sentence, max_tokens)
+            ]
+        for number, piece in enumerate(pieces, start=1):
+            units.append((index, piece, content_breaks and number == len(pieces) and is_break(paragraph)))
+
+    chunks = []
+    current = ''
+    current_paragraph = None
+    for paragraph, piece, breaks in units:
+        separator = ' ' if paragraph == current_paragraph else '\n\n'
+        if current and estimate_tokens(current + separator + piece) > max_tokens:
+            chunks.append(current)
+            current = ''
+        current = current + separator + piece if current else piece
+        current_paragraph = paragraph
+        if breaks:
+            chunks.append(current)
+            current = ''
+    if current:
+        chunks.append(current)
+    return chunks or [text]
+
+
+def _split_words(sentence, max_tokens):
+    """Split a single oversized sentence on whitespace"""
+    if estimate_tokens(sentence) <= max_tokens:
+        return [sentence]
+    pieces = []
+    current = ''
+    for word in sentence.split():
+        if current and estimate_tokens(current + ' ' + word) > max_tokens:
+            pieces.append(current)
+            current = ''
+        current = current + ' ' + word if current else word
+    if current:
+        pieces.append(current)
+    return pieces
@@ -0,0 +1,202 @@
+"""
+Compression for large text columns.
+
+Every stored value starts with a five-byte header: the codec (raw UTF-8,
+zlib or zstd) and the id of the CompressionDictionary it was compressed
+with, 0 for none. Values therefore stay readable after TEXT_COMPRESSION or
+the dictionary changes, and old and new rows can be mixed freely.
+
+zlib is always available; zstd needs the optional zstandard package. New
+values use the newest dictionary trained for the configured codec (see the
+train_text_dictionary command), looked up once per process.
+"""
+
+import struct
+import threading
+import zlib
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+RAW, ZLIB, ZSTD = 0, 1, 2
+CODECS = {'none': RAW, 'zlib': ZLIB, 'zstd': ZSTD}
+
+HEADER = struct.Struct('>BI')
+NO_DICTIONARY = (0, None)
+
+# Raw deflate streams; the header above already identifies the format
+ZLIB_WBITS = -15
+# zlib only looks back 32 KB, so a longer dictionary would be wasted
+ZLIB_MAX_DICTIONARY = 32 * 1024
+
+_dictionaries = {}
+_newest = {}
+_zstd_dictionaries = {}
+_lock = threading.Lock()
+
+
+def compress(text, codec=None, dictionary=None):
+    """
+    Encode text for storage.
+
+    Falls back to raw UTF-8 when compression would not save space.
+
+    Args:
+        text (str): Text to store
+        codec (str): 'none', 'zlib' or 'zstd'; defaults to TEXT_COMPRESSION
+        dictionary (tuple): (id, data) of the dictionary to use, or
+            NO_DICTIONARY; defaults to the newest one trained for the codec
+
+    Returns:
+        bytes: Header followed by the payload
+    """
+    raw = text.encode('utf-8')
+    codec = _codec(codec or settings.TEXT_COMPRESSION)
+    if codec == RAW:
+        return HEADER.pack(RAW, 0) + raw
+    dictionary_id, data = dictionary or _newest_dictionary(codec)
+    if codec == ZLIB:
+        compressor = zlib.compressobj(settings.TEXT_COMPRESSION_LEVEL, zlib.DEFLATED, ZLIB_WBITS, zdict=data or b'')
+        payload = compressor.compress(raw) + compressor.flush()
+    else:
+        payload = _zstd_compressor(data).compress(raw)
+    if len(payload) >= len(raw):
+        return HEADER.pack(RAW, 0) + raw
+    return HEADER.pack(codec, dictionary_id) + payload
+
+
+def decompress(data, dictionary=None):
+    """
+    Decode a value written by compress().
+
+    Args:
+        data (bytes): Stored value
+        dictionary (bytes): Data of the dictionary the value was compressed
+            with; looked up by the id in its header when not given
+    """
+    codec, dictionary_id = HEADER.unpack_from(data)
+    payload = memoryview(data)[HEADER.size:]
+    if codec == RAW:
+        return bytes(payload).decode('utf-8')
+    dictionary = dictionary or _dictionary(dictionary_id)
+    if codec == ZLIB:
+        return zlib.decompressobj(ZLIB_WBITS, zdict=dictionary or b'').decompress(payload).decode('utf-8')
+    return _zstd_decompressor(dictionary).decompress(payload).decode('utf-8')
+
+
+def decompress_prefix(data, length, dictionary=None):
+    """Decode only as much of a value as needed for its first length characters"""
+    codec, dictionary_id = HEADER.unpack_from(data)
+    payload = memoryview(data)[HEADER.size:]
+    # UTF-8 needs at most four bytes per character
+    limit = length * 4
+    if codec == RAW:
+        head = bytes(payload[:limit])
+    else:
+        dictionary = dictionary or _dictionary(dictionary_id)
+        if codec == ZLIB:
+            head = zlib.decompressobj(ZLIB_WBITS, zdict=dictionary or b'').decompress(payload, limit)
+        else:
+            head = _zstd_decompressor(dictionary).stream_reader(bytes(payload)).read(limit)
+    return head.decode('utf-8', errors='ignore')[:length]
+
+
+def train_dictionary(codec_name, samples, size):
+    """
+    Build a compression dictionary from sample texts.
+
+    zstd dictionaries come from zstandard's trainer. zlib has no trainer,
+    so its dictionary is the most frequent words and word pairs of the
+    samples, most frequent last, where zlib finds them cheapest.
+
+    Returns:
+        bytes: Dictionary data
+    """
+    codec = _codec(codec_name)
+    if codec == ZSTD:
+        return zstandard.train_dictionary(size, [text.encode('utf-8') for text in samples]).as_bytes()
+    if codec != ZLIB:
+        raise ValueError('Dictionaries need the zlib or zstd codec')
+    counts = Counter()
+    for text in samples:
+        words = text.split()
+        counts.update(words)
+        counts.update(' '.join(pair) for pair in zip(words, words[1:]))
+    size = min(size, ZLIB_MAX_DICTIONARY)
+    parts = []
+    used = 0
+    for phrase, count in counts.most_common():
+        if count < 2:
+            break
+        encoded = phrase.encode('utf-8') + b' '
+        if used + len(encoded) > size:
+            break
+        parts.append(encoded)
+        used += len(encoded)
+    return b''.join(reversed(parts))
+
+
+def forget_dictionaries():
+    """Drop cached dictionaries so the next write picks up a newly trained one"""
+    with _lock:
+        _newest.clear()
+
+
+def _codec(name):
+    if name not in CODECS:
+        raise ImproperlyConfigured(f"Unknown TEXT_COMPRESSION {name!r}; use one of {', '.join(CODECS)}")
+    if CODECS[name] == ZSTD and zstandard is None:
+        raise ImproperlyConfigured("TEXT_COMPRESSION 'zstd' needs the zstandard package")
+    return CODECS[name]
+
+
+def _newest_dictionary(codec):
+    """(id, data) of the newest dictionary for codec, or NO_DICTIONARY"""
+    with _lock:
+        if codec not in _newest:
+            from ..models import CompressionDictionary
+
+            row = CompressionDictionary.objects.filter(codec=codec).order_by('-id').values_list('id', 'data').first()
+            _newest[codec] = (row[0], bytes(row[1])) if row else NO_DICTIONARY
+            if row:
+                _dictionaries[row[0]] = bytes(row[1])
+        return _newest[codec]
+
+
+def _dictionary(dictionary_id):
+    if not dictionary_id:
+        return None
+    with _lock:
+        if dictionary_id not in _dictionaries:
+            from ..models import CompressionDictionary
+
+            _dictionaries[dictionary_id] = bytes(
+                CompressionDictionary.objects.values_list('data', flat=True).get(id=dictionary_id)
+            )
+        return _dictionaries[dictionary_id]
+
+
+def _zstd_dictionary(dictionary):
+    """Loaded zstd dictionary, kept so its tables are only built once"""
+    if not dictionary:
+        return None
+    with _lock:
+        if dictionary not in _zstd_dictionaries:
+            _zstd_dictionaries[dictionary] = zstandard.ZstdCompressionDict(dictionary)
+        return _zstd_dictionaries[dictionary]
+
+
+def _zstd_compressor(dictionary):
+    return zstandard.ZstdCompressor(level=settings.TEXT_COMPRESSION_LEVEL, dict_data=_zstd_dictionary(dictionary))
+
+
+def _zstd_decompressor(dictionary):
+    if zstandard is None:
+        raise ImproperlyConfigured("Reading zstd values needs the zstandard package")
+    return zstandard.ZstdDecompressor(dict_data=_zstd_dictionary(dictionary))
@@ -0,0 +1,125 @@
+"""
+Counters shared by every worker process, for rate limits and token budgets.
+
+Each counter expires timeout seconds after it was first incremented;
+later increments add to it atomically without extending its life. Two
+backends are available through THROTTLE_COUNTER_BACKEND:
+
+'db' keeps counters in the SharedCounter table. Increments are a single
+UPDATE ... SET value = value + n, and the expiry is only written when the
+row is created, so concurrent workers never lose each other's counts.
+Expired rows are purged whenever a counter is created.
+
+'redis' uses INCRBY and sets the expiry only on keys that have none, in
+one Lua script, so the two steps cannot interleave with other clients.
+It needs the optional redis package.
+"""
+
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+_backend = None
+_lock = threading.Lock()
+
+
+class DatabaseCounters:
+
+    def incr(self, key, amount, timeout):
+        now = timezone.now()
+        from ..models import SharedCounter
+
+        while True:
+            counter = SharedCounter.objects.filter(key=key, expires_at__gt=now)
+            if counter.update(value=F('value') + amount):
+                return counter.values_list('value', flat=True).first() or 0
+            try:
+                with transaction.atomic():
+                    # Also clears an expired row left under the same key
+                    SharedCounter.objects.filter(expires_at__lte=now).delete()
+                    SharedCounter.objects.create(key=key, value=amount, expires_at=now + timedelta(seconds=timeout))
+                return amount
+            except IntegrityError:
+                # Another worker created the counter first; add to theirs
+                continue
+
+    def get_many(self, keys):
+        from ..models import SharedCounter
+
+        return dict(
+            SharedCounter.objects.filter(key__in=keys, expires_at__gt=timezone.now()).values_list('key', 'value')
+        )
+
+
+class RedisCounters:
+
+    INCR = """
+        local value = redis.call('INCRBY', KEYS[1], ARGV[1])
+        if redis.call('TTL', KEYS[1]) < 0 then
+            redis.call('EXPIRE', KEYS[1], ARGV[2])
+        end
+        return value
+    """
+
+    def __init__(self, url):
+        if redis is None:
+            raise ImproperlyConfigured("THROTTLE_COUNTER_BACKEND 'redis' needs the redis package")
+        self.client = redis.Redis.from_url(url)
+        self._incr = self.client.register_script(self.INCR)
+
+    def incr(self, key, amount, timeout):
+        return int(self._incr(keys=[key], args=[amount, int(timeout)]))
+
+    def get_many(self, keys):
+        return {key: int(value) for key, value in zip(keys, self.client.mget(keys)) if value is not None}
+
+
+def backend():
+    """The configured backend, created once per process"""
+    global _backend
+    if _backend is None:
+        with _lock:
+            if _backend is None:
+                name = settings.THROTTLE_COUNTER_BACKEND
+                if name == 'db':
+                    _backend = DatabaseCounters()
+                elif name == 'redis':
+                    _backend = RedisCounters(settings.THROTTLE_REDIS_URL)
+                else:
+                    raise ImproperlyConfigured(f"Unknown THROTTLE_COUNTER_BACKEND {name!r}; use 'db' or 'redis'")
+    return _backend
+
+
+def incr(key, amount=1, timeout=60):
+    """
+    Add amount to a counter, creating it if it does not exist or has expired.
+
+    Args:
+        key (str): Counter name
+        amount (int): Amount to add; negative to take back an increment
+        timeout (int): Seconds a new counter lives; ignored for existing ones
+
+    Returns:
+        int: The counter's value after the increment
+    """
+    return backend().incr(key, amount, timeout)
+
+
+def get_many(keys):
+    """Current values of the live counters among keys, as a dict"""
+    return backend().get_many(list(keys))
+
+
+def get(key):
+    """Current value of a counter, 0 if it does not exist or has expired"""
+    return get_many([key]).get(key, 0)
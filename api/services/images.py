@@ -0,0 +1,194 @@
+"""
+Prepare uploaded images for text extraction.
+
+Uploads are decoded with Pillow to learn their real format, then shrunk to
+IMAGE_MAX_DIMENSION, converted to grayscale, straightened and re-encoded
+as JPEG, or as PNG when that is smaller for drawings and screenshots.
+Smaller images cost fewer vision tokens and upload faster, and the
+provider is always told the correct media type. An upload that needed no
+resizing or rotation is sent as-is when re-encoding would not shrink it.
+"""
+
+import io
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+from django.conf import settings
+
+# Formats every provider accepts as-is
+MEDIA_TYPES = {
+    'JPEG': 'image/jpeg',
+    'PNG': 'image/png',
+    'GIF': 'image/gif',
+    'WEBP': 'image/webp',
+}
+
+# Sources that are usually drawings or screenshots, which PNG compresses
+# better than JPEG
+LOSSLESS_FORMATS = {'PNG', 'GIF'}
+LOSSLESS_MODES = {'1', 'P', 'PA', 'LA', 'RGBA'}
+
+# EXIF tag holding the camera's rotation flag
+ORIENTATION = 0x0112
+
+
+class InvalidImage(ValueError):
+    """Raised when an upload cannot be decoded as an image"""
+
+
+class ImageTooLarge(InvalidImage):
+    """Raised when an upload exceeds IMAGE_MAX_UPLOAD_BYTES"""
+
+
+def check_upload_size(upload):
+    """
+    Reject uploads larger than IMAGE_MAX_UPLOAD_BYTES.
+
+    Raises:
+        ImageTooLarge: If the upload is over the limit
+    """
+    if upload.size > settings.IMAGE_MAX_UPLOAD_BYTES:
+        raise ImageTooLarge(
+            f'Image is larger than {settings.IMAGE_MAX_UPLOAD_BYTES // (1024 * 1024)} MB'
+        )
+
+
+def prepare_image(source):
+    """
+    Decode, normalize and re-encode an uploaded image.
+
+    Pillow reads straight from the upload, which Django spools to a
+    temporary file when it is large, so the raw file is never held in
+    memory as a whole. JPEGs are decoded at reduced scale when they are
+    larger than IMAGE_MAX_DIMENSION.
+
+    The result is the smallest of the JPEG encoding, a PNG encoding for
+    lossless sources, and the original bytes when the image kept its size
+    and orientation.
+
+    Args:
+        source: Uploaded file, any binary file object, or bytes
+
+    Returns:
+        tuple: (image bytes, media type)
+
+    Raises:
+        InvalidImage: If source is not an image Pillow can read
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    max_dimension = settings.IMAGE_MAX_DIMENSION
+    try:
+        source.seek(0)
+        image = Image.open(source)
+        media_type = MEDIA_TYPES.get(image.format)
+        if not settings.IMAGE_PREPROCESS_ENABLED and media_type is not None:
+            source.seek(0)
+            return source.read(), media_type
+        lossless = image.format in LOSSLESS_FORMATS or image.mode in LOSSLESS_MODES
+        original_size = image.size
+        # Phone photos are often stored sideways with an EXIF rotation flag
+        upright = image.getexif().get(ORIENTATION, 1) == 1
+        image.draft('RGB', (max_dimension, max_dimension))
+        image.load()
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        raise InvalidImage('Unsupported or corrupt image file') from e
+
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+    image = flatten(image).convert('L' if settings.IMAGE_GRAYSCALE else 'RGB')
+    unchanged = upright and image.size == original_size
+    if settings.IMAGE_MAX_SKEW > 0:
+        straightened = deskew(image, settings.IMAGE_MAX_SKEW)
+        unchanged = unchanged and straightened is image
+        image = straightened
+
+    encodings = [(encode(image, 'JPEG', quality=settings.IMAGE_JPEG_QUALITY, optimize=True), 'image/jpeg')]
+    if lossless:
+        encodings.append((encode(image, 'PNG', optimize=True), 'image/png'))
+    data, encoded_type = min(encodings, key=lambda encoding: len(encoding[0]))
+
+    if unchanged and media_type is not None:
+        source.seek(0, io.SEEK_END)
+        if source.tell() <= len(data):
+            source.seek(0)
+            return source.read(), media_type
+    return data, encoded_type
+
+
+def encode(image, format, **options):
+    """Image encoded in format, as bytes"""
+    buffer = io.BytesIO()
+    image.save(buffer, format=format, **options)
+    return buffer.getvalue()
+
+
+def flatten(image):
+    """
+    Composite a transparent image onto white.
+
+    Transparent pixels often hold black, which would otherwise show through
+    once the alpha channel is dropped and hide dark text.
+    """
+    if image.mode == 'P' and 'transparency' in image.info:
+        image = image.convert('RGBA')
+    if image.mode not in ('RGBA', 'LA', 'PA'):
+        return image
+    image = image.convert('RGBA')
+    return Image.alpha_composite(Image.new('RGBA', image.size, 'white'), image)
+
+
+def perceptual_hash(data, size=16):
+    """
+    Difference hash of an image as a hex string of size * size bits.
+
+    Each bit records whether a pixel of a small grayscale thumbnail is
+    brighter than its right-hand neighbour, so re-encoding, resizing and
+    small lighting changes flip only a few bits.
+
+    Returns:
+        str: Hash, or '' if the image cannot be decoded
+    """
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.draft('L', ((size + 1) * 8, size * 8))
+        thumbnail = image.convert('L').resize((size + 1, size), Image.LANCZOS)
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        return ''
+    pixels = thumbnail.tobytes()
+    bits = ''.join(
+        '1' if pixels[row + column + 1] > pixels[row + column] else '0'
+        for row in range(0, len(pixels), size + 1)
+        for column in range(size)
+    )
+    return f'{int(bits, 2):0{size * size // 4}x}'
+
+
+def deskew(image, max_angle):
+    """
+    Rotate image so its lines of text run horizontally.
+
+    The angle is taken from the minimum-area rectangle around the dark
+    pixels. Corrections larger than max_angle degrees are assumed to be
+    misdetections and skipped.
+    """
+    # OpenCV adds over 100 ms to startup; only uploads need it
+    import cv2
+    import numpy as np
+
+    gray = np.asarray(image.convert('L'))
+    _, mask = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    points = cv2.findNonZero(mask)
+    if points is None:
+        return image
+
+    angle = cv2.minAreaRect(points)[-1]
+    # OpenCV reports the angle in a 90 degree range whose bounds vary by version
+    if angle < -45:
+        angle += 90
+    elif angle > 45:
+        angle -= 90
+    if abs(angle) < 0.5 or abs(angle) > max_angle:
+        return image
+
+    fill = 255 if image.mode == 'L' else (255, 255, 255)
+    return image.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=fill)
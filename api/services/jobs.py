@@ -0,0 +1,183 @@
+"""
+Database-backed job queue for background AI processing.
+
+Views enqueue a Job row and return immediately. Worker threads in the same
+process (or a dedicated `manage.py process_jobs` process) claim pending jobs
+with a conditional UPDATE, so several workers can share the table without an
+external broker.
+"""
+
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from ..models import Book, Job, Page
+from . import book_cache, search_index, usage
+from .ai_service import ProviderBusy, ai_service
+from .chunking import split_text
+from .images import prepare_image
+from .resimplify import store_blocks
+
+logger = logging.getLogger(__name__)
+
+_wakeup = threading.Event()
+_workers = []
+_workers_lock = threading.Lock()
+
+
+def enqueue(kind, user_id, book=None, page=None, text='', attachment=None):
+    """
+    Queue a job and make sure local workers are running.
+
+    Args:
+        kind (str): One of Job.KIND_CHOICES
+        user_id (str): Owner of the job
+        book (Book): Book the job fills in, if any
+        page (Page): Placeholder page the job fills in, if any
+        text (str): Input text
+        attachment (bytes): Raw input image, if any
+
+    Returns:
+        Job: The queued job
+    """
+    job = Job.objects.create(
+        kind=kind,
+        user_id=user_id,
+        book=book,
+        page=page,
+        text=text,
+        attachment=attachment
+    )
+    transaction.on_commit(_wakeup.set)
+    ensure_workers()
+    return job
+
+
+def claim_next():
+    """Atomically move the oldest pending job to running and return it"""
+    while True:
+        job_id = Job.objects.filter(status=Job.PENDING).order_by('created_at').values_list('id', flat=True).first()
+        if job_id is None:
+            return None
+        claimed = Job.objects.filter(id=job_id, status=Job.PENDING).update(
+            status=Job.RUNNING,
+            updated_at=timezone.now()
+        )
+        if claimed:
+            return Job.objects.select_related('book', 'page').defer(
+                'book__original_text', 'page__content'
+            ).get(id=job_id)
+
+
+def requeue_stale():
+    """Return jobs left running by a dead worker to the queue"""
+    cutoff = timezone.now() - timedelta(seconds=settings.AI_JOB_TIMEOUT)
+    return Job.objects.filter(status=Job.RUNNING, updated_at__lt=cutoff).update(
+        status=Job.PENDING,
+        updated_at=timezone.now()
+    )
+
+
+def run_job(job):
+    """Execute a claimed job and record its outcome"""
+    job.attempts += 1
+    try:
+        with usage.charged_to(job.user_id):
+            if job.kind == Job.PROCESS_TEXT:
+                simplified_chunks, suggested_title = ai_service.simplify_and_title(job.text)
+                with transaction.atomic():
+                    _fill_page(job, '\n\n'.join(simplified_chunks), title=suggested_title)
+                    store_blocks(
+                        job.book, split_text(job.text, settings.AI_CHUNK_TOKENS), simplified_chunks,
+                        [job.page_id] * len(simplified_chunks)
+                    )
+            elif job.kind == Job.ADD_PAGE:
+                _fill_page(job, ai_service.simplify_text(job.text))
+            elif job.kind == Job.UPLOAD_IMAGE:
+                image, media_type = prepare_image(job.attachment)
+                job.result = ai_service.extract_text_from_image(image, media_type)
+                job.attachment = None
+            else:
+                raise ValueError(f"Unknown job kind: {job.kind}")
+        job.status = Job.DONE
+        job.error = ''
+    except ProviderBusy:
+        if job.attempts < settings.AI_JOB_MAX_ATTEMPTS:
+            # Not the job's fault; leave it for a later attempt
+            job.status = Job.PENDING
+        else:
+            logger.error(f"Giving up on {job.kind} job {job.id}: providers busy for {job.attempts} attempts")
+            job.status = Job.FAILED
+            job.error = f"AI service was busy for {job.attempts} attempts"
+    except Exception as e:
+        logger.error(f"Error running {job.kind} job {job.id}: {str(e)}")
+        job.status = Job.FAILED
+        job.error = str(e)
+    if job.status == Job.FAILED and job.page_id:
+        # Don't leave an empty page in the book
+        job.book.remove_pages([job.page_id])
+        job.page = None
+    job.save(update_fields=['status', 'result', 'error', 'attachment', 'attempts', 'updated_at'])
+    if job.book_id:
+        _mark_book_processed(job)
+    return job
+
+
+def _fill_page(job, content, title=None):
+    Page.objects.filter(id=job.page_id).update(content=content)
+    search_index.index_pages([Page(id=job.page_id, book_id=job.book_id, content=content)], job.user_id)
+    book = job.book
+    update_fields = ['last_edited']
+    if title is not None:
+        book.title = title
+        update_fields.append('title')
+    book.save(update_fields=update_fields)
+
+
+def _mark_book_processed(job):
+    # A book whose process_text job failed has none of its text simplified
+    unfinished = Job.objects.filter(
+        Q(status__in=[Job.PENDING, Job.RUNNING]) | Q(status=Job.FAILED, kind=Job.PROCESS_TEXT),
+        book_id=job.book_id
+    ).exists()
+    Book.objects.filter(id=job.book_id).update(
+        is_processed=not unfinished,
+        last_edited=timezone.now()
+    )
+    book_cache.invalidate(job.book_id, job.user_id)
+
+
+def work(stop_event=None):
+    """Drain the queue until stop_event is set, sleeping while it is empty"""
+    while stop_event is None or not stop_event.is_set():
+        try:
+            job = claim_next()
+            if job is None:
+                _wakeup.wait(settings.AI_JOB_POLL_INTERVAL)
+                _wakeup.clear()
+            elif run_job(job).status == Job.PENDING:
+                _wakeup.wait(settings.AI_JOB_POLL_INTERVAL)
+        except Exception as e:
+            logger.error(f"Job worker error: {str(e)}")
+            _wakeup.wait(settings.AI_JOB_POLL_INTERVAL)
+        finally:
+            close_old_connections()
+
+
+def ensure_workers():
+    """Start the in-process worker threads once per process"""
+    if settings.AI_JOB_WORKERS <= 0 or _workers:
+        return
+    with _workers_lock:
+        if _workers:
+            return
+        requeue_stale()
+        for index in range(settings.AI_JOB_WORKERS):
+            thread = threading.Thread(target=work, name=f'ai-job-{index}', daemon=True)
+            thread.start()
+            _workers.append(thread)
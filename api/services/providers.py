@@ -0,0 +1,452 @@
+"""
+Provider backends for the AI service.
+
+Each backend wraps one vendor SDK behind the same three calls:
+complete() for a text prompt, read_images() for a prompt mixed with
+images, and stream() for incremental text, plus is_retryable() and
+retry_after() to classify the SDK's errors. acomplete() and
+aread_images() are the non-blocking counterparts used by async views. The router in routing.py only
+talks to this interface, so local stub providers can stand in for either
+vendor. Every backend reports the tokens each call used to usage.record().
+
+Vendor SDKs are imported and their clients created on first use, so a
+process only pays for the SDK it actually calls, and commands that never
+call a provider pay for none. Async clients are kept per event loop, as
+their connection pools cannot be shared between loops.
+"""
+
+import asyncio
+import base64
+import contextvars
+import random
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from django.conf import settings
+
+from . import resilience, usage
+from .chunking import estimate_tokens
+
+
+class LazyClientProvider:
+    """
+    Base for backends whose SDK clients are built on first use.
+
+    _connect() builds the blocking client and _connect_async() the client
+    for the running event loop.
+    """
+
+    def __init__(self, api_key, model_name):
+        self.api_key = api_key
+        self.model_name = model_name
+        self._client = None
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._connect()
+        return self._client
+
+    @property
+    def async_client(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._async_clients.get(loop)
+            if client is None:
+                client = self._async_clients[loop] = self._connect_async()
+        return client
+
+    def _connect(self):
+        raise NotImplementedError
+
+    def _connect_async(self):
+        raise NotImplementedError
+
+
+class ClaudeProvider(LazyClientProvider):
+
+    name = 'claude'
+
+    def __init__(self, api_key, model_name='claude-3-sonnet-20240229'):
+        super().__init__(api_key, model_name)
+
+    def _connect(self):
+        """Create one pooled HTTP client, shared by every thread of the process"""
+        import anthropic
+        import httpx
+
+        return anthropic.Client(
+            http_client=anthropic.DefaultHttpxClient(limits=self._limits(httpx, settings.AI_MAX_IN_FLIGHT)),
+            **self._options(httpx)
+        )
+
+    def _connect_async(self):
+        """Create the pooled async HTTP client for the running event loop"""
+        import anthropic
+        import httpx
+
+        return anthropic.AsyncClient(
+            http_client=anthropic.DefaultAsyncHttpxClient(
+                limits=self._limits(httpx, settings.AI_ASYNC_MAX_IN_FLIGHT)
+            ),
+            **self._options(httpx)
+        )
+
+    def _options(self, httpx):
+        return {
+            'api_key': self.api_key,
+            # Retries are handled by the router, which can fail over instead
+            'max_retries': 0,
+            'timeout': httpx.Timeout(settings.AI_SIMPLIFY_TIMEOUT, connect=settings.AI_CONNECT_TIMEOUT),
+        }
+
+    @staticmethod
+    def _limits(httpx, connections):
+        return httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+
+    def complete(self, prompt, max_tokens, timeout):
+        """Return the reply to a text prompt"""
+        return self._reply(self.client.messages.create(**self._message(prompt, max_tokens, timeout)))
+
+    async def acomplete(self, prompt, max_tokens, timeout):
+        """Return the reply to a text prompt without blocking the event loop"""
+        return await self._areply(await self.async_client.messages.create(**self._message(prompt, max_tokens, timeout)))
+
+    def read_images(self, content, max_tokens, timeout):
+        """
+        Return the reply to a prompt that includes images.
+
+        Args:
+            content (list): Text parts (str) and (image bytes, media type) pairs
+        """
+        message = self.client.messages.create(**self._message(self._blocks(content), max_tokens, timeout))
+        return self._reply(message)
+
+    async def aread_images(self, content, max_tokens, timeout):
+        """read_images() without blocking the event loop"""
+        message = await self.async_client.messages.create(
+            **self._message(self._blocks(content), max_tokens, timeout)
+        )
+        return await self._areply(message)
+
+    def _message(self, content, max_tokens, timeout):
+        return {
+            'model': self.model_name,
+            'max_tokens': max_tokens,
+            'timeout': timeout,
+            'messages': [{"role": "user", "content": content}],
+        }
+
+    @staticmethod
+    def _blocks(content):
+        """Convert text parts and (image bytes, media type) pairs to content blocks"""
+        blocks = []
+        for part in content:
+            if isinstance(part, str):
+                blocks.append({"type": "text", "text": part})
+            else:
+                image, media_type = part
+                blocks.append({
+                    "type": "image",
+                    "source": {
+                        "type": "base64",
+                        "media_type": media_type,
+                        "data": base64.b64encode(image).decode('ascii')
+                    }
+                })
+        return blocks
+
+    def stream(self, prompt, max_tokens, timeout):
+        """Yield text deltas for a text prompt"""
+        with self.client.messages.stream(
+            model=self.model_name,
+            max_tokens=max_tokens,
+            timeout=timeout,
+            messages=[{"role": "user", "content": prompt}]
+        ) as stream:
+            try:
+                yield from stream.text_stream
+            finally:
+                # Charged even when the client disconnects part way
+                self._record(stream.current_message_snapshot)
+
+    @staticmethod
+    def is_retryable(error):
+        # Only SDK calls raise these errors, so the SDK is already imported
+        import anthropic
+
+        return isinstance(error, anthropic.APIConnectionError) or resilience.is_retryable(error)
+
+    @staticmethod
+    def retry_after(error):
+        return resilience.retry_after(error)
+
+    @classmethod
+    def _reply(cls, message):
+        usage.record(cls._tokens(message))
+        return cls._text(message)
+
+    @classmethod
+    async def _areply(cls, message):
+        await usage.arecord(cls._tokens(message))
+        return cls._text(message)
+
+    @classmethod
+    def _record(cls, message):
+        usage.record(cls._tokens(message))
+
+    @staticmethod
+    def _tokens(message):
+        if message is None or message.usage is None:
+            return 0
+        return message.usage.input_tokens + message.usage.output_tokens
+
+    @staticmethod
+    def _text(message):
+        return ''.join(getattr(block, 'text', '') for block in message.content)
+
+
+class GeminiProvider(LazyClientProvider):
+    """
+    Gemini backend.
+
+    max_tokens is sent as the generation config's max_output_tokens. The
+    pinned SDK accepts no per-request timeout, so timeout is enforced around
+    the call: blocking calls run on a small pool and are abandoned when they
+    overrun it, async calls are cancelled. Either way the caller gets a
+    TimeoutError, which the router retries or fails over.
+    """
+
+    name = 'gemini'
+
+    def __init__(self, api_key, model_name='gemini-1.5-flash'):
+        super().__init__(api_key, model_name)
+        self._executor = None
+
+    def _connect(self):
+        import google.generativeai as genai
+
+        genai.configure(api_key=self.api_key)
+        return genai.GenerativeModel(self.model_name)
+
+    def _connect_async(self):
+        # The same model serves generate_content_async() through the SDK's own async transport
+        return self.client
+
+    def complete(self, prompt, max_tokens, timeout):
+        """Return the reply to a text prompt"""
+        return self._reply(self._within(
+            timeout, self.client.generate_content, prompt, generation_config=self._config(max_tokens)
+        ))
+
+    async def acomplete(self, prompt, max_tokens, timeout):
+        """Return the reply to a text prompt without blocking the event loop"""
+        return await self._areply(await self._awithin(
+            timeout, self.async_client.generate_content_async(prompt, generation_config=self._config(max_tokens))
+        ))
+
+    def read_images(self, content, max_tokens, timeout):
+        """
+        Return the reply to a prompt that includes images.
+
+        Args:
+            content (list): Text parts (str) and (image bytes, media type) pairs
+        """
+        return self._reply(self._within(
+            timeout, self.client.generate_content, self._parts(content), generation_config=self._config(max_tokens)
+        ))
+
+    async def aread_images(self, content, max_tokens, timeout):
+        """read_images() without blocking the event loop"""
+        return await self._areply(
+            await self._awithin(timeout, self.async_client.generate_content_async(
+                self._parts(content), generation_config=self._config(max_tokens)
+            ))
+        )
+
+    def _within(self, timeout, call, *args, **kwargs):
+        """
+        Run a blocking SDK call, giving up after timeout seconds.
+
+        Raises:
+            TimeoutError: If the call has not returned in time; it is left
+                to finish in the background
+        """
+        if not timeout:
+            return call(*args, **kwargs)
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=settings.AI_MAX_IN_FLIGHT, thread_name_prefix='gemini'
+                    )
+        future = self._executor.submit(contextvars.copy_context().run, call, *args, **kwargs)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise TimeoutError(f"Gemini did not answer within {timeout} seconds") from None
+
+    @staticmethod
+    async def _awithin(timeout, call):
+        """Await an SDK call, cancelling it after timeout seconds"""
+        if not timeout:
+            return await call
+        try:
+            return await asyncio.wait_for(call, timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Gemini did not answer within {timeout} seconds") from None
+
+    @staticmethod
+    def _config(max_tokens):
+        return {'max_output_tokens': max_tokens}
+
+    @staticmethod
+    def _parts(content):
+        return [
+            part if isinstance(part, str) else {"mime_type": part[1], "data": part[0]}
+            for part in content
+        ]
+
+    def stream(self, prompt, max_tokens, timeout):
+        """Yield text deltas for a text prompt"""
+        response = None
+        try:
+            # The deadline applies to each chunk, like a read timeout
+            responses = iter(self._within(
+                timeout, self.client.generate_content, prompt,
+                generation_config=self._config(max_tokens), stream=True
+            ))
+            while (chunk := self._within(timeout, next, responses, None)) is not None:
+                response = chunk
+                yield response.text
+        finally:
+            # Each chunk carries the running total
+            if response is not None:
+                self._record(response)
+
+    @staticmethod
+    def is_retryable(error):
+        """google.api_core errors carry their HTTP status as code"""
+        return resilience.is_retryable(error)
+
+    @staticmethod
+    def retry_after(error):
+        return None
+
+    @classmethod
+    def _reply(cls, response):
+        cls._record(response)
+        return response.text
+
+    @classmethod
+    async def _areply(cls, response):
+        await usage.arecord(cls._tokens(response))
+        return response.text
+
+    @classmethod
+    def _record(cls, response):
+        usage.record(cls._tokens(response))
+
+    @staticmethod
+    def _tokens(response):
+        metadata = getattr(response, 'usage_metadata', None)
+        return metadata.total_token_count if metadata is not None else 0
+
+
+class StubProviderError(Exception):
+    """Simulated provider outage"""
+
+    status_code = 503
+
+
+class StubProvider:
+    """
+    Local provider that answers without any network calls.
+
+    Replies echo the last line of the prompt. latency (seconds) and
+    failure_rate (0-1) simulate slow or failing vendors. Token usage is
+    estimated from the length of the prompt and reply.
+    """
+
+    def __init__(self, name='stub', latency=0.0, failure_rate=0.0):
+        self.name = name
+        self.model_name = f'{name}-model'
+        self.latency = latency
+        self.failure_rate = failure_rate
+
+    def complete(self, prompt, max_tokens, timeout):
+        """Return the last line of the prompt"""
+        self._simulate()
+        return self._charged(prompt, self._reply(prompt))
+
+    async def acomplete(self, prompt, max_tokens, timeout):
+        await self._asimulate()
+        reply = self._reply(prompt)
+        await usage.arecord(self._tokens(prompt, reply))
+        return reply
+
+    def read_images(self, content, max_tokens, timeout):
+        """Return placeholder text, one marked section per image when there are several"""
+        self._simulate()
+        return self._charged(content, self._image_reply(content))
+
+    async def aread_images(self, content, max_tokens, timeout):
+        await self._asimulate()
+        reply = self._image_reply(content)
+        await usage.arecord(self._tokens(content, reply))
+        return reply
+
+    def stream(self, prompt, max_tokens, timeout):
+        """Yield the reply to complete() word by word"""
+        for index, word in enumerate(self.complete(prompt, max_tokens, timeout).split()):
+            yield word if index == 0 else ' ' + word
+
+    @staticmethod
+    def is_retryable(error):
+        return resilience.is_retryable(error)
+
+    @staticmethod
+    def retry_after(error):
+        return None
+
+    @staticmethod
+    def _reply(prompt):
+        return prompt.strip().splitlines()[-1].strip()
+
+    @classmethod
+    def _charged(cls, prompt, reply):
+        usage.record(cls._tokens(prompt, reply))
+        return reply
+
+    @staticmethod
+    def _tokens(prompt, reply):
+        parts = [prompt] if isinstance(prompt, str) else [part for part in prompt if isinstance(part, str)]
+        return sum(estimate_tokens(part) for part in parts) + estimate_tokens(reply)
+
+    @staticmethod
+    def _image_reply(content):
+        count = sum(1 for part in content if not isinstance(part, str))
+        if count == 1:
+            return 'Stub text for image'
+        return '\n'.join(f'=== IMAGE {number} ===\nStub text for image {number}' for number in range(1, count + 1))
+
+    def _simulate(self):
+        if self.latency:
+            time.sleep(self.latency)
+        self._maybe_fail()
+
+    async def _asimulate(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self._maybe_fail()
+
+    def _maybe_fail(self):
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise StubProviderError(f'{self.name} stub failure')
@@ -0,0 +1,134 @@
+"""
+Retry and circuit breaking for provider calls.
+
+Retryable errors (rate limits, server errors, timeouts, dropped
+connections) are retried with full-jitter exponential backoff, waiting
+for the Retry-After header instead when the provider sends one. Each
+provider has a circuit breaker: after AI_BREAKER_FAILURES consecutive
+failures it opens and calls fail fast for AI_BREAKER_COOLDOWN seconds,
+then a single trial request decides whether it closes again.
+"""
+
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from django.conf import settings
+
+RETRYABLE_STATUS = {408, 409, 429}
+
+
+def status_of(error):
+    """HTTP status carried by an SDK error, if any"""
+    for attribute in ('status_code', 'code'):
+        value = getattr(error, attribute, None)
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def is_retryable(error):
+    """Whether error is worth retrying, judged from its HTTP status or type"""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    status = status_of(error)
+    return status is not None and (status in RETRYABLE_STATUS or status >= 500)
+
+
+def retry_after(error):
+    """Seconds to wait from a Retry-After header on error's response, if any"""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    value = headers.get('retry-after') if headers is not None else None
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((moment - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+def backoff_delay(attempt):
+    """Full-jitter exponential delay before retry number attempt (from 0)"""
+    ceiling = min(settings.AI_RETRY_MAX_DELAY, settings.AI_RETRY_BASE_DELAY * 2 ** attempt)
+    return random.uniform(0, ceiling)
+
+
+class CircuitBreaker:
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=None, cooldown=None):
+        """Initialize a closed breaker with limits taken from settings by default"""
+        self.name = name
+        self.failure_threshold = failure_threshold if failure_threshold is not None else settings.AI_BREAKER_FAILURES
+        self.cooldown = cooldown if cooldown is not None else settings.AI_BREAKER_COOLDOWN
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.times_opened = 0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def available(self):
+        """Whether a call could be let through now, without reserving it"""
+        with self._lock:
+            if self.state == self.OPEN:
+                return time.monotonic() - self.opened_at >= self.cooldown
+            return not (self.state == self.HALF_OPEN and self._trial_running)
+
+    def allow(self):
+        """
+        Reserve permission for one call.
+
+        Returns:
+            bool: False while open, or while a half-open trial is already running
+        """
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = self.HALF_OPEN
+            if self.state == self.OPEN:
+                return False
+            if self.state == self.HALF_OPEN:
+                if self._trial_running:
+                    return False
+                self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.times_opened += 1
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def release(self):
+        """End a call that neither proved nor disproved the provider's health"""
+        with self._lock:
+            self._trial_running = False
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'times_opened': self.times_opened,
+            }
@@ -0,0 +1,220 @@
+"""
+Re-simplify only the parts of a book's original text that changed.
+
+The original text is split into blocks with split_text. Texts within the
+chunk budget are a single block; longer ones are split at content-defined
+breaks, which keep untouched paragraphs in identical blocks. Each
+block's digest, simplified text and page are stored as TextBlock rows when
+the pages are first created (add_simplified_pages, store_blocks). After an
+edit, the new blocks are matched against the stored ones by digest: only
+unmatched blocks are sent to the provider, and only the pages holding
+changed blocks are rebuilt. Pages added later with their own text hold no
+blocks and are left alone.
+
+Pages whose simplification is not known block by block, such as the
+placeholder of a queued process_text job, hold a placeholder block
+(store_placeholders) whose empty digest no text matches, so the next edit
+rewrites them.
+
+Books processed before blocks were stored are recovered from the result
+cache when every block of the previous text is cached and the pages match
+what process_text produced (one page, or one page per block). Otherwise
+their first page, which process_text always filled from the original
+text, is taken to hold it.
+"""
+
+import hashlib
+import logging
+from difflib import SequenceMatcher
+
+from django.conf import settings
+from django.db import transaction
+
+from ..models import Book, Page, TextBlock
+from . import search_index
+from .ai_service import ai_service
+from .chunking import split_text
+
+logger = logging.getLogger(__name__)
+
+# Digest of placeholder blocks; real digests are never empty
+PLACEHOLDER = ''
+
+
+def block_digest(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def store_blocks(book, texts, outputs, page_ids):
+    """
+    Record the blocks of a book's simplified original text, replacing any stored ones.
+
+    Args:
+        book (Book): Book the text belongs to
+        texts (list): Blocks of the original text
+        outputs (list): Simplified text of each block
+        page_ids (list): Id of the page holding each block
+    """
+    TextBlock.objects.filter(book=book).delete()
+    TextBlock.objects.bulk_create([
+        TextBlock(book=book, page_id=page_id, position=position, digest=block_digest(text), simplified=output)
+        for position, (text, output, page_id) in enumerate(zip(texts, outputs, page_ids))
+    ])
+
+
+def store_placeholders(book, pages):
+    """
+    Mark pages as holding a book's simplified original text without knowing its blocks.
+
+    Replaces any stored blocks with one placeholder block per page, so the
+    next edit rewrites these pages rather than leaving them stale.
+
+    Args:
+        book (Book): Book the pages belong to
+        pages (list): Pages holding the simplified original text, in order
+    """
+    TextBlock.objects.filter(book=book).delete()
+    TextBlock.objects.bulk_create([
+        TextBlock(book=book, page=page, position=position, digest=PLACEHOLDER, simplified='')
+        for position, page in enumerate(pages)
+    ])
+
+
+def add_simplified_pages(book, outputs, split_pages=False):
+    """
+    Append the simplification of a book's original text as pages, and store its blocks.
+
+    Args:
+        book (Book): Book whose original_text was simplified
+        outputs (list): Simplified text of each chunk, as from simplify_chunks
+        split_pages (bool): One page per chunk instead of a single page
+
+    Returns:
+        list: The new pages
+    """
+    texts = split_text(book.original_text, settings.AI_CHUNK_TOKENS)
+    with transaction.atomic():
+        if split_pages:
+            pages = book.add_pages(outputs)
+            page_ids = [page.id for page in pages]
+        else:
+            pages = book.add_pages(['\n\n'.join(outputs)])
+            page_ids = [pages[0].id] * len(outputs)
+        if len(texts) == len(outputs):
+            store_blocks(book, texts, outputs, page_ids)
+        else:
+            logger.warning(f"Not storing blocks of book {book.id}: {len(outputs)} outputs for {len(texts)} blocks")
+    return pages
+
+
+def resimplify(book, previous_text):
+    """
+    Bring a book's pages in line with its edited original text.
+
+    Args:
+        book (Book): Book whose new original_text is already saved
+        previous_text (str): original_text before the edit, used to recover
+            the layout of books without stored blocks
+
+    Returns:
+        int: Number of blocks sent to the provider
+
+    Raises:
+        Exception: If simplifying a changed block fails; nothing is written
+    """
+    texts = split_text(book.original_text, settings.AI_CHUNK_TOKENS)
+    stored = list(book.blocks.all()) or _recover(book, previous_text)
+
+    # One (simplified text or None, page id or None) entry per new block
+    plan = []
+    touched = set()
+    matcher = SequenceMatcher(
+        None, [block.digest for block in stored], [block_digest(text) for text in texts], autojunk=False
+    )
+    for tag, old_start, old_end, new_start, new_end in matcher.get_opcodes():
+        if tag == 'equal':
+            plan += [(block.simplified, block.page_id) for block in stored[old_start:old_end]]
+            continue
+        replaced = stored[old_start:old_end]
+        touched.update(block.page_id for block in replaced)
+        count = new_end - new_start
+        if tag == 'replace':
+            # Replacements take the pages of the blocks they replace, in
+            # order; surplus old blocks are dropped and extra new ones are
+            # spread evenly over the old pages
+            plan += [
+                (None, replaced[index if count <= len(replaced) else index * len(replaced) // count].page_id)
+                for index in range(count)
+            ]
+            continue
+        # Insertions join the page of the block before them
+        if plan:
+            page_id = plan[-1][1]
+        else:
+            page_id = stored[old_start].page_id if old_start < len(stored) else None
+        plan += [(None, page_id)] * count
+
+    missing = [index for index, (simplified, _) in enumerate(plan) if simplified is None]
+    if len(missing) == 1:
+        outputs = [ai_service.simplify_chunk(texts[missing[0]])]
+    else:
+        outputs = ai_service.map(ai_service.simplify_chunk, [texts[index] for index in missing])
+    for index, output in zip(missing, outputs):
+        plan[index] = (output, plan[index][1])
+
+    with transaction.atomic():
+        Book.objects.select_for_update().filter(pk=book.pk).exists()
+        if any(page_id is None for _, page_id in plan):
+            first_page = book.pages.order_by('page_number').first() or book.add_page('')
+            plan = [(simplified, page_id or first_page.id) for simplified, page_id in plan]
+        touched.update(plan[index][1] for index in missing)
+
+        store_blocks(book, texts, [simplified for simplified, _ in plan], [page_id for _, page_id in plan])
+
+        rebuilt, emptied = [], []
+        for page in Page.objects.filter(id__in=touched).only('id', 'book_id'):
+            contents = [simplified for simplified, page_id in plan if page_id == page.id]
+            if contents:
+                page.content = '\n\n'.join(contents)
+                rebuilt.append(page)
+            else:
+                emptied.append(page.id)
+        Page.objects.bulk_update(rebuilt, ['content'])
+        search_index.index_pages(rebuilt, book.user_id)
+        if emptied:
+            book.remove_pages(emptied)
+        book.total_pages = book.pages.count()
+        book.save(update_fields=['total_pages', 'last_edited'])
+
+    logger.info(f"Re-simplified {len(missing)} of {len(texts)} blocks of book {book.id}")
+    return len(missing)
+
+
+def _recover(book, previous_text):
+    """
+    Rebuild the blocks of a book without stored ones.
+
+    Returns:
+        list: Unsaved TextBlocks. When the result cache cannot account for
+            the pages, a placeholder block on the first page. [] when the
+            book has no pages.
+    """
+    texts = split_text(previous_text, settings.AI_CHUNK_TOKENS)
+    pages = list(book.pages.order_by('page_number')[:len(texts)])
+    if not pages:
+        return []
+    outputs = [ai_service.peek('simplify', text) for text in texts]
+    if None not in outputs:
+        if pages[0].content == '\n\n'.join(outputs):
+            layout = [pages[0]] * len(texts)
+        elif len(pages) == len(texts) and all(page.content == output for page, output in zip(pages, outputs)):
+            layout = pages
+        else:
+            layout = None
+        if layout is not None:
+            return [
+                TextBlock(book=book, page=page, position=position, digest=block_digest(text), simplified=output)
+                for position, (text, output, page) in enumerate(zip(texts, outputs, layout))
+            ]
+    return [TextBlock(book=book, page=pages[0], position=0, digest=PLACEHOLDER, simplified='')]
+
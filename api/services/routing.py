@@ -0,0 +1,451 @@
+"""
+Route provider requests by operation, with hedging and failover.
+
+Every operation (simplify, title, ocr) has an ordered list of providers.
+A request goes to the first healthy provider. For operations listed in
+AI_HEDGE_OPERATIONS, a duplicate request is sent to the next provider once
+the first has taken longer than its recent p95 latency, and whichever
+answers first wins. A failed request moves on to the next provider
+straight away. Latency and error rates are tracked per provider over a
+sliding window, and each provider has its own in-flight request limit.
+
+Before failing over, retryable errors are retried on the same provider
+with backoff, and providers whose circuit breaker is open are skipped
+(see resilience.py).
+
+acall() does the same for async views. Its requests wait on the event
+loop instead of a thread, with a separate, larger in-flight limit
+(AI_ASYNC_MAX_IN_FLIGHT), and losing hedged requests are cancelled.
+"""
+
+import asyncio
+import contextvars
+import itertools
+import logging
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import asynccontextmanager, contextmanager
+
+from django.conf import settings
+
+from .resilience import CircuitBreaker, backoff_delay
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderBusy(Exception):
+    """Raised when every in-flight request slot for a provider is taken"""
+
+
+class CircuitOpen(ProviderBusy):
+    """Raised when a provider's circuit breaker is rejecting calls"""
+
+
+class ProviderStats:
+
+    def __init__(self, window):
+        """Track the last window requests of one provider"""
+        self._latencies = deque(maxlen=window)
+        self._outcomes = deque(maxlen=window)
+        self._counters = {
+            'requests': 0, 'errors': 0, 'rejected': 0,
+            'hedges': 0, 'failovers': 0, 'retries': 0,
+            'short_circuited': 0, 'in_flight': 0,
+        }
+        self._lock = threading.Lock()
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def record(self, latency, ok):
+        """Record the outcome of one finished request"""
+        with self._lock:
+            self._counters['requests'] += 1
+            if ok:
+                self._latencies.append(latency)
+            else:
+                self._counters['errors'] += 1
+            self._outcomes.append(ok)
+
+    def p95(self):
+        """95th percentile latency of recent successes, or None without data"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if len(latencies) < settings.AI_ROUTER_MIN_SAMPLES:
+            return None
+        return latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)]
+
+    def error_rate(self):
+        with self._lock:
+            outcomes = list(self._outcomes)
+        return outcomes.count(False) / len(outcomes) if outcomes else 0.0
+
+    def is_healthy(self):
+        with self._lock:
+            samples = len(self._outcomes)
+        return samples < settings.AI_ROUTER_MIN_SAMPLES or self.error_rate() < settings.AI_ROUTER_MAX_ERROR_RATE
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self._counters)
+        p95 = self.p95()
+        counters['p95_latency'] = round(p95, 3) if p95 is not None else None
+        counters['error_rate'] = round(self.error_rate(), 4)
+        counters['healthy'] = self.is_healthy()
+        return counters
+
+
+class Router:
+
+    def __init__(self, providers, routes=None):
+        """
+        Args:
+            providers (list): Provider backends, in default preference order
+            routes (dict): Operation name to list of provider names; missing
+                operations use the default order
+        """
+        self.providers = {provider.name: provider for provider in providers}
+        self.default_order = [provider.name for provider in providers]
+        self.routes = {
+            operation: [name for name in names if name in self.providers]
+            for operation, names in (routes or {}).items()
+        }
+        self.stats = {name: ProviderStats(settings.AI_ROUTER_WINDOW) for name in self.providers}
+        self.slots = {name: threading.BoundedSemaphore(settings.AI_MAX_IN_FLIGHT) for name in self.providers}
+        self.breakers = {name: CircuitBreaker(name) for name in self.providers}
+        # asyncio semaphores belong to one event loop
+        self._async_slots = weakref.WeakKeyDictionary()
+        self.executor = ThreadPoolExecutor(
+            max_workers=settings.AI_MAX_IN_FLIGHT * len(self.providers),
+            thread_name_prefix='ai-router'
+        )
+
+    def route(self, operation):
+        """Provider names configured for operation, in preference order"""
+        return self.routes.get(operation) or self.default_order
+
+    def candidates(self, operation):
+        """
+        Provider names for operation, healthy ones first, otherwise in configured order.
+
+        Providers with an open circuit are left out unless every one is open,
+        in which case each attempt fails fast with CircuitOpen.
+        """
+        names = self.route(operation)
+        names = [name for name in names if self.breakers[name].available()] or names
+        return sorted(names, key=lambda name: not self.stats[name].is_healthy())
+
+    def call(self, operation, request):
+        """
+        Run request against the providers routed for operation.
+
+        Args:
+            operation (str): Operation name used for routing
+            request (callable): Makes one call given a provider backend
+
+        Returns:
+            The first successful result
+
+        Raises:
+            Exception: The last error when every provider failed
+        """
+        names = self.candidates(operation)
+        if len(names) > 1 and operation in settings.AI_HEDGE_OPERATIONS:
+            return self._hedged(names, request)
+        return self._sequential(names, request)
+
+    async def acall(self, operation, request):
+        """
+        Async counterpart of call().
+
+        Args:
+            operation (str): Operation name used for routing
+            request (callable): Returns an awaitable for one call given a
+                provider backend
+        """
+        names = self.candidates(operation)
+        if len(names) > 1 and operation in settings.AI_HEDGE_OPERATIONS:
+            return await self._ahedged(names, request)
+        return await self._asequential(names, request)
+
+    def stream(self, operation, request):
+        """
+        Yield from request's iterator, failing over until the first item.
+
+        Once output has started, an error is raised to the caller rather
+        than restarting on another provider.
+        """
+        names = self.candidates(operation)
+        for position, name in enumerate(names):
+            started = False
+            try:
+                for item in self._attempt_stream(name, request):
+                    started = True
+                    yield item
+                return
+            except Exception as e:
+                if started or position == len(names) - 1:
+                    raise
+                logger.error(f"{name} stream failed, failing over: {str(e)}")
+                self.stats[names[position + 1]].count('failovers')
+
+    @contextmanager
+    def slot(self, name):
+        """
+        Hold one of a provider's in-flight request slots and time the request.
+
+        Raises:
+            ProviderBusy: If no slot frees up within AI_SLOT_TIMEOUT
+        """
+        stats = self.stats[name]
+        if not self.slots[name].acquire(timeout=settings.AI_SLOT_TIMEOUT):
+            stats.count('rejected')
+            raise ProviderBusy(f"Too many in-flight {name} requests")
+        stats.count('in_flight')
+        started = time.monotonic()
+        ok = False
+        try:
+            yield
+            ok = True
+        except GeneratorExit:
+            # A streaming client went away; not the provider's fault
+            ok = True
+            raise
+        finally:
+            stats.count('in_flight', -1)
+            stats.record(time.monotonic() - started, ok)
+            self.slots[name].release()
+
+    @asynccontextmanager
+    async def aslot(self, name):
+        """
+        Async counterpart of slot(), limited to AI_ASYNC_MAX_IN_FLIGHT requests per event loop.
+
+        Raises:
+            ProviderBusy: If no slot frees up within AI_SLOT_TIMEOUT
+        """
+        loop = asyncio.get_running_loop()
+        slots = self._async_slots.get(loop)
+        if slots is None:
+            slots = self._async_slots[loop] = {
+                provider: asyncio.BoundedSemaphore(settings.AI_ASYNC_MAX_IN_FLIGHT) for provider in self.providers
+            }
+        stats = self.stats[name]
+        try:
+            await asyncio.wait_for(slots[name].acquire(), settings.AI_SLOT_TIMEOUT)
+        except asyncio.TimeoutError:
+            stats.count('rejected')
+            raise ProviderBusy(f"Too many in-flight {name} requests")
+        stats.count('in_flight')
+        started = time.monotonic()
+        ok = False
+        try:
+            yield
+            ok = True
+        except asyncio.CancelledError:
+            # A hedged request lost the race; not the provider's fault
+            ok = True
+            raise
+        finally:
+            stats.count('in_flight', -1)
+            stats.record(time.monotonic() - started, ok)
+            slots[name].release()
+
+    def snapshot(self):
+        """Return per-provider counters and circuit breaker state for this process"""
+        return {
+            name: {**stats.snapshot(), 'circuit': self.breakers[name].snapshot()}
+            for name, stats in self.stats.items()
+        }
+
+    def _guard(self, name):
+        if not self.breakers[name].allow():
+            self.stats[name].count('short_circuited')
+            raise CircuitOpen(f"{name} circuit is open")
+
+    def _retry_delay(self, name, error, attempt, can_retry):
+        """
+        Record a failed try and decide whether to try the same provider again.
+
+        Only retryable errors count against the circuit breaker. A
+        Retry-After longer than AI_RETRY_MAX_DELAY is not waited out; the
+        request fails over instead.
+
+        Args:
+            attempt (int): Number of the try that failed, from 1
+            can_retry (bool): Whether the caller is able to try again
+
+        Returns:
+            float: Seconds to wait before retrying, or None to give up
+        """
+        provider = self.providers[name]
+        breaker = self.breakers[name]
+        if isinstance(error, ProviderBusy) or not provider.is_retryable(error):
+            breaker.release()
+            return None
+        breaker.record_failure()
+        if not can_retry or breaker.state != CircuitBreaker.CLOSED:
+            return None
+        delay = provider.retry_after(error)
+        if delay is None:
+            delay = backoff_delay(attempt - 1)
+        elif delay > settings.AI_RETRY_MAX_DELAY:
+            return None
+        self.stats[name].count('retries')
+        logger.warning(f"{name} request failed, retrying in {delay:.2f}s: {str(error)}")
+        return delay
+
+    def _attempt(self, name, request):
+        self._guard(name)
+        for attempt in itertools.count(1):
+            try:
+                with self.slot(name):
+                    result = request(self.providers[name])
+            except Exception as e:
+                delay = self._retry_delay(name, e, attempt, attempt <= settings.AI_RETRY_ATTEMPTS)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+            else:
+                self.breakers[name].record_success()
+                return result
+
+    def _attempt_stream(self, name, request):
+        """Like _attempt, but only retries until the first item has been yielded"""
+        self._guard(name)
+        for attempt in itertools.count(1):
+            started = False
+            try:
+                with self.slot(name):
+                    for item in request(self.providers[name]):
+                        started = True
+                        yield item
+            except GeneratorExit:
+                self.breakers[name].release()
+                raise
+            except Exception as e:
+                can_retry = attempt <= settings.AI_RETRY_ATTEMPTS and not started
+                delay = self._retry_delay(name, e, attempt, can_retry)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+            else:
+                self.breakers[name].record_success()
+                return
+
+    async def _aattempt(self, name, request):
+        self._guard(name)
+        for attempt in itertools.count(1):
+            try:
+                async with self.aslot(name):
+                    result = await request(self.providers[name])
+            except asyncio.CancelledError:
+                self.breakers[name].release()
+                raise
+            except Exception as e:
+                delay = self._retry_delay(name, e, attempt, attempt <= settings.AI_RETRY_ATTEMPTS)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+            else:
+                self.breakers[name].record_success()
+                return result
+
+    def _sequential(self, names, request):
+        last_error = None
+        for position, name in enumerate(names):
+            if position:
+                self.stats[name].count('failovers')
+            try:
+                return self._attempt(name, request)
+            except Exception as e:
+                logger.error(f"{name} request failed: {str(e)}")
+                last_error = e
+        raise last_error
+
+    def _hedged(self, names, request):
+        remaining = list(names)
+        pending = {}
+        last_error = None
+
+        def launch(reason=None):
+            name = remaining.pop(0)
+            if reason:
+                self.stats[name].count(reason)
+            # Copy the caller's context so usage is charged to its user
+            pending[self.executor.submit(contextvars.copy_context().run, self._attempt, name, request)] = name
+
+        launch()
+        primary = self.stats[names[0]]
+        while pending:
+            delay = None
+            if remaining:
+                p95 = primary.p95()
+                delay = max(p95 if p95 is not None else settings.AI_HEDGE_DELAY, settings.AI_HEDGE_MIN_DELAY)
+            done, _ = wait(pending, timeout=delay, return_when=FIRST_COMPLETED)
+            if not done:
+                launch('hedges')
+                continue
+            for future in done:
+                name = pending.pop(future)
+                try:
+                    return future.result()
+                except Exception as e:
+                    logger.error(f"{name} request failed: {str(e)}")
+                    last_error = e
+                    if remaining:
+                        launch('failovers')
+        raise last_error
+
+    async def _asequential(self, names, request):
+        last_error = None
+        for position, name in enumerate(names):
+            if position:
+                self.stats[name].count('failovers')
+            try:
+                return await self._aattempt(name, request)
+            except Exception as e:
+                logger.error(f"{name} request failed: {str(e)}")
+                last_error = e
+        raise last_error
+
+    async def _ahedged(self, names, request):
+        remaining = list(names)
+        pending = {}
+        last_error = None
+
+        def launch(reason=None):
+            name = remaining.pop(0)
+            if reason:
+                self.stats[name].count(reason)
+            pending[asyncio.ensure_future(self._aattempt(name, request))] = name
+
+        launch()
+        primary = self.stats[names[0]]
+        try:
+            while pending:
+                delay = None
+                if remaining:
+                    p95 = primary.p95()
+                    delay = max(p95 if p95 is not None else settings.AI_HEDGE_DELAY, settings.AI_HEDGE_MIN_DELAY)
+                done, _ = await asyncio.wait(pending, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    launch('hedges')
+                    continue
+                for task in done:
+                    name = pending.pop(task)
+                    try:
+                        return task.result()
+                    except Exception as e:
+                        logger.error(f"{name} request failed: {str(e)}")
+                        last_error = e
+                        if remaining:
+                            launch('failovers')
+        finally:
+            for task in pending:
+                task.cancel()
+        raise last_error
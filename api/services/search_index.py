@@ -0,0 +1,180 @@
+"""
+Full-text search over books and their pages.
+
+Every book has one index row for its title and original text, and every
+page one row for its content. On SQLite the rows live in an FTS5 table and
+are ranked with bm25(); on PostgreSQL they live in a table with a weighted
+tsvector column behind a GIN index and are ranked with ts_rank(). Rows are
+keyed by page id, or by the negated book id for book rows, so a single
+page or book can be replaced or dropped without touching the rest.
+
+Rows are kept current by the Book signals (signals.py) and by the code
+that writes pages (Book.add_pages, resimplify, jobs). Pages have no signal
+receivers, so deleting a book can cascade to its pages without loading
+each one; the book's rows are then dropped with one DELETE by book_id.
+
+Only the SQLite statements are covered by the test suite, which runs on
+SQLite. The POSTGRES_* statements and the PostgreSQL table in migrations
+0008 and 0014 are untested.
+
+Matches in returned snippets are wrapped in <mark> tags; the surrounding
+text is HTML-escaped.
+"""
+
+import html
+import re
+
+from django.conf import settings
+from django.db import connection
+
+TABLE = 'api_search_index'
+
+# Delimiters the database puts around matches, swapped for <mark> tags after escaping
+MATCH_START = '\x02'
+MATCH_END = '\x03'
+
+SQLITE_UPSERT = [
+    f"DELETE FROM {TABLE} WHERE rowid = %s",
+    f"INSERT INTO {TABLE} (rowid, title, body, user_id, book_id, page_id) VALUES (%s, %s, %s, %s, %s, %s)",
+]
+
+# Untested; see the module docstring
+POSTGRES_UPSERT = f"""
+    INSERT INTO {TABLE} (id, title, body, user_id, book_id, page_id) VALUES (%s, %s, %s, %s, %s, %s)
+    ON CONFLICT (id) DO UPDATE SET title = EXCLUDED.title, body = EXCLUDED.body, user_id = EXCLUDED.user_id
+"""
+
+SQLITE_SEARCH = f"""
+    SELECT {TABLE}.book_id, b.title, p.page_number,
+           highlight({TABLE}, 0, char(2), char(3)),
+           snippet({TABLE}, 1, char(2), char(3), '…', %s),
+           -bm25({TABLE}, 5.0, 1.0) AS rank
+    FROM {TABLE}
+    JOIN api_book b ON b.id = {TABLE}.book_id
+    LEFT JOIN api_page p ON p.id = {TABLE}.page_id
+    WHERE {TABLE} MATCH %s AND {TABLE}.user_id = %s
+    ORDER BY rank DESC
+    LIMIT %s
+"""
+
+# Headlines are only built for the rows that survive the LIMIT. Untested;
+# see the module docstring
+POSTGRES_SEARCH = f"""
+    SELECT hit.book_id, b.title, p.page_number,
+           ts_headline('english', hit.title, hit.query, %s),
+           ts_headline('english', hit.body, hit.query, %s),
+           hit.rank
+    FROM (
+        SELECT s.book_id, s.page_id, s.title, s.body, query, ts_rank(s.document, query) AS rank
+        FROM {TABLE} s, websearch_to_tsquery('english', %s) query
+        WHERE s.user_id = %s AND s.document @@ query
+        ORDER BY rank DESC
+        LIMIT %s
+    ) hit
+    JOIN api_book b ON b.id = hit.book_id
+    LEFT JOIN api_page p ON p.id = hit.page_id
+    ORDER BY hit.rank DESC
+"""
+
+
+class SearchUnavailable(Exception):
+    """Raised when the database has no full-text search support"""
+
+
+def is_supported():
+    return connection.vendor in ('sqlite', 'postgresql')
+
+
+def index_book(book):
+    """Add or replace the index row for a book's title and original text"""
+    _upsert([(-book.id, book.title or '', book.original_text, book.user_id, book.id, None)])
+
+
+def index_pages(pages, user_id):
+    """Add or replace the index rows for pages, all belonging to user_id's books"""
+    _upsert([(page.id, '', page.content, user_id, page.book_id, page.id) for page in pages])
+
+
+def remove_book(book_id):
+    """Drop the index rows of a book and all of its pages"""
+    if not is_supported():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLE} WHERE book_id = %s", [book_id])
+
+
+def remove_pages(page_ids):
+    """Drop the index rows of pages"""
+    if not page_ids or not is_supported():
+        return
+    key = 'rowid' if connection.vendor == 'sqlite' else 'id'
+    with connection.cursor() as cursor:
+        cursor.executemany(f"DELETE FROM {TABLE} WHERE {key} = %s", [[page_id] for page_id in page_ids])
+
+
+def search(user_id, query, limit):
+    """
+    Find the books and pages of user_id that match query.
+
+    Args:
+        user_id (str): Owner of the books to search
+        query (str): Words to look for; every word must match
+        limit (int): Maximum number of results
+
+    Returns:
+        list: Dicts with book_id, book_title, page_number (None for a match
+            in the book's own title or text), title and snippet with matches
+            marked, and rank (higher is better), best match first
+
+    Raises:
+        SearchUnavailable: If the database has no full-text search support
+    """
+    if not is_supported():
+        raise SearchUnavailable(f'Search is not supported on {connection.vendor}')
+    if connection.vendor == 'sqlite':
+        terms = re.findall(r'\w+', query)
+        if not terms:
+            return []
+        # Quote every word so user input cannot be read as FTS5 syntax
+        expression = '{title body} : (' + ' AND '.join(f'"{term}"' for term in terms) + ')'
+        sql, params = SQLITE_SEARCH, [settings.SEARCH_SNIPPET_WORDS, expression, user_id, limit]
+    else:
+        options = (
+            f'StartSel={MATCH_START}, StopSel={MATCH_END}, MaxFragments=2, '
+            f'MaxWords={settings.SEARCH_SNIPPET_WORDS}, MinWords={settings.SEARCH_SNIPPET_WORDS // 2}'
+        )
+        sql, params = POSTGRES_SEARCH, ['HighlightAll=true, ' + options, options, query, user_id, limit]
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    return [
+        {
+            'book_id': book_id,
+            'book_title': book_title,
+            'page_number': page_number,
+            'title': _marked(title) or None,
+            'snippet': _marked(snippet),
+            'rank': round(rank, 4),
+        }
+        for book_id, book_title, page_number, title, snippet, rank in rows
+    ]
+
+
+def _marked(text):
+    """HTML-escape text and turn the match delimiters into <mark> tags"""
+    escaped = html.escape(text or '')
+    return escaped.replace(MATCH_START, '<mark>').replace(MATCH_END, '</mark>')
+
+
+def _upsert(rows):
+    if not rows or not is_supported():
+        return
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            # FTS5 tables have no upsert
+            cursor.executemany(SQLITE_UPSERT[0], [row[:1] for row in rows])
+            cursor.executemany(SQLITE_UPSERT[1], rows)
+        else:
+            cursor.executemany(POSTGRES_UPSERT, rows)
+
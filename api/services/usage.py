@@ -0,0 +1,108 @@
+"""
+Per-user accounting of the tokens providers report.
+
+Views and jobs name the user their provider calls are charged to with
+charged_to(); providers call record(), or arecord() from async calls, with
+the usage of every response, and the tokens are added to that user's
+counter for the current UTC day.
+The user travels in a context variable, which asyncio tasks and
+sync_to_async carry along; the thread pools in ai_service and the router
+copy it into their workers.
+
+Totals are shared counters (see counters.py), so every worker process
+sees the same figures. Tokens are only known once a call returns, so a
+request that starts under the budget may take a user slightly over it.
+"""
+
+import asyncio
+import functools
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from . import counters
+
+logger = logging.getLogger(__name__)
+
+_user = ContextVar('ai_usage_user', default=None)
+
+# Counters outlive their day so late requests still find them
+COUNTER_TIMEOUT = 2 * 24 * 60 * 60
+
+
+def request_user(request):
+    """The userId a request names in its body or query string, if any"""
+    return request.data.get('userId') or request.GET.get('userId') or None
+
+
+@contextmanager
+def charged_to(user_id):
+    """Charge provider calls made inside the block to user_id"""
+    # Restored rather than reset, as stream generators may resume in a copied context
+    previous = _user.get()
+    _user.set(user_id)
+    try:
+        yield
+    finally:
+        _user.set(previous)
+
+
+def metered(view):
+    """Charge the provider calls a view makes to the request's userId"""
+    if asyncio.iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            with charged_to(request_user(request)):
+                return await view(request, *args, **kwargs)
+    else:
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            with charged_to(request_user(request)):
+                return view(request, *args, **kwargs)
+    return wrapper
+
+
+def current_user():
+    """The user provider calls are charged to at this point, or None"""
+    return _user.get()
+
+
+def record(tokens):
+    """Add tokens reported by a provider to the current user's daily total"""
+    user_id = _user.get()
+    if not user_id or not tokens:
+        return
+    try:
+        counters.incr(_key(user_id), tokens, COUNTER_TIMEOUT)
+    except Exception as e:
+        logger.error(f"Could not record {tokens} tokens for {user_id}: {str(e)}")
+
+
+async def arecord(tokens):
+    """record() for async provider calls; the counter is updated in a worker thread"""
+    if _user.get() and tokens:
+        await sync_to_async(record)(tokens)
+
+
+def used_today(user_id):
+    """Tokens charged to user_id since midnight UTC"""
+    return counters.get(_key(user_id))
+
+
+def budget_exhausted(user_id):
+    budget = settings.AI_DAILY_TOKEN_BUDGET
+    return bool(budget) and used_today(user_id) >= budget
+
+
+def seconds_until_reset():
+    now = datetime.now(timezone.utc)
+    midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return (midnight - now).total_seconds()
+
+
+def _key(user_id):
+    return f"tokens:{user_id}:{datetime.now(timezone.utc).date().isoformat()}"
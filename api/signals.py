@@ -0,0 +1,28 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Book
+from .services import book_cache, search_index
+
+# Book fields that feed the book's search index row
+INDEXED_BOOK_FIELDS = {'title', 'original_text'}
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def invalidate_book_cache(sender, instance, **kwargs):
+    """Drop cached payloads whenever a book is saved or deleted"""
+    book_cache.invalidate(instance.id, instance.user_id)
+
+
+@receiver(post_save, sender=Book)
+def index_book(sender, instance, update_fields=None, **kwargs):
+    """Reindex a book's title and text, unless the save left both untouched"""
+    if update_fields is None or INDEXED_BOOK_FIELDS & set(update_fields):
+        search_index.index_book(instance)
+
+
+@receiver(post_delete, sender=Book)
+def unindex_book(sender, instance, **kwargs):
+    """Drop the index rows of a deleted book and its pages"""
+    search_index.remove_book(instance.id)
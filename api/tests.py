@@ -1,3 +1,1068 @@
-from django.test import TestCase
+import asyncio
+import io
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.core.cache import caches
+from django.db import close_old_connections, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import F
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image, ImageDraw
+
+from .fields import CompressedText, text_prefix
+from .models import Book, Job, Page, SharedCounter, TextBlock
+from . import views
+from .services import ai_service, book_cache, bulk_import, compression, counters, jobs, resimplify, search_index, usage
+from .services.ai_service import AIServiceProvider
+from .services.chunking import estimate_tokens, split_text
+from .services.images import prepare_image
+from .services.providers import StubProvider, StubProviderError
+from .services.resilience import CircuitBreaker
+from .services.routing import CircuitOpen, ProviderBusy, Router
+from .throttling import SlidingWindowThrottle
+
+
+def paragraphs(count, words=60):
+    return [f'Paragraph {number} ' + ' '.join(['word'] * words) for number in range(count)]
+
+
+def answer(provider):
+    """Request that calls the provider and reports which one answered"""
+    provider.complete('text', 10, 1)
+    return provider.name
+
+
+async def aanswer(provider):
+    await provider.acomplete('text', 10, 1)
+    return provider.name
+
+
+def failing(name):
+    return StubProvider(name, failure_rate=1.0)
+
+
+@override_settings(
+    AI_HEDGE_OPERATIONS=['simplify'], AI_HEDGE_DELAY=0.05, AI_HEDGE_MIN_DELAY=0.05,
+    AI_RETRY_ATTEMPTS=1, AI_RETRY_BASE_DELAY=0, AI_BREAKER_FAILURES=5, AI_BREAKER_COOLDOWN=30,
+)
+class RouterTests(SimpleTestCase):
+
+    def test_uses_first_provider(self):
+        router = Router([StubProvider('a'), StubProvider('b')])
+        self.assertEqual(router.call('title', answer), 'a')
+
+    def test_route_overrides_default_order(self):
+        router = Router([StubProvider('a'), StubProvider('b')], {'title': ['b', 'a']})
+        self.assertEqual(router.call('title', answer), 'b')
+
+    def test_unknown_providers_are_dropped_from_routes(self):
+        router = Router([StubProvider('a')], {'title': ['missing', 'a']})
+        self.assertEqual(router.route('title'), ['a'])
+
+    def test_retries_then_fails_over(self):
+        router = Router([failing('a'), StubProvider('b')])
+        self.assertEqual(router.call('title', answer), 'b')
+        stats = router.snapshot()
+        self.assertEqual(stats['a']['retries'], 1)
+        self.assertEqual(stats['a']['errors'], 2)
+        self.assertEqual(stats['b']['failovers'], 1)
+
+    def test_raises_last_error_when_every_provider_fails(self):
+        router = Router([failing('a'), failing('b')])
+        with self.assertRaisesMessage(StubProviderError, 'b stub failure'):
+            router.call('title', answer)
+
+    def test_hedges_slow_provider(self):
+        router = Router([StubProvider('a', latency=1), StubProvider('b')])
+        started = time.monotonic()
+        self.assertEqual(router.call('simplify', answer), 'b')
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(router.snapshot()['b']['hedges'], 1)
+
+    def test_does_not_hedge_other_operations(self):
+        router = Router([StubProvider('a', latency=0.2), StubProvider('b')])
+        self.assertEqual(router.call('title', answer), 'a')
+        self.assertEqual(router.snapshot()['b']['requests'], 0)
+
+    def test_async_hedge_cancels_losing_request(self):
+        router = Router([StubProvider('a', latency=1), StubProvider('b')])
+
+        async def run():
+            result = await router.acall('simplify', aanswer)
+            # Let the cancelled request unwind
+            await asyncio.sleep(0)
+            return result
+
+        self.assertEqual(asyncio.run(run()), 'b')
+        stats = router.snapshot()
+        self.assertEqual(stats['b']['hedges'], 1)
+        self.assertEqual(stats['a']['in_flight'], 0)
+        self.assertEqual(stats['a']['errors'], 0)
+
+    def test_async_fails_over(self):
+        router = Router([failing('a'), StubProvider('b')])
+        self.assertEqual(asyncio.run(router.acall('title', aanswer)), 'b')
+
+    @override_settings(AI_BREAKER_FAILURES=2, AI_RETRY_ATTEMPTS=0)
+    def test_open_breaker_skips_provider(self):
+        router = Router([failing('a'), StubProvider('b')])
+        router.call('title', answer)
+        router.call('title', answer)
+        self.assertEqual(router.snapshot()['a']['circuit']['state'], CircuitBreaker.OPEN)
+
+        self.assertEqual(router.candidates('title'), ['b'])
+        self.assertEqual(router.call('title', answer), 'b')
+        self.assertEqual(router.snapshot()['a']['requests'], 2)
+
+    @override_settings(AI_BREAKER_FAILURES=1, AI_RETRY_ATTEMPTS=0)
+    def test_open_breaker_fails_fast_when_no_provider_is_left(self):
+        router = Router([failing('a')])
+        with self.assertRaises(StubProviderError):
+            router.call('title', answer)
+        with self.assertRaises(CircuitOpen):
+            router.call('title', answer)
+        self.assertEqual(router.snapshot()['a']['short_circuited'], 1)
+
+    def test_non_retryable_errors_leave_breaker_closed(self):
+        router = Router([StubProvider('a')])
+
+        def broken(provider):
+            raise ValueError('bad request')
+
+        for _ in range(6):
+            with self.assertRaises(ValueError):
+                router.call('title', broken)
+        self.assertEqual(router.snapshot()['a']['circuit']['state'], CircuitBreaker.CLOSED)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+
+    def test_lets_one_trial_through_after_cooldown(self):
+        breaker = CircuitBreaker('a', failure_threshold=2, cooldown=0)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(breaker.allow())
+
+    def test_failed_trial_reopens(self):
+        breaker = CircuitBreaker('a', failure_threshold=1, cooldown=0)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(breaker.times_opened, 2)
+
+    def test_stays_open_during_cooldown(self):
+        breaker = CircuitBreaker('a', failure_threshold=1, cooldown=60)
+        breaker.record_failure()
+        self.assertFalse(breaker.available())
+        self.assertFalse(breaker.allow())
+
+
+@override_settings(AI_CACHE_ENABLED=True, AI_RETRY_ATTEMPTS=0, AI_HEDGE_OPERATIONS=[])
+class ResultCacheKeyTests(TestCase):
+
+    def service(self, providers, routes=None):
+        service = AIServiceProvider(providers, routes or {})
+        service.cache.clear()
+        return service
+
+    def test_result_from_fallback_provider_is_found_again(self):
+        service = self.service([failing('a'), StubProvider('b')])
+        result = service.simplify_chunk('Some text.')
+        self.assertEqual(service.peek('simplify', 'Some text.'), result)
+
+    def test_key_depends_on_routed_providers(self):
+        both = self.service([StubProvider('a'), StubProvider('b')])
+        both.simplify_chunk('Some text.')
+
+        self.assertIsNone(self.service([StubProvider('a')]).peek('simplify', 'Some text.'))
+        reordered = self.service([StubProvider('a'), StubProvider('b')], {'simplify': ['b', 'a']})
+        self.assertIsNone(reordered.peek('simplify', 'Some text.'))
+        self.assertIsNotNone(self.service([StubProvider('a'), StubProvider('b')]).peek('simplify', 'Some text.'))
+
+    def test_key_depends_on_operation_route(self):
+        service = self.service([StubProvider('a'), StubProvider('b')], {'title': ['b']})
+        self.assertNotEqual(service.cache_key('title', 'x'), service.cache_key('simplify', 'x'))
+        other = self.service([StubProvider('a'), StubProvider('b')], {'title': ['a']})
+        self.assertEqual(service.cache_key('simplify', 'x'), other.cache_key('simplify', 'x'))
+        self.assertNotEqual(service.cache_key('title', 'x'), other.cache_key('title', 'x'))
+
+
+class SplitTextTests(SimpleTestCase):
+
+    def test_text_within_budget_is_one_chunk(self):
+        text = '\n\n'.join(paragraphs(12, words=2))
+        self.assertEqual(split_text(text, 700), [text])
+
+    def test_chunks_fit_budget(self):
+        chunks = split_text('\n\n'.join(paragraphs(40)), 200)
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(estimate_tokens(chunk) <= 200 for chunk in chunks))
+
+    def test_edit_leaves_other_chunks_unchanged(self):
+        texts = paragraphs(40)
+        before = split_text('\n\n'.join(texts), 500)
+        texts[20] = 'An edited paragraph.'
+        after = split_text('\n\n'.join(texts), 500)
+        changed = set(before).symmetric_difference(after)
+        self.assertLessEqual(len(changed), 4)
+        self.assertEqual(before[0], after[0])
+        self.assertEqual(before[-1], after[-1])
+
+
+@override_settings(AI_CHUNK_TOKENS=100, AI_CACHE_ENABLED=False, AI_HEDGE_OPERATIONS=[])
+class ResimplifyTests(TestCase):
+
+    def setUp(self):
+        self.service = AIServiceProvider([StubProvider()])
+        patcher = mock.patch.object(resimplify, 'ai_service', self.service)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.texts = paragraphs(20, words=30)
+
+    def create_book(self, texts, split_pages=False):
+        text = '\n\n'.join(texts)
+        book = Book.objects.create(user_id='reader', original_text=text)
+        resimplify.add_simplified_pages(book, self.service.simplify_chunks(text), split_pages)
+        return book
+
+    def edit(self, book, texts):
+        previous_text = book.original_text
+        book.original_text = '\n\n'.join(texts)
+        book.save()
+        with mock.patch.object(self.service, 'simplify_chunk', wraps=self.service.simplify_chunk) as simplify:
+            resimplify.resimplify(book, previous_text)
+        book.refresh_from_db()
+        return simplify.call_count
+
+    def contents(self, book):
+        return [str(content) for content in book.pages.values_list('content', flat=True)]
+
+    def test_pages_store_their_blocks(self):
+        book = self.create_book(self.texts, split_pages=True)
+        blocks = list(book.blocks.all())
+        self.assertEqual(len(blocks), len(split_text(book.original_text, 100)))
+        self.assertEqual([block.page_id for block in blocks], list(book.pages.values_list('id', flat=True)))
+
+    def test_edit_resimplifies_changed_blocks_only(self):
+        book = self.create_book(self.texts, split_pages=True)
+        blocks = book.blocks.count()
+        self.texts[10] = 'A short replacement paragraph.'
+        calls = self.edit(book, self.texts)
+
+        self.assertGreaterEqual(calls, 1)
+        self.assertLess(calls, blocks)
+        self.assertIn('A short replacement paragraph.', '\n\n'.join(self.contents(book)))
+        self.assertEqual(self.contents(book), [block.simplified for block in book.blocks.all()])
+
+    def test_inserted_text_joins_existing_pages(self):
+        book = self.create_book(self.texts, split_pages=True)
+        pages = book.total_pages
+        self.texts.insert(10, 'An inserted paragraph.')
+        calls = self.edit(book, self.texts)
+
+        self.assertLessEqual(calls, 3)
+        self.assertEqual(book.total_pages, pages)
+        self.assertIn('An inserted paragraph.', '\n\n'.join(self.contents(book)))
+        self.assertEqual(
+            [block.digest for block in book.blocks.all()],
+            [resimplify.block_digest(text) for text in split_text(book.original_text, 100)]
+        )
+
+    def test_unchanged_text_sends_nothing(self):
+        book = self.create_book(self.texts)
+        self.assertEqual(self.edit(book, self.texts), 0)
+
+    def test_removed_blocks_remove_their_pages(self):
+        book = self.create_book(self.texts, split_pages=True)
+        pages = book.total_pages
+        self.edit(book, self.texts[:5])
+        self.assertLess(book.total_pages, pages)
+        self.assertEqual(list(book.pages.values_list('page_number', flat=True)), list(range(1, book.total_pages + 1)))
+
+    def test_added_pages_are_left_alone(self):
+        book = self.create_book(self.texts)
+        book.add_page('A page of its own')
+        self.texts[0] = 'A new opening.'
+        self.edit(book, self.texts)
+        self.assertEqual(self.contents(book)[-1], 'A page of its own')
+
+    def test_replaced_blocks_keep_their_pages(self):
+        book = self.create_book(self.texts, split_pages=True)
+        pages = book.total_pages
+        for index in range(8, 13):
+            self.texts[index] = f'Rewritten paragraph {index} ' + ' '.join(['other'] * 30)
+        calls = self.edit(book, self.texts)
+
+        self.assertGreater(calls, 1)
+        self.assertEqual(book.total_pages, pages)
+        self.assertEqual(
+            '\n\n'.join(self.contents(book)), '\n\n'.join(block.simplified for block in book.blocks.all())
+        )
+
+    def test_placeholder_pages_are_rewritten(self):
+        text = '\n\n'.join(self.texts)
+        book = Book.objects.create(user_id='reader', original_text=text)
+        resimplify.store_placeholders(book, book.add_pages(['First item', 'Second item', 'Third item']))
+        added = book.add_page('A page of its own')
+
+        self.texts[0] = 'A new opening.'
+        calls = self.edit(book, self.texts)
+
+        self.assertEqual(calls, len(split_text(book.original_text, 100)))
+        self.assertEqual(book.total_pages, 4)
+        contents = self.contents(book)
+        self.assertEqual('\n\n'.join(contents[:3]), '\n\n'.join(block.simplified for block in book.blocks.all()))
+        self.assertNotIn('item', '\n\n'.join(contents[:3]))
+        self.assertEqual(Page.objects.get(id=added.id).content, 'A page of its own')
+
+    def test_book_without_blocks_rewrites_its_first_page(self):
+        book = self.create_book(self.texts)
+        TextBlock.objects.filter(book=book).delete()
+        book.add_page('A page of its own')
+
+        self.texts[0] = 'A new opening.'
+        calls = self.edit(book, self.texts)
+
+        self.assertEqual(calls, len(split_text(book.original_text, 100)))
+        first, second = self.contents(book)
+        self.assertEqual(first, '\n\n'.join(block.simplified for block in book.blocks.all()))
+        self.assertEqual(second, 'A page of its own')
+
+
+class CounterTests(TestCase):
+
+    def test_increments_keep_first_expiry(self):
+        self.assertEqual(counters.incr('hits', 5, timeout=60), 5)
+        expires_at = SharedCounter.objects.get(key='hits').expires_at
+        self.assertEqual(counters.incr('hits', 3, timeout=3600), 8)
+        self.assertEqual(SharedCounter.objects.get(key='hits').expires_at, expires_at)
+
+    def test_expired_counter_starts_over(self):
+        counters.incr('hits', 5, timeout=60)
+        SharedCounter.objects.update(expires_at=F('expires_at') - timedelta(minutes=2))
+        self.assertEqual(counters.get('hits'), 0)
+        self.assertEqual(counters.incr('hits', 2, timeout=60), 2)
+        self.assertEqual(SharedCounter.objects.count(), 1)
+
+    def test_get_many_skips_missing_counters(self):
+        counters.incr('a', 1, timeout=60)
+        self.assertEqual(counters.get_many(['a', 'b']), {'a': 1})
+
+
+class OneClientThrottle(SlidingWindowThrottle):
+    scope = 'test'
+    rate = '2/m'
+
+    def get_ident_key(self, request):
+        return 'client'
+
+
+class ThrottleTests(TestCase):
+
+    def test_refuses_requests_over_the_rate(self):
+        allowed = [OneClientThrottle().allow_request(None, None) for _ in range(3)]
+        self.assertEqual(allowed, [True, True, False])
+
+    def test_refused_requests_are_not_counted(self):
+        throttle = OneClientThrottle()
+        for _ in range(5):
+            throttle.allow_request(None, None)
+        self.assertEqual(SharedCounter.objects.get().value, 2)
+        self.assertGreater(throttle.wait(), 0)
+
+    @override_settings(AI_DAILY_TOKEN_BUDGET=100)
+    def test_token_budget(self):
+        with usage.charged_to('reader'):
+            usage.record(60)
+            self.assertFalse(usage.budget_exhausted('reader'))
+            async_to_sync(usage.arecord)(40)
+        self.assertEqual(usage.used_today('reader'), 100)
+        self.assertTrue(usage.budget_exhausted('reader'))
+        self.assertFalse(usage.budget_exhausted('someone else'))
+
+
+class AddPagesTests(TransactionTestCase):
+
+    def test_concurrent_appends_get_consecutive_numbers(self):
+        book = Book.objects.create(user_id='reader', original_text='Text')
+        errors = []
+
+        def append(worker):
+            try:
+                Book.objects.get(id=book.id).add_pages([f'{worker}-{number}' for number in range(5)])
+            except Exception as e:
+                errors.append(e)
+            finally:
+                close_old_connections()
+
+        threads = [threading.Thread(target=append, args=(worker,)) for worker in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        book.refresh_from_db()
+        self.assertEqual(book.total_pages, 40)
+        self.assertEqual(list(book.pages.values_list('page_number', flat=True)), list(range(1, 41)))
+        # Each call's pages stay together
+        contents = [str(content) for content in book.pages.values_list('content', flat=True)]
+        for start in range(0, 40, 5):
+            self.assertEqual(len({content.split('-')[0] for content in contents[start:start + 5]}), 1)
+
+
+class CompressedTextFieldTests(TestCase):
+
+    text = 'Plain words, repeated plain words. ' * 50 + 'Ünïcödé ✓'
+
+    def test_round_trip(self):
+        book = Book.objects.create(user_id='reader', original_text=self.text)
+        self.assertEqual(Book.objects.get(id=book.id).original_text, self.text)
+
+    def test_stored_compressed(self):
+        book = Book.objects.create(user_id='reader', original_text=self.text)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT original_text FROM api_book WHERE id = %s', [book.id])
+            stored = bytes(cursor.fetchone()[0])
+        self.assertLess(len(stored), len(self.text.encode('utf-8')))
+        self.assertEqual(compression.decompress(stored), self.text)
+
+    def test_decompressed_on_first_read_only(self):
+        book = Book.objects.create(user_id='reader', original_text=self.text)
+        loaded = Book.objects.get(id=book.id)
+        self.assertIsInstance(loaded.__dict__['original_text'], CompressedText)
+        self.assertEqual(text_prefix(loaded, 'original_text', 11), 'Plain words')
+        self.assertIsInstance(loaded.__dict__['original_text'], CompressedText)
+        self.assertEqual(loaded.original_text, self.text)
+        self.assertIsInstance(loaded.__dict__['original_text'], str)
+
+    def test_values_list_returns_markers(self):
+        Book.objects.create(user_id='reader', original_text=self.text)
+        value = Book.objects.values_list('original_text', flat=True).get()
+        self.assertEqual(str(value), self.text)
+
+    def test_saving_other_fields_keeps_text(self):
+        book = Book.objects.create(user_id='reader', original_text=self.text)
+        loaded = Book.objects.get(id=book.id)
+        loaded.is_processed = True
+        loaded.save(update_fields=['is_processed'])
+        self.assertIsInstance(loaded.__dict__['original_text'], CompressedText)
+        loaded.save()
+        self.assertEqual(Book.objects.get(id=book.id).original_text, self.text)
+
+    @override_settings(TEXT_COMPRESSION='none')
+    def test_values_keep_their_codec(self):
+        raw = Book.objects.create(user_id='reader', original_text=self.text)
+        with override_settings(TEXT_COMPRESSION='zlib'):
+            self.assertEqual(Book.objects.get(id=raw.id).original_text, self.text)
+
+
+class CompressedTextMigrationTests(TransactionTestCase):
+
+    before = [('api', '0009_textblock')]
+    after = [('api', '0010_compressed_text')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_round_trip(self):
+        apps = self.migrate(self.before)
+        OldBook = apps.get_model('api', 'Book')
+        OldPage = apps.get_model('api', 'Page')
+        texts = ['Short.', 'Longer text, ' * 100, 'Ünïcödé ✓']
+        books = [OldBook.objects.create(user_id='reader', original_text=text) for text in texts]
+        for book in books:
+            OldPage.objects.create(book=book, page_number=1, content=book.original_text.upper())
+
+        apps = self.migrate(self.after)
+        NewBook = apps.get_model('api', 'Book')
+        for book, text in zip(books, texts):
+            stored = NewBook.objects.values_list('original_text', flat=True).get(id=book.id)
+            self.assertIsInstance(stored, CompressedText)
+            self.assertEqual(str(stored), text)
+        NewPage = apps.get_model('api', 'Page')
+        self.assertEqual(
+            sorted(str(content) for content in NewPage.objects.values_list('content', flat=True)),
+            sorted(text.upper() for text in texts)
+        )
+
+        apps = self.migrate(self.before)
+        OldBook = apps.get_model('api', 'Book')
+        self.assertEqual(
+            [OldBook.objects.get(id=book.id).original_text for book in books],
+            texts
+        )
+
+
+def encoded(image, format, **options):
+    buffer = io.BytesIO()
+    image.save(buffer, format=format, **options)
+    return buffer.getvalue()
+
+
+def screenshot(mode='RGB', background='white', size=(800, 600)):
+    image = Image.new(mode, size, background)
+    draw = ImageDraw.Draw(image)
+    for y in range(20, size[1] - 20, 24):
+        draw.text((20, y), 'The quick brown fox jumps over the lazy dog', fill='black')
+    return image
+
+
+@override_settings(
+    IMAGE_PREPROCESS_ENABLED=True, IMAGE_MAX_DIMENSION=1600, IMAGE_GRAYSCALE=True,
+    IMAGE_MAX_SKEW=0, IMAGE_JPEG_QUALITY=80,
+)
+class PrepareImageTests(SimpleTestCase):
+
+    def test_screenshots_do_not_grow(self):
+        source = encoded(screenshot(), 'PNG')
+        data, media_type = prepare_image(source)
+        self.assertLessEqual(len(data), len(source))
+        self.assertIn(media_type, ('image/png', 'image/jpeg'))
+
+    def test_small_jpeg_kept_when_reencoding_does_not_shrink_it(self):
+        source = encoded(screenshot().convert('L'), 'JPEG', quality=30)
+        self.assertEqual(prepare_image(source), (source, 'image/jpeg'))
+
+    def test_large_images_are_shrunk(self):
+        source = encoded(screenshot(size=(3200, 2400)), 'PNG')
+        data, media_type = prepare_image(source)
+        self.assertEqual(Image.open(io.BytesIO(data)).size, (1600, 1200))
+
+    def test_transparency_becomes_white(self):
+        source = encoded(screenshot('RGBA', (0, 0, 0, 0)), 'PNG')
+        data, media_type = prepare_image(source)
+        image = Image.open(io.BytesIO(data)).convert('L')
+        self.assertEqual(image.getpixel((5, 5)), 255)
+
+
+@override_settings(SEARCH_SNIPPET_WORDS=16, AI_CHUNK_TOKENS=100, AI_CACHE_ENABLED=False, AI_HEDGE_OPERATIONS=[])
+class SearchIndexTests(TestCase):
+
+    def search(self, query, user_id='reader'):
+        return search_index.search(user_id, query, 10)
+
+    def indexed_rows(self, book):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {search_index.TABLE} WHERE book_id = %s', [book.id])
+            return cursor.fetchone()[0]
+
+    def test_new_books_and_pages_are_indexed(self):
+        book = Book.objects.create(user_id='reader', title='Moby Dick', original_text='Call me Ishmael.')
+        book.add_pages(['The whale surfaced.', 'The harpoon missed.'])
+
+        [hit] = self.search('harpoon')
+        self.assertEqual((hit['book_id'], hit['page_number']), (book.id, 2))
+        [hit] = self.search('ishmael')
+        self.assertIsNone(hit['page_number'])
+        self.assertEqual(hit['title'], 'Moby Dick')
+
+    def test_edits_are_reindexed(self):
+        book = Book.objects.create(user_id='reader', title='Draft', original_text='Old wording.')
+        book.title = 'Final'
+        book.original_text = 'New wording.'
+        book.save()
+
+        self.assertEqual(self.search('draft'), [])
+        self.assertEqual(self.search('old'), [])
+        self.assertEqual(len(self.search('final')), 1)
+        self.assertEqual(len(self.search('new wording')), 1)
+
+    def test_resimplified_pages_are_reindexed(self):
+        service = AIServiceProvider([StubProvider()])
+        texts = paragraphs(20, words=30)
+        book = Book.objects.create(user_id='reader', original_text='\n\n'.join(texts))
+        with mock.patch.object(resimplify, 'ai_service', service):
+            resimplify.add_simplified_pages(book, service.simplify_chunks(book.original_text), split_pages=True)
+            previous_text = book.original_text
+            book.original_text = '\n\n'.join(texts[:5] + ['Zanzibar'])
+            book.save()
+            resimplify.resimplify(book, previous_text)
+
+        book.refresh_from_db()
+        self.assertEqual(self.indexed_rows(book), book.total_pages + 1)
+        self.assertIn(book.pages.last().page_number, [hit['page_number'] for hit in self.search('zanzibar')])
+
+    def test_deleted_books_are_removed_in_one_statement(self):
+        book = Book.objects.create(user_id='reader', original_text='Text')
+        book.add_pages([f'Page {number} about lighthouses' for number in range(50)])
+        self.assertEqual(self.indexed_rows(book), 51)
+
+        with CaptureQueriesContext(connection) as queries:
+            book.delete()
+        self.assertEqual(self.indexed_rows(book), 0)
+        self.assertEqual(self.search('lighthouses'), [])
+        self.assertEqual(sum(search_index.TABLE in query['sql'] for query in queries.captured_queries), 1)
+        self.assertLess(len(queries), 10)
+
+    def test_results_are_scoped_to_the_user(self):
+        Book.objects.create(user_id='reader', original_text='A shared secret.')
+        Book.objects.create(user_id='someone else', original_text='Another shared secret.')
+
+        self.assertEqual(len(self.search('secret')), 1)
+        self.assertEqual(len(self.search('secret', user_id='someone else')), 1)
+        self.assertEqual(self.search('secret', user_id='nobody'), [])
+
+    def test_title_matches_rank_first(self):
+        in_text = Book.objects.create(user_id='reader', title='Notes', original_text='Something about gardens.')
+        in_title = Book.objects.create(user_id='reader', title='Gardens', original_text='Something else.')
+        # bm25 needs the word to be rare to give it any weight
+        for number in range(10):
+            Book.objects.create(user_id='reader', title=f'Filler {number}', original_text='Unrelated text.')
+
+        hits = self.search('gardens')
+        self.assertEqual([hit['book_id'] for hit in hits], [in_title.id, in_text.id])
+        self.assertGreater(hits[0]['rank'], hits[1]['rank'])
+
+    def test_snippets_are_escaped(self):
+        Book.objects.create(user_id='reader', original_text='Use <script>alert(1)</script> & marvel.')
+
+        [hit] = self.search('marvel')
+        self.assertNotIn('<script>', hit['snippet'])
+        self.assertIn('&lt;script&gt;', hit['snippet'])
+        self.assertIn('&amp; <mark>marvel</mark>', hit['snippet'])
+
+    def test_fts_syntax_is_quoted(self):
+        Book.objects.create(user_id='reader', title='Plain', original_text='Alpha beta gamma.')
+
+        for query in ['alpha AND', 'NEAR(alpha', '"alpha', 'alpha*', 'title:plain', 'alpha OR delta', '-beta', '^alpha']:
+            with self.subTest(query=query):
+                self.search(query)
+        # Every word must match, so operators are just words
+        self.assertEqual(self.search('alpha OR delta'), [])
+        self.assertEqual(len(self.search('alpha beta')), 1)
+        self.assertEqual(self.search('!!!'), [])
+
+    def test_search_view(self):
+        Book.objects.create(user_id='reader', original_text='Find the needle.')
+        client = Client()
+
+        response = client.get('/api/books/search/', {'userId': 'reader', 'q': 'needle'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 1)
+        self.assertEqual(client.get('/api/books/search/', {'userId': 'reader'}).status_code, 400)
+
+
+class JobClaimTests(TransactionTestCase):
+
+    @override_settings(AI_JOB_WORKERS=0)
+    def test_each_job_is_claimed_once(self):
+        queued = [jobs.enqueue(Job.UPLOAD_IMAGE, 'reader').id for _ in range(5)]
+        claimed = []
+        errors = []
+
+        def claim():
+            try:
+                while (job := jobs.claim_next()) is not None:
+                    claimed.append(job.id)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                close_old_connections()
+
+        threads = [threading.Thread(target=claim) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(claimed), sorted(queued))
+        self.assertEqual(set(Job.objects.values_list('status', flat=True)), {Job.RUNNING})
+
+
+@override_settings(AI_JOB_WORKERS=0, AI_JOB_MAX_ATTEMPTS=3, AI_CACHE_ENABLED=False, AI_HEDGE_OPERATIONS=[])
+class RunJobTests(TransactionTestCase):
+    # Simplifying records usage from pool threads, which would wait on a TestCase's open transaction
+
+    def setUp(self):
+        self.service = AIServiceProvider([StubProvider()])
+        patcher = mock.patch.object(jobs, 'ai_service', self.service)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.book = Book.objects.create(user_id='reader', original_text='Some text.', is_processed=False)
+
+    def enqueue(self, kind, text='Queued text.'):
+        page = self.book.add_page('')
+        return jobs.enqueue(kind, 'reader', book=self.book, page=page, text=text)
+
+    def run_next(self):
+        return jobs.run_job(jobs.claim_next())
+
+    def test_process_text_fills_its_page(self):
+        job = self.enqueue(Job.PROCESS_TEXT)
+        job = self.run_next()
+
+        self.assertEqual(job.status, Job.DONE)
+        self.book.refresh_from_db()
+        self.assertTrue(self.book.is_processed)
+        self.assertNotEqual(str(Page.objects.get(id=job.page_id).content), '')
+        self.assertEqual(list(self.book.blocks.values_list('page_id', flat=True)), [job.page_id])
+
+    def test_failed_job_removes_its_placeholder(self):
+        self.book.add_page('Before')
+        job = self.enqueue(Job.ADD_PAGE)
+        self.book.add_page('After')
+        with mock.patch.object(self.service, 'simplify_text', side_effect=ValueError('Bad input')):
+            job = self.run_next()
+
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(Job.objects.get(id=job.id).error, 'Bad input')
+        self.assertIsNone(Job.objects.get(id=job.id).page_id)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.total_pages, 2)
+        self.assertEqual(
+            [(page.page_number, str(page.content)) for page in self.book.pages.all()],
+            [(1, 'Before'), (2, 'After')]
+        )
+        # The book's other pages are all there
+        self.assertTrue(self.book.is_processed)
+
+    def test_failed_process_text_leaves_book_unprocessed(self):
+        self.enqueue(Job.PROCESS_TEXT)
+        with mock.patch.object(self.service, 'simplify_and_title', side_effect=ValueError('Bad input')):
+            self.run_next()
+
+        self.book.refresh_from_db()
+        self.assertFalse(self.book.is_processed)
+        self.assertEqual(self.book.total_pages, 0)
+
+    def test_busy_providers_requeue_until_attempts_run_out(self):
+        job = self.enqueue(Job.ADD_PAGE)
+        with mock.patch.object(self.service, 'simplify_text', side_effect=ProviderBusy('busy')):
+            for attempt in range(1, 3):
+                job = self.run_next()
+                self.assertEqual((job.status, job.attempts), (Job.PENDING, attempt))
+            job = self.run_next()
+
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 3))
+        self.assertIn('busy', job.error)
+        self.assertIsNone(jobs.claim_next())
+        self.assertEqual(self.book.pages.count(), 0)
+
+    def test_stale_running_jobs_are_requeued(self):
+        stale = self.enqueue(Job.ADD_PAGE)
+        fresh = self.enqueue(Job.ADD_PAGE)
+        Job.objects.update(status=Job.RUNNING)
+        Job.objects.filter(id=stale.id).update(updated_at=F('updated_at') - timedelta(hours=1))
+
+        with override_settings(AI_JOB_TIMEOUT=600):
+            self.assertEqual(jobs.requeue_stale(), 1)
+        self.assertEqual(Job.objects.get(id=stale.id).status, Job.PENDING)
+        self.assertEqual(Job.objects.get(id=fresh.id).status, Job.RUNNING)
+
+    def test_job_status_view(self):
+        job = self.enqueue(Job.ADD_PAGE)
+        client = Client()
+        url = f'/api/jobs/{job.id}/'
+
+        response = client.get(url, {'userId': 'reader'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], Job.PENDING)
+        self.assertNotIn('book', response.json())
+
+        self.run_next()
+        response = client.get(url, {'userId': 'reader'})
+        self.assertEqual(response.json()['status'], Job.DONE)
+        self.assertEqual(response.json()['book']['id'], self.book.id)
+
+        self.assertEqual(client.get(url, {'userId': 'someone else'}).status_code, 404)
+        self.assertEqual(client.get(url).status_code, 400)
+
+
+class StubServiceMixin:
+    """Send every AI call in the views through a StubProvider"""
+
+    def setUp(self):
+        super().setUp()
+        self.service = AIServiceProvider([StubProvider()])
+        for module in (ai_service, bulk_import, jobs, resimplify, views):
+            patcher = mock.patch.object(module, 'ai_service', self.service)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        caches['books'].clear()
+        self.client = Client()
+
+    def add_page(self, book, text='Another page.'):
+        response = self.client.post(
+            f'/api/books/{book.id}/add-page/', {'userId': book.user_id, 'text': text}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def update(self, book, **data):
+        response = self.client.patch(
+            f'/api/books/{book.id}/update/', {'userId': book.user_id, **data}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        return response
+
+
+@override_settings(AI_CACHE_ENABLED=False, AI_HEDGE_OPERATIONS=[], AI_JOB_WORKERS=0)
+class ConditionalGetTests(StubServiceMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.book = Book.objects.create(user_id='reader', title='Book', original_text='Text')
+        self.book.add_page('First page')
+        self.url = f'/api/books/{self.book.id}/'
+
+    def get(self, url, **headers):
+        return self.client.get(url, {'userId': 'reader'}, headers=headers)
+
+    def test_matching_etag_gets_304(self):
+        response = self.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get(self.url, if_none_match=response['ETag']).status_code, 304)
+
+    def test_unmodified_since_gets_304(self):
+        response = self.get(self.url)
+        self.assertEqual(self.get(self.url, if_modified_since=response['Last-Modified']).status_code, 304)
+
+    def test_etag_varies_with_the_query(self):
+        response = self.get(self.url)
+        other = self.client.get(self.url, {'userId': 'reader', 'fields': 'id,title'})
+        self.assertNotEqual(response['ETag'], other['ETag'])
+
+    def test_etag_changes_after_add_page(self):
+        etag = self.get(self.url)['ETag']
+        self.add_page(self.book)
+
+        response = self.get(self.url, if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['total_pages'], 2)
+
+    def test_etag_changes_after_update(self):
+        etag = self.get(self.url)['ETag']
+        self.update(self.book, title='Renamed')
+
+        response = self.get(self.url, if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['title'], 'Renamed')
+
+    def test_list_etag_changes_after_delete(self):
+        older = Book.objects.create(user_id='reader', title='Older', original_text='Text')
+        Book.objects.filter(id=older.id).update(last_edited=F('last_edited') - timedelta(days=1))
+        etag = self.get('/api/books/')['ETag']
+
+        # The newest last_edited is unchanged; only the count tells
+        older.delete()
+        response = self.get('/api/books/', if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([book['id'] for book in response.json()], [self.book.id])
+
+    def test_deleted_book_is_not_found(self):
+        etag = self.get(self.url)['ETag']
+        self.book.delete()
+        self.assertEqual(self.get(self.url, if_none_match=etag).status_code, 404)
+
+    def test_lists_carry_no_last_modified(self):
+        response = self.get('/api/books/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('ETag', response)
+        self.assertNotIn('Last-Modified', response)
+        self.assertIn('Last-Modified', self.get(self.url))
+
+
+@override_settings(BOOK_CACHE_TTL=300, AI_CACHE_ENABLED=False, AI_HEDGE_OPERATIONS=[], AI_JOB_WORKERS=0)
+class BookCacheTests(StubServiceMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.book = Book.objects.create(user_id='reader', title='Book', original_text='Text')
+        self.book.add_page('First page')
+
+    def get_book(self):
+        return self.client.get(f'/api/books/{self.book.id}/', {'userId': 'reader'}).json()
+
+    def get_books(self):
+        return self.client.get('/api/books/', {'userId': 'reader'}).json()
+
+    def test_reads_are_cached(self):
+        self.get_book()
+        with mock.patch.object(views, 'BookSerializer', side_effect=AssertionError('not cached')):
+            self.assertEqual(self.get_book()['title'], 'Book')
+
+    def test_book_changes_after_add_page(self):
+        self.get_book()
+        self.get_books()
+        self.add_page(self.book, 'A second page')
+
+        self.assertEqual(len(self.get_book()['pages']), 2)
+        self.assertEqual(self.get_books()[0]['total_pages'], 2)
+
+    def test_book_changes_after_update(self):
+        self.get_book()
+        self.get_books()
+        self.update(self.book, title='Renamed')
+
+        self.assertEqual(self.get_book()['title'], 'Renamed')
+        self.assertEqual(self.get_books()[0]['title'], 'Renamed')
+
+    def test_list_changes_after_delete(self):
+        self.assertEqual(len(self.get_books()), 1)
+        self.book.delete()
+        self.assertEqual(self.get_books(), [])
+
+    def test_saves_invalidate_even_an_unchanged_version(self):
+        build = mock.Mock(side_effect=['before', 'after'])
+        scope = book_cache.book_scope(self.book.id)
+
+        self.assertEqual(book_cache.read_through(scope, 'version', 'path', build), 'before')
+        self.assertEqual(book_cache.read_through(scope, 'version', 'path', build), 'before')
+        self.book.save(update_fields=['is_processed'])
+        self.assertEqual(book_cache.read_through(scope, 'version', 'path', build), 'after')
+
+
+@override_settings(AI_CACHE_ENABLED=False, AI_HEDGE_OPERATIONS=[], AI_JOB_WORKERS=0)
+class ImportBookTests(StubServiceMixin, TransactionTestCase):
+    # Items are simplified on pool threads, which would wait on a TestCase's open transaction
+
+    def setUp(self):
+        super().setUp()
+        simplify_chunk = self.service.simplify_chunk
+
+        def failing_on_request(chunk):
+            if 'FAIL' in chunk:
+                raise StubProviderError(f'Could not simplify {chunk!r}')
+            return simplify_chunk(chunk)
+
+        patcher = mock.patch.object(self.service, 'simplify_chunk', side_effect=failing_on_request)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, texts, **data):
+        return self.client.post('/api/import/', {'userId': 'reader', 'texts': texts, **data}, content_type='application/json')
+
+    def test_failures_are_reported_per_item(self):
+        response = self.post(['First item', 'FAIL second item', 'Third item'])
+
+        self.assertEqual(response.status_code, 200)
+        items = response.json()['items']
+        self.assertEqual([item['status'] for item in items], ['done', 'failed', 'done'])
+        self.assertIn('FAIL second item', items[1]['error'])
+        self.assertNotIn('page_number', items[1])
+
+    def test_pages_follow_input_order_skipping_failures(self):
+        texts = [f'Item {number}' if number % 3 else f'FAIL item {number}' for number in range(8)]
+        response = self.post(texts)
+
+        items = response.json()['items']
+        book = Book.objects.get(id=response.json()['book']['id'])
+        pages = {page.page_number: str(page.content) for page in book.pages.all()}
+        done = [item for item in items if item['status'] == 'done']
+        self.assertEqual([item['page_number'] for item in done], list(range(1, len(done) + 1)))
+        for item in done:
+            self.assertEqual(pages[item['page_number']], texts[item['index']])
+        self.assertEqual(book.total_pages, len(done))
+
+    def test_all_failing_creates_nothing(self):
+        response = self.post(['FAIL one', 'FAIL two'])
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual([item['status'] for item in response.json()['items']], ['failed', 'failed'])
+        self.assertFalse(Book.objects.exists())
+
+    def test_new_book(self):
+        response = self.post(['First item', 'FAIL second item', 'Third item'])
+
+        book = Book.objects.get(id=response.json()['book']['id'])
+        self.assertEqual(book.user_id, 'reader')
+        self.assertEqual(book.title, 'First item')
+        self.assertEqual(book.original_text, 'First item\n\nThird item')
+        self.assertTrue(book.is_processed)
+        # Imported pages are placeholders until the first edit
+        self.assertEqual(
+            list(book.blocks.values_list('page_id', 'digest')),
+            [(page_id, resimplify.PLACEHOLDER) for page_id in book.pages.values_list('id', flat=True)]
+        )
+
+    def test_existing_book(self):
+        book = Book.objects.create(user_id='reader', title='Mine', original_text='Text')
+        book.add_pages(['Page one', 'Page two'])
+        response = self.post(['New item', 'FAIL item', 'Last item'], bookId=book.id)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item.get('page_number') for item in response.json()['items']], [3, None, 4])
+        self.assertEqual(Book.objects.count(), 1)
+        book.refresh_from_db()
+        self.assertEqual((book.title, book.original_text, book.total_pages), ('Mine', 'Text', 4))
+        self.assertFalse(book.blocks.exists())
+
+    def test_other_users_book_is_not_found(self):
+        book = Book.objects.create(user_id='someone else', original_text='Text')
+        self.assertEqual(self.post(['Item'], bookId=book.id).status_code, 404)
+        self.assertEqual(book.pages.count(), 0)
+
+
+@override_settings(AI_CACHE_ENABLED=False, AI_HEDGE_OPERATIONS=[])
+class ExtractBatchTests(TestCase):
+
+    def setUp(self):
+        self.provider = StubProvider()
+        self.service = AIServiceProvider([self.provider])
+        self.images = [(f'image {number}'.encode(), 'image/png') for number in range(1, 4)]
+
+    def extract(self, reply=None):
+        """Run _extract_batch, answering batched requests with reply if given"""
+        read_images = self.provider.read_images
+
+        def batch_reply(content, max_tokens, timeout):
+            if reply is not None and sum(not isinstance(part, str) for part in content) > 1:
+                return reply
+            return read_images(content, max_tokens, timeout)
+
+        with mock.patch.object(self.provider, 'read_images', side_effect=batch_reply) as requests:
+            results = self.service._extract_batch(self.images)
+        return results, requests.call_count
+
+    def test_sections_are_split_at_markers(self):
+        results, requests = self.extract()
+        self.assertEqual(results, [f'Stub text for image {number}' for number in range(1, 4)])
+        self.assertEqual(requests, 1)
+
+    def test_text_before_the_first_marker_is_ignored(self):
+        results, requests = self.extract(
+            'Here is the text:\n=== IMAGE 1 ===\nOne\n  === IMAGE 2 ===  \nTwo\n\n=== IMAGE 3 ===\nThree\n'
+        )
+        self.assertEqual(results, ['One', 'Two', 'Three'])
+        self.assertEqual(requests, 1)
+
+    def test_mismatched_sections_fall_back_to_one_request_per_image(self):
+        replies = [
+            'No markers at all',
+            '=== IMAGE 1 ===\nOne\n=== IMAGE 3 ===\nThree',
+            '=== IMAGE 2 ===\nTwo\n=== IMAGE 1 ===\nOne\n=== IMAGE 3 ===\nThree',
+            '=== IMAGE 1 ===\nOne\n=== IMAGE 2 ===\nTwo\n=== IMAGE 3 ===\nThree\n=== IMAGE 4 ===\nFour',
+        ]
+        for reply in replies:
+            with self.subTest(reply=reply):
+                results, requests = self.extract(reply)
+                self.assertEqual(results, ['Stub text for image'] * 3)
+                self.assertEqual(requests, 1 + len(self.images))
+
+    def test_single_image_is_sent_without_markers(self):
+        self.images = self.images[:1]
+        results, requests = self.extract()
+        self.assertEqual(results, ['Stub text for image'])
+        self.assertEqual(requests, 1)
@@ -0,0 +1,99 @@
+import time
+
+from django.conf import settings
+from rest_framework.throttling import BaseThrottle
+
+from .services import counters, usage
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+
+def parse_rate(rate):
+    """
+    Parse a '<count>/<period>' rate such as '30/m'.
+
+    Returns:
+        tuple: (count, window in seconds), or (0, 0) when rate is empty or 0
+    """
+    if not rate or rate == '0':
+        return 0, 0
+    count, period = rate.split('/')
+    return int(count), PERIODS[period[0]]
+
+
+class SlidingWindowThrottle(BaseThrottle):
+    """
+    Allow at most `rate` requests per client over a sliding window.
+
+    Requests are counted per fixed window in shared counters. The previous
+    window's count is weighed by how much of it the sliding window still
+    covers, which approximates a request log with two counters per client.
+    A request is counted before it is checked, and taken back if it is
+    refused, so concurrent requests cannot all slip in under the limit.
+    """
+    scope = None
+    rate = None
+
+    def __init__(self):
+        self.limit, self.window = parse_rate(self.rate)
+        self.retry_in = None
+
+    def get_ident_key(self, request):
+        """The client to count the request against, or None to let it through"""
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        ident = self.get_ident_key(request) if self.limit else None
+        if ident is None:
+            return True
+        index, elapsed = divmod(time.time(), self.window)
+        previous_key, current_key = (f'throttle:{self.scope}:{ident}:{int(number)}' for number in (index - 1, index))
+        # Requests already counted in this window, not including this one
+        current = counters.incr(current_key, timeout=2 * self.window) - 1
+        previous = counters.get(previous_key)
+
+        if previous * (1 - elapsed / self.window) + current >= self.limit:
+            counters.incr(current_key, -1, timeout=2 * self.window)
+            if current >= self.limit:
+                # The weighted count only drops below the limit during the next window
+                self.retry_in = self.window - elapsed + self.window * (1 - self.limit / current)
+            else:
+                self.retry_in = self.window * (1 - (self.limit - current) / previous) - elapsed
+            return False
+        return True
+
+    def wait(self):
+        return max(self.retry_in, 0) if self.retry_in is not None else None
+
+
+class UserRateThrottle(SlidingWindowThrottle):
+    """Limit AI requests per userId"""
+    scope = 'user'
+    rate = settings.AI_USER_RATE
+
+    def get_ident_key(self, request):
+        return usage.request_user(request)
+
+
+class IPRateThrottle(SlidingWindowThrottle):
+    """Limit AI requests per client address, whichever userId they claim"""
+    scope = 'ip'
+    rate = settings.AI_IP_RATE
+
+    def get_ident_key(self, request):
+        return self.get_ident(request)
+
+
+class TokenBudgetThrottle(BaseThrottle):
+    """Turn a user away once the tokens charged to them today reach AI_DAILY_TOKEN_BUDGET"""
+
+    def allow_request(self, request, view):
+        user_id = usage.request_user(request)
+        return user_id is None or not usage.budget_exhausted(user_id)
+
+    def wait(self):
+        return usage.seconds_until_reset()
+
+
+# Checked before any endpoint that calls an AI provider
+AI_THROTTLES = [IPRateThrottle, UserRateThrottle, TokenBudgetThrottle]
@@ -3,9 +3,17 @@ from . import views
 
 urlpatterns = [
     path('books/', views.get_all_books),
+    path('books/search/', views.search_books),
     path('process/', views.process_text),
+    path('process/stream/', views.process_text_stream),
     path('books/<int:book_id>/', views.get_book),
+    path('books/<int:book_id>/pages/', views.get_pages),
     path('books/<int:book_id>/update/', views.update_book),
     path('books/<int:book_id>/add-page/', views.add_page),
+    path('books/<int:book_id>/add-page/stream/', views.add_page_stream),
+    path('import/', views.import_book),
     path('upload-image/', views.upload_image),
+    path('upload-images/', views.upload_images),
+    path('jobs/<int:job_id>/', views.get_job),
+    path('metrics/', views.ai_metrics),
 ]
\ No newline at end of file
@@ -1,16 +1,217 @@
 from rest_framework import status
-from rest_framework.decorators import api_view, parser_classes
+from rest_framework.decorators import api_view, parser_classes, throttle_classes
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.response import Response
-from django.shortcuts import get_object_or_404
-import base64
-from .models import Book, Page
-from .serializers import BookSerializer
-from .services.ai_service import simplify_text, suggest_title, extract_text_from_image
+from rest_framework.utils.encoders import JSONEncoder
+from adrf.decorators import api_view as async_api_view
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+from django.http import StreamingHttpResponse
+from django.shortcuts import aget_object_or_404, get_object_or_404
+from django.views.decorators.http import condition
+from asgiref.sync import sync_to_async
+import hashlib
+import json
+from .models import Book, Page, Job
+from .pagination import BookCursorPagination
+from .serializers import BookSerializer, BookSummarySerializer, PageSerializer
+from .throttling import AI_THROTTLES
+from .services import book_cache, jobs, search_index, usage
+from .services.resimplify import add_simplified_pages, resimplify, store_placeholders
+from .services.bulk_import import simplify_items
+from .services.images import ImageTooLarge, InvalidImage, check_upload_size, prepare_image
+from .services.ai_service import (
+    ProviderBusy, ai_service, asimplify_chunks, asimplify_and_title, stream_simplify_text,
+    aextract_text_from_image, extract_text_from_images
+)
 import logging
 
 logger = logging.getLogger(__name__)
 
+def request_flag(request, name):
+    """Read a boolean option from the request body or query string"""
+    value = request.data.get(name, request.GET.get(name, False))
+    return value is True or str(value).lower() in ('1', 'true', 'yes')
+
+def job_accepted(job):
+    """Build the 202 response returned for a queued job"""
+    return Response({
+        'job_id': job.id,
+        'status': job.status,
+        'book_id': job.book_id,
+        'status_url': f'/api/jobs/{job.id}/',
+    }, status=status.HTTP_202_ACCEPTED)
+
+def requested_fields(request, serializer_class):
+    """
+    Parse the `fields` and `include` query parameters against serializer_class.
+
+    `fields` replaces the serializer's defaults; `include` adds the fields
+    the serializer only returns on request, e.g. include=original.
+
+    Returns:
+        list: Requested field names, or the serializer's defaults
+
+    Raises:
+        ValueError: If an unknown field or include is requested
+    """
+    value = request.GET.get('fields')
+    if value:
+        fields = [name.strip() for name in value.split(',') if name.strip()]
+        unknown = set(fields) - set(serializer_class.Meta.fields)
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    else:
+        fields = list(getattr(serializer_class, 'default_fields', serializer_class.Meta.fields))
+    includes = getattr(serializer_class, 'includes', {})
+    names = [name.strip() for name in request.GET.get('include', '').split(',') if name.strip()]
+    unknown = set(names) - set(includes)
+    if unknown:
+        raise ValueError(f"Unknown include: {', '.join(sorted(unknown))}")
+    fields += [includes[name] for name in names if includes[name] not in fields]
+    return fields
+
+def books_for_user(user_id, fields):
+    """Load only the columns and relations needed to serialize fields"""
+    columns = {field.name for field in Book._meta.concrete_fields}
+    names = [name for name in fields if name in columns]
+    if 'excerpt' in fields:
+        # The excerpt is decompressed from the start of the stored text
+        names.append('original_text')
+    books = Book.objects.filter(user_id=user_id).only('id', 'last_edited', *names)
+    if 'pages' in fields:
+        books = books.prefetch_related('pages')
+    return books
+
+def book_version(request, book_id=None):
+    """
+    Look up the values that change whenever the requested book(s) change.
+
+    The result is kept on the request so the ETag and Last-Modified
+    callbacks share one query.
+
+    Returns:
+        dict: last_edited plus total_pages, or the book count and page
+            total when listing; None if nothing matches
+    """
+    if not hasattr(request, '_book_version'):
+        books = Book.objects.filter(user_id=request.GET.get('userId'))
+        if book_id is None:
+            version = books.aggregate(
+                last_edited=Max('last_edited'),
+                count=Count('id'),
+                total_pages=Sum('total_pages')
+            )
+        else:
+            version = books.filter(id=book_id).values('last_edited', 'total_pages').first()
+        if version is not None and version['last_edited'] is None:
+            version = None
+        request._book_version = version
+    return request._book_version
+
+def book_etag(request, book_id=None):
+    """ETag for a book read, varying with the query string"""
+    version = book_version(request, book_id)
+    if version is None:
+        return None
+    state = repr((sorted(version.items()), request.get_full_path()))
+    return hashlib.sha1(state.encode('utf-8')).hexdigest()
+
+def book_last_modified(request, book_id=None):
+    """
+    Last-Modified for a single book read.
+
+    Lists get none: deleting any book but the newest leaves the newest
+    last_edited unchanged, so only their ETag, which counts the books,
+    notices the deletion.
+    """
+    if book_id is None:
+        return None
+    version = book_version(request, book_id)
+    return version['last_edited'] if version else None
+
+def import_items(request):
+    """
+    Read the ordered import items from a request.
+
+    `items` is a list (or a JSON string, for multipart requests) of
+    {"text": ...} or {"image": "<upload field name>"} entries. Without it,
+    the `texts` values are followed by the files uploaded as `images`.
+
+    Returns:
+        list: Dicts holding either 'text' or 'image' (an uploaded file)
+
+    Raises:
+        ValueError: If the items are malformed
+    """
+    items = request.data.get('items')
+    if isinstance(items, str):
+        items = json.loads(items)
+    if items is None:
+        texts = request.data.getlist('texts') if hasattr(request.data, 'getlist') else request.data.get('texts', [])
+        items = [{'text': text} for text in texts]
+        items += [{'image': image} for image in request.FILES.getlist('images')]
+    if not isinstance(items, list) or not items:
+        raise ValueError('At least one text or image is required')
+    if len(items) > settings.BULK_IMPORT_MAX_ITEMS:
+        raise ValueError(f'At most {settings.BULK_IMPORT_MAX_ITEMS} items can be imported at once')
+
+    parsed = []
+    for index, item in enumerate(items):
+        image = item.get('image') if isinstance(item, dict) else None
+        if isinstance(image, str):
+            image = request.FILES.get(image)
+            if image is None:
+                raise ValueError(f'Item {index} refers to a missing upload')
+        if image is not None:
+            try:
+                check_upload_size(image)
+            except ImageTooLarge as e:
+                raise ValueError(f'Item {index}: {e}')
+            parsed.append({'image': image})
+        elif isinstance(item, dict) and isinstance(item.get('text'), str) and item['text'].strip():
+            parsed.append({'text': item['text']})
+        else:
+            raise ValueError(f'Item {index} needs a non-empty text or an image')
+    return parsed
+
+@sync_to_async
+def book_data(book):
+    """Serialize book with its pages from an async view"""
+    return BookSerializer(book).data
+
+def sse_event(data, event=None):
+    """Format a Server-Sent Event carrying JSON data"""
+    message = f'event: {event}\n' if event else ''
+    return message + f'data: {json.dumps(data, cls=JSONEncoder)}\n\n'
+
+async def iterate_in_thread(iterator):
+    """Drive a blocking iterator from a thread so ASGI can flush each item"""
+    done = object()
+    try:
+        while True:
+            item = await sync_to_async(next, thread_sensitive=False)(iterator, done)
+            if item is done:
+                return
+            yield item
+    finally:
+        # Let a generator clean up when the client disconnects part way
+        if hasattr(iterator, 'close'):
+            await sync_to_async(iterator.close, thread_sensitive=False)()
+
+def event_stream(request, events):
+    """Build a text/event-stream response that flushes every event"""
+    if isinstance(request._request, ASGIRequest):
+        # Django buffers synchronous iterators under ASGI
+        events = iterate_in_thread(events)
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@condition(etag_func=book_etag, last_modified_func=book_last_modified)
 @api_view(['GET'])
 def get_all_books(request):
     """Get all books for a specific user"""
@@ -21,12 +222,57 @@ def get_all_books(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    books = Book.objects.filter(user_id=user_id)
-    serializer = BookSerializer(books, many=True)
-    return Response(serializer.data)
+    summary = request_flag(request, 'summary')
+    serializer_class = BookSummarySerializer if summary else BookSerializer
+    try:
+        fields = requested_fields(request, serializer_class)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    def build():
+        books = books_for_user(user_id, fields)
+        # Summaries are always paginated; full books only when a page is asked for
+        if summary or 'cursor' in request.GET or 'limit' in request.GET:
+            paginator = BookCursorPagination()
+            page = paginator.paginate_queryset(books, request)
+            serializer = serializer_class(page, many=True, fields=fields)
+            return paginator.get_paginated_response(serializer.data).data
+        return serializer_class(books, many=True, fields=fields).data
+    
+    payload = book_cache.read_through(
+        book_cache.user_scope(user_id), book_version(request),
+        request.get_full_path(), build
+    )
+    return Response(payload)
 
-@api_view(['POST'])
-def process_text(request):
+@api_view(['GET'])
+def search_books(request):
+    """Search the titles, texts and pages of a user's books"""
+    user_id = request.GET.get('userId')
+    query = request.GET.get('q', '').strip()
+    if not user_id or not query:
+        return Response(
+            {'error': 'Both userId and q are required'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    try:
+        limit = min(int(request.GET.get('limit', settings.SEARCH_PAGE_SIZE)), settings.SEARCH_MAX_RESULTS)
+    except ValueError:
+        return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+    if limit < 1:
+        return Response({'error': 'limit must be positive'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        results = search_index.search(user_id, query, limit)
+    except search_index.SearchUnavailable as e:
+        return Response({'error': str(e)}, status=status.HTTP_501_NOT_IMPLEMENTED)
+    return Response({'query': query, 'results': results})
+
+@async_api_view(['POST'])
+@throttle_classes(AI_THROTTLES)
+@usage.metered
+async def process_text(request):
     """Process text and create a new book"""
     try:
         text = request.data.get('text', '')
@@ -38,18 +284,25 @@ def process_text(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        background = request_flag(request, 'async')
+        
         # Create new book with user_id
-        book = Book.objects.create(
+        book = await Book.objects.acreate(
             title="Untitled Book",
             original_text=text,
-            is_processed=True,
+            is_processed=not background,
             user_id=user_id
         )
         
-        # Simplify text using Claude
+        if background:
+            page = await sync_to_async(book.add_page)('')
+            await sync_to_async(store_placeholders)(book, [page])
+            job = await sync_to_async(jobs.enqueue)(Job.PROCESS_TEXT, user_id, book=book, page=page, text=text)
+            return job_accepted(job)
+        
+        # Simplify text and suggest a title in parallel
         try:
-            simplified_text = simplify_text(text)
-            suggested_title = suggest_title(text)
+            simplified_chunks, suggested_title = await asimplify_and_title(text)
         except Exception as e:
             logger.error(f"Claude API error: {str(e)}")
             return Response(
@@ -57,13 +310,12 @@ def process_text(request):
                 status=status.HTTP_503_SERVICE_UNAVAILABLE
             )
         
-        # Add page and update title
-        book.add_page(simplified_text)
+        # Add pages and update title
+        await sync_to_async(add_simplified_pages)(book, simplified_chunks, request_flag(request, 'splitPages'))
         book.title = suggested_title
-        book.save()
+        await book.asave(update_fields=['title', 'last_edited'])
         
-        serializer = BookSerializer(book)
-        return Response(serializer.data)
+        return Response(await book_data(book))
         
     except Exception as e:
         logger.error(f"Error in process_text: {str(e)}")
@@ -72,6 +324,57 @@ def process_text(request):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+@api_view(['POST'])
+@throttle_classes(AI_THROTTLES)
+@usage.metered
+def process_text_stream(request):
+    """Process text and create a new book, streaming the simplified text"""
+    text = request.data.get('text', '')
+    user_id = request.data.get('userId')
+    
+    if not text or not user_id:
+        return Response(
+            {'error': 'Both text and userId are required'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    title_future = ai_service.submit_title(text)
+    
+    def events():
+        book = Book.objects.create(
+            title="Untitled Book",
+            original_text=text,
+            is_processed=False,
+            user_id=user_id
+        )
+        finished = False
+        try:
+            yield sse_event({'book_id': book.id}, 'book')
+            outputs = []
+            try:
+                # The stream runs after the view returns, outside its metering
+                with usage.charged_to(user_id):
+                    for part in stream_simplify_text(text, outputs):
+                        yield sse_event({'text': part})
+            except Exception as e:
+                logger.error(f"AI streaming error in process_text_stream: {str(e)}")
+                yield sse_event({'error': 'Error processing text with AI service'}, 'error')
+                return
+            
+            add_simplified_pages(book, outputs)
+            book.title = title_future.result()
+            book.is_processed = True
+            book.save(update_fields=['title', 'is_processed', 'last_edited'])
+            finished = True
+            yield sse_event(BookSerializer(book).data, 'done')
+        finally:
+            # The stream failed or the client went away before it finished
+            if not finished:
+                book.delete()
+    
+    return event_stream(request, events())
+
+@condition(etag_func=book_etag, last_modified_func=book_last_modified)
 @api_view(['GET'])
 def get_book(request, book_id):
     """Get a specific book and its pages"""
@@ -82,13 +385,74 @@ def get_book(request, book_id):
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    book = get_object_or_404(Book, id=book_id, user_id=user_id)
-    serializer = BookSerializer(book)
-    return Response(serializer.data)
+    try:
+        fields = requested_fields(request, BookSerializer)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    def build():
+        book = get_object_or_404(books_for_user(user_id, fields), id=book_id)
+        return BookSerializer(book, fields=fields).data
+    
+    payload = book_cache.read_through(
+        book_cache.book_scope(book_id), book_version(request, book_id),
+        request.get_full_path(), build
+    )
+    return Response(payload)
+
+@condition(etag_func=book_etag, last_modified_func=book_last_modified)
+@api_view(['GET'])
+def get_pages(request, book_id):
+    """Get a range of a book's pages, starting at page number `start`"""
+    user_id = request.GET.get('userId')
+    if not user_id:
+        return Response(
+            {'error': 'userId is required'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    try:
+        start = max(int(request.GET.get('start', 1)), 1)
+        limit = int(request.GET.get('limit', settings.BOOK_PAGES_PAGE_SIZE))
+    except ValueError:
+        return Response(
+            {'error': 'start and limit must be integers'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    limit = min(max(limit, 1), settings.BOOK_PAGES_MAX_PAGE_SIZE)
+    
+    def build():
+        book = get_object_or_404(Book.objects.only('id', 'total_pages'), id=book_id, user_id=user_id)
+        # One extra row tells us where the next range starts
+        pages = list(
+            Page.objects.filter(book_id=book.id, page_number__gte=start)
+            .order_by('page_number')[:limit + 1]
+        )
+        return {
+            'book_id': book.id,
+            'total_pages': book.total_pages,
+            'start': start,
+            'next_start': pages[limit].page_number if len(pages) > limit else None,
+            'pages': PageSerializer(pages[:limit], many=True).data,
+        }
+    
+    payload = book_cache.read_through(
+        book_cache.book_scope(book_id), book_version(request, book_id),
+        request.get_full_path(), build
+    )
+    return Response(payload)
 
 @api_view(['PATCH'])
+@usage.metered
 def update_book(request, book_id):
-    """Update book details"""
+    """
+    Update book details.
+
+    With `resimplify`, an edited original_text is simplified again, but
+    only the changed blocks go to the AI service and only their pages are
+    rebuilt. Such edits are refused up front once the user's daily token
+    budget is spent.
+    """
     try:
         user_id = request.data.get('userId')
         if not user_id:
@@ -97,11 +461,36 @@ def update_book(request, book_id):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        book = get_object_or_404(Book, id=book_id, user_id=user_id)
+        if request_flag(request, 'resimplify') and usage.budget_exhausted(user_id):
+            return Response(
+                {'error': 'Daily AI token budget used up'},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={'Retry-After': str(int(usage.seconds_until_reset()) + 1)}
+            )
+        
+        try:
+            fields = requested_fields(request, BookSerializer)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # The original text is only needed when it is being replaced
+        editing_text = 'original_text' in request.data
+        books = Book.objects.all() if editing_text else Book.objects.defer('original_text')
+        book = get_object_or_404(books, id=book_id, user_id=user_id)
+        previous_text = book.original_text if editing_text else None
         serializer = BookSerializer(book, data=request.data, partial=True)
         if serializer.is_valid():
             serializer.save()
-            return Response(serializer.data)
+            if editing_text and request_flag(request, 'resimplify') and book.original_text != previous_text:
+                try:
+                    resimplify(book, previous_text)
+                except Exception as e:
+                    logger.error(f"AI service error in update_book: {str(e)}")
+                    return Response(
+                        {'error': 'Text was saved but could not be simplified again'},
+                        status=status.HTTP_503_SERVICE_UNAVAILABLE
+                    )
+            return Response(BookSerializer(book, fields=fields).data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         return Response(
@@ -109,8 +498,10 @@ def update_book(request, book_id):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
-@api_view(['POST'])
-def add_page(request, book_id):
+@async_api_view(['POST'])
+@throttle_classes(AI_THROTTLES)
+@usage.metered
+async def add_page(request, book_id):
     """Add a new page to an existing book"""
     try:
         user_id = request.data.get('userId')
@@ -120,7 +511,7 @@ def add_page(request, book_id):
                 status=status.HTTP_400_BAD_REQUEST
             )
             
-        book = get_object_or_404(Book, id=book_id, user_id=user_id)
+        book = await aget_object_or_404(Book.objects.defer('original_text'), id=book_id, user_id=user_id)
         text = request.data.get('text', '')
         
         if not text:
@@ -129,9 +520,16 @@ def add_page(request, book_id):
                 status=status.HTTP_400_BAD_REQUEST
             )
             
+        if request_flag(request, 'async'):
+            page = await sync_to_async(book.add_page)('')
+            book.is_processed = False
+            await book.asave(update_fields=['is_processed', 'last_edited'])
+            job = await sync_to_async(jobs.enqueue)(Job.ADD_PAGE, user_id, book=book, page=page, text=text)
+            return job_accepted(job)
+            
         # Simplify new text
         try:
-            simplified_text = simplify_text(text)
+            simplified_chunks = await asimplify_chunks(text)
         except Exception as e:
             logger.error(f"Claude API error in add_page: {str(e)}")
             return Response(
@@ -139,12 +537,12 @@ def add_page(request, book_id):
                 status=status.HTTP_503_SERVICE_UNAVAILABLE
             )
         
-        # Add as new page
-        book.add_page(simplified_text)
-        book.refresh_from_db()
+        # Add as new page, or one page per chunk when requested
+        if not request_flag(request, 'splitPages'):
+            simplified_chunks = ['\n\n'.join(simplified_chunks)]
+        await sync_to_async(book.add_pages)(simplified_chunks)
         
-        serializer = BookSerializer(book)
-        return Response(serializer.data)
+        return Response(await book_data(book))
         
     except Exception as e:
         logger.error(f"Error in add_page: {str(e)}")
@@ -154,8 +552,104 @@ def add_page(request, book_id):
         )
 
 @api_view(['POST'])
+@throttle_classes(AI_THROTTLES)
+@usage.metered
+def add_page_stream(request, book_id):
+    """Add a new page to an existing book, streaming the simplified text"""
+    user_id = request.data.get('userId')
+    if not user_id:
+        return Response(
+            {'error': 'userId is required'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+        
+    book = get_object_or_404(Book.objects.defer('original_text'), id=book_id, user_id=user_id)
+    text = request.data.get('text', '')
+    
+    if not text:
+        return Response(
+            {'error': 'No text provided'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    def events():
+        parts = []
+        try:
+            with usage.charged_to(user_id):
+                for part in stream_simplify_text(text):
+                    parts.append(part)
+                    yield sse_event({'text': part})
+        except Exception as e:
+            logger.error(f"AI streaming error in add_page_stream: {str(e)}")
+            yield sse_event({'error': 'Error processing text with AI service'}, 'error')
+            return
+        
+        book.add_page(''.join(parts).strip())
+        yield sse_event(BookSerializer(book).data, 'done')
+    
+    return event_stream(request, events())
+
+@api_view(['POST'])
+@throttle_classes(AI_THROTTLES)
+@usage.metered
+def import_book(request):
+    """Simplify many texts and images into pages of a new or existing book"""
+    user_id = request.data.get('userId')
+    if not user_id:
+        return Response(
+            {'error': 'userId is required'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    book_id = request.data.get('bookId')
+    book = get_object_or_404(Book.objects.defer('original_text'), id=book_id, user_id=user_id) if book_id else None
+    
+    try:
+        items = import_items(request)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    results, suggested_title = simplify_items(items, with_title=book is None)
+    report = [
+        {'index': index, 'status': 'failed', 'error': error} if error
+        else {'index': index, 'status': 'done'}
+        for index, (_, _, error) in enumerate(results)
+    ]
+    succeeded = [(index, text, content) for index, (text, content, error) in enumerate(results) if not error]
+    if not succeeded:
+        return Response(
+            {'error': 'Error processing items with AI service', 'items': report},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+    
+    # Pages are numbered in input order, skipping failed items
+    created = book is None
+    with transaction.atomic():
+        if created:
+            book = Book.objects.create(
+                title=suggested_title or "Untitled Book",
+                original_text='\n\n'.join(text for _, text, _ in succeeded),
+                is_processed=True,
+                user_id=user_id
+            )
+        pages = book.add_pages([content for _, _, content in succeeded])
+        if created:
+            # Items were simplified one by one, not in the blocks split_text
+            # makes of the joined text, so their pages are placeholders
+            store_placeholders(book, pages)
+    for (index, _, _), page in zip(succeeded, pages):
+        report[index]['page_number'] = page.page_number
+    
+    return Response({
+        'book': BookSerializer(book).data,
+        'items': report,
+    })
+
+@async_api_view(['POST'])
 @parser_classes([MultiPartParser, FormParser])
-def upload_image(request):
+@throttle_classes(AI_THROTTLES)
+@usage.metered
+async def upload_image(request):
     """Handle image upload and text extraction using Claude"""
     try:
         if 'image' not in request.FILES:
@@ -165,17 +659,40 @@ def upload_image(request):
             )
 
         image_file = request.FILES['image']
+        try:
+            check_upload_size(image_file)
+        except ImageTooLarge as e:
+            return Response({'error': str(e)}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
         
-        # Read the image file and encode it to base64
-        image_data = base64.b64encode(image_file.read()).decode('utf-8')
+        if request_flag(request, 'async'):
+            user_id = request.data.get('userId')
+            if not user_id:
+                return Response(
+                    {'error': 'userId is required for async uploads'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            job = await sync_to_async(jobs.enqueue)(Job.UPLOAD_IMAGE, user_id, attachment=image_file.read())
+            return job_accepted(job)
         
-        # Extract text using Claude
-        extracted_text = extract_text_from_image(image_data)
+        # Normalize the image straight from the upload, off the event loop
+        try:
+            image, media_type = await sync_to_async(prepare_image, thread_sensitive=False)(image_file)
+        except InvalidImage as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Extract text using the configured provider
+        extracted_text = await aextract_text_from_image(image, media_type)
         
         return Response({
             'extracted_text': extracted_text
         }, status=status.HTTP_200_OK)
         
+    except ProviderBusy as e:
+        logger.error(f"Error processing image: {str(e)}")
+        return Response(
+            {'error': 'AI service is busy, please retry shortly'},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
     except Exception as e:
         logger.error(f"Error processing image: {str(e)}")
         return Response(
@@ -183,6 +700,82 @@ def upload_image(request):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+@api_view(['POST'])
+@parser_classes([MultiPartParser, FormParser])
+@throttle_classes(AI_THROTTLES)
+@usage.metered
+def upload_images(request):
+    """Extract text from several images, batching them into few provider calls"""
+    try:
+        image_files = request.FILES.getlist('images')
+        if not image_files:
+            return Response(
+                {'error': 'No image files provided'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(image_files) > settings.OCR_MAX_IMAGES:
+            return Response(
+                {'error': f'At most {settings.OCR_MAX_IMAGES} images can be uploaded at once'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            for image_file in image_files:
+                check_upload_size(image_file)
+        except ImageTooLarge as e:
+            return Response({'error': str(e)}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        
+        try:
+            images = ai_service.map(prepare_image, image_files)
+        except InvalidImage as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        extracted_texts = extract_text_from_images(images)
+        
+        return Response({
+            'extracted_texts': extracted_texts
+        }, status=status.HTTP_200_OK)
+        
+    except ProviderBusy as e:
+        logger.error(f"Error processing images: {str(e)}")
+        return Response(
+            {'error': 'AI service is busy, please retry shortly'},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+    except Exception as e:
+        logger.error(f"Error processing images: {str(e)}")
+        return Response(
+            {'error': str(e)}, 
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+@api_view(['GET'])
+def get_job(request, job_id):
+    """Report the status of a background job"""
+    user_id = request.GET.get('userId')
+    if not user_id:
+        return Response(
+            {'error': 'userId is required'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    job = get_object_or_404(
+        Job.objects.select_related('book').defer('book__original_text'), id=job_id, user_id=user_id
+    )
+    data = {
+        'job_id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'book_id': job.book_id,
+        'error': job.error or None,
+    }
+    if job.status == Job.DONE:
+        if job.kind == Job.UPLOAD_IMAGE:
+            data['extracted_text'] = job.result
+        else:
+            data['book'] = BookSerializer(job.book).data
+    return Response(data)
+
 @api_view(['DELETE'])
 def delete_book(request, book_id):
     """Delete a specific book"""
@@ -194,7 +787,7 @@ def delete_book(request, book_id):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        book = get_object_or_404(Book, id=book_id, user_id=user_id)
+        book = get_object_or_404(Book.objects.only('id', 'user_id'), id=book_id, user_id=user_id)
         book.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
     except Exception as e:
@@ -203,6 +796,16 @@ def delete_book(request, book_id):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+@api_view(['GET'])
+def ai_metrics(request):
+    """Report AI service counters for this worker process"""
+    return Response({
+        'provider': ai_service.provider,
+        'cache': ai_service.cache.stats() if ai_service.cache else None,
+        'image_cache': ai_service.image_cache.stats() if ai_service.image_cache else None,
+        'providers': ai_service.router.snapshot(),
+    })
+
 @api_view(['GET'])
 def health_check(request):
     return Response({"status": "healthy"})
\ No newline at end of file
@@ -75,6 +75,17 @@ DATABASES = {
     )
 }
 
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # AI worker threads write concurrently; take the write lock up front so
+    # they wait for each other instead of failing with "database is locked".
+    DATABASES['default'].setdefault('OPTIONS', {}).update({
+        'transaction_mode': 'IMMEDIATE',
+        'timeout': 20,
+    })
+    # Threads sharing an in-memory test database fail with "table is locked"
+    # rather than waiting, so tests get a file that Django removes afterwards
+    DATABASES['default'].setdefault('TEST', {}).setdefault('NAME', os.path.join(BASE_DIR, 'test_db.sqlite3'))
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -152,9 +163,168 @@ REST_FRAMEWORK = {
         'rest_framework.parsers.FormParser',
         'rest_framework.parsers.MultiPartParser',
     ],
+    # Proxies in front of the app; throttles take the client address from
+    # X-Forwarded-For accordingly
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', '1')),
 }
 
 
 ANTHROPIC_API_KEY = os.getenv('ANTHROPIC_API_KEY')
 
-GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
\ No newline at end of file
+GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+
+# AI result cache
+AI_CACHE_ENABLED = os.getenv('AI_CACHE_ENABLED', 'True') == 'True'
+AI_CACHE_TTL = int(os.getenv('AI_CACHE_TTL', str(60 * 60 * 24 * 30)))
+AI_CACHE_MAX_ENTRIES = int(os.getenv('AI_CACHE_MAX_ENTRIES', '10000'))
+AI_CACHE_MEMORY_ENTRIES = int(os.getenv('AI_CACHE_MEMORY_ENTRIES', '256'))
+
+# Maximum concurrent provider calls issued by one worker process
+AI_MAX_WORKERS = int(os.getenv('AI_MAX_WORKERS', '4'))
+
+# Background job queue. Set AI_JOB_WORKERS=0 to leave the queue to
+# `manage.py process_jobs` instead of in-process worker threads.
+AI_JOB_WORKERS = int(os.getenv('AI_JOB_WORKERS', '2'))
+AI_JOB_POLL_INTERVAL = float(os.getenv('AI_JOB_POLL_INTERVAL', '2'))
+AI_JOB_TIMEOUT = int(os.getenv('AI_JOB_TIMEOUT', '600'))
+# Runs after which a job still refused by busy providers is failed
+AI_JOB_MAX_ATTEMPTS = int(os.getenv('AI_JOB_MAX_ATTEMPTS', '5'))
+
+# Inputs longer than this many estimated tokens are simplified in chunks
+AI_CHUNK_TOKENS = int(os.getenv('AI_CHUNK_TOKENS', '700'))
+
+# Book list pagination and summary excerpts
+BOOK_LIST_PAGE_SIZE = int(os.getenv('BOOK_LIST_PAGE_SIZE', '20'))
+BOOK_LIST_MAX_PAGE_SIZE = int(os.getenv('BOOK_LIST_MAX_PAGE_SIZE', '100'))
+BOOK_EXCERPT_LENGTH = int(os.getenv('BOOK_EXCERPT_LENGTH', '200'))
+BOOK_PAGES_PAGE_SIZE = int(os.getenv('BOOK_PAGES_PAGE_SIZE', '10'))
+BOOK_PAGES_MAX_PAGE_SIZE = int(os.getenv('BOOK_PAGES_MAX_PAGE_SIZE', '100'))
+
+# Full-text search: results per request and words per highlighted snippet
+SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', '20'))
+SEARCH_MAX_RESULTS = int(os.getenv('SEARCH_MAX_RESULTS', '50'))
+SEARCH_SNIPPET_WORDS = int(os.getenv('SEARCH_SNIPPET_WORDS', '16'))
+
+# Compression of book and page text: 'zlib', 'zstd' (needs the zstandard
+# package) or 'none'. Stored values record their codec, so changing this only
+# affects new writes. Train a shared dictionary with train_text_dictionary.
+TEXT_COMPRESSION = os.getenv('TEXT_COMPRESSION', 'zlib')
+TEXT_COMPRESSION_LEVEL = int(os.getenv('TEXT_COMPRESSION_LEVEL', '6'))
+
+# Serialized book cache: 'locmem' (per process), 'file' or 'db'. The db
+# backend needs `manage.py createcachetable`. Set BOOK_CACHE_TTL=0 to disable.
+BOOK_CACHE_BACKEND = os.getenv('BOOK_CACHE_BACKEND', 'locmem')
+BOOK_CACHE_TTL = int(os.getenv('BOOK_CACHE_TTL', '300'))
+
+BOOK_CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'books',
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('BOOK_CACHE_LOCATION', os.path.join(BASE_DIR, 'cache', 'books')),
+    },
+    'db': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': os.getenv('BOOK_CACHE_LOCATION', 'book_cache'),
+    },
+}
+
+# Rate limit and token counters, shared by every worker: 'db' (the
+# SharedCounter table) or 'redis' (needs the redis package). Both increment
+# atomically without extending a counter's expiry.
+THROTTLE_COUNTER_BACKEND = os.getenv('THROTTLE_COUNTER_BACKEND', 'db')
+THROTTLE_REDIS_URL = os.getenv('THROTTLE_REDIS_URL', 'redis://localhost:6379/0')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'books': {
+        **BOOK_CACHE_BACKENDS[BOOK_CACHE_BACKEND],
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('BOOK_CACHE_MAX_ENTRIES', '1000')),
+        },
+    },
+}
+
+# Maximum number of texts and images accepted by one bulk import
+BULK_IMPORT_MAX_ITEMS = int(os.getenv('BULK_IMPORT_MAX_ITEMS', '50'))
+
+# Image preprocessing before text extraction. IMAGE_MAX_SKEW is the largest
+# rotation in degrees that deskewing will correct; 0 disables it.
+IMAGE_PREPROCESS_ENABLED = os.getenv('IMAGE_PREPROCESS_ENABLED', 'True') == 'True'
+IMAGE_MAX_DIMENSION = int(os.getenv('IMAGE_MAX_DIMENSION', '1600'))
+IMAGE_GRAYSCALE = os.getenv('IMAGE_GRAYSCALE', 'True') == 'True'
+IMAGE_MAX_SKEW = float(os.getenv('IMAGE_MAX_SKEW', '10'))
+IMAGE_JPEG_QUALITY = int(os.getenv('IMAGE_JPEG_QUALITY', '80'))
+# Uploads over FILE_UPLOAD_MAX_MEMORY_SIZE (2.5 MB by default) are spooled
+# to a temporary file and read from there; anything over this is rejected.
+IMAGE_MAX_UPLOAD_BYTES = int(os.getenv('IMAGE_MAX_UPLOAD_BYTES', str(15 * 1024 * 1024)))
+
+# Image text extraction cache. Images a user uploads whose 256-bit perceptual
+# hashes differ in at most IMAGE_CACHE_MAX_DISTANCE bits (below 8) from one
+# they uploaded before share its result; 0 matches exact content only.
+IMAGE_CACHE_MAX_ENTRIES = int(os.getenv('IMAGE_CACHE_MAX_ENTRIES', '2000'))
+IMAGE_CACHE_MAX_DISTANCE = int(os.getenv('IMAGE_CACHE_MAX_DISTANCE', '4'))
+
+# Batch text extraction: images per upload and images per provider request
+OCR_MAX_IMAGES = int(os.getenv('OCR_MAX_IMAGES', '30'))
+OCR_BATCH_SIZE = int(os.getenv('OCR_BATCH_SIZE', '4'))
+
+# Outbound provider requests. Each process allows AI_MAX_IN_FLIGHT requests
+# per provider; callers wait up to AI_SLOT_TIMEOUT seconds for a free slot
+# and get a 503 otherwise. Timeouts are in seconds and apply to Claude; the
+# pinned Gemini SDK does not accept per-request timeouts.
+AI_MAX_IN_FLIGHT = int(os.getenv('AI_MAX_IN_FLIGHT', '8'))
+# Async views wait for providers on the event loop rather than a thread, so
+# one ASGI worker can hold many more requests in flight
+AI_ASYNC_MAX_IN_FLIGHT = int(os.getenv('AI_ASYNC_MAX_IN_FLIGHT', '200'))
+AI_SLOT_TIMEOUT = float(os.getenv('AI_SLOT_TIMEOUT', '0.5'))
+AI_CONNECT_TIMEOUT = float(os.getenv('AI_CONNECT_TIMEOUT', '5'))
+AI_SIMPLIFY_TIMEOUT = float(os.getenv('AI_SIMPLIFY_TIMEOUT', '60'))
+AI_TITLE_TIMEOUT = float(os.getenv('AI_TITLE_TIMEOUT', '15'))
+AI_OCR_TIMEOUT = float(os.getenv('AI_OCR_TIMEOUT', '60'))
+
+# Provider routing. AI_ROUTE_<OPERATION> lists providers to try in order,
+# e.g. AI_ROUTE_OCR=claude,gemini; by default Gemini is preferred when
+# configured. Hedged operations get a duplicate request on the next provider
+# once the first exceeds its recent p95 latency (AI_HEDGE_DELAY until enough
+# samples exist). Providers whose recent error rate reaches
+# AI_ROUTER_MAX_ERROR_RATE are tried last.
+AI_ROUTES = {
+    operation: [name.strip() for name in os.getenv(f'AI_ROUTE_{operation.upper()}', '').split(',') if name.strip()]
+    for operation in ('simplify', 'title', 'ocr')
+}
+AI_HEDGE_OPERATIONS = [name.strip() for name in os.getenv('AI_HEDGE_OPERATIONS', 'simplify,title').split(',') if name.strip()]
+AI_HEDGE_DELAY = float(os.getenv('AI_HEDGE_DELAY', '10'))
+AI_HEDGE_MIN_DELAY = float(os.getenv('AI_HEDGE_MIN_DELAY', '2'))
+AI_ROUTER_WINDOW = int(os.getenv('AI_ROUTER_WINDOW', '100'))
+AI_ROUTER_MIN_SAMPLES = int(os.getenv('AI_ROUTER_MIN_SAMPLES', '5'))
+AI_ROUTER_MAX_ERROR_RATE = float(os.getenv('AI_ROUTER_MAX_ERROR_RATE', '0.5'))
+
+# Retries of rate-limited, overloaded or timed-out provider calls, before
+# failing over. Delays grow exponentially from AI_RETRY_BASE_DELAY with full
+# jitter; a Retry-After header is honoured when it is at most
+# AI_RETRY_MAX_DELAY seconds. The SDKs' own retries are turned off.
+AI_RETRY_ATTEMPTS = int(os.getenv('AI_RETRY_ATTEMPTS', '2'))
+AI_RETRY_BASE_DELAY = float(os.getenv('AI_RETRY_BASE_DELAY', '0.5'))
+AI_RETRY_MAX_DELAY = float(os.getenv('AI_RETRY_MAX_DELAY', '8'))
+
+# Per-provider circuit breaker: open after this many consecutive retryable
+# failures, then let one trial call through after AI_BREAKER_COOLDOWN seconds
+AI_BREAKER_FAILURES = int(os.getenv('AI_BREAKER_FAILURES', '5'))
+AI_BREAKER_COOLDOWN = float(os.getenv('AI_BREAKER_COOLDOWN', '30'))
+
+# Limits on the endpoints that call providers, checked before any call.
+# Rates are '<count>/<s|m|h|d>' over a sliding window, per userId and per
+# client address; '0' disables one. AI_DAILY_TOKEN_BUDGET caps the
+# provider-reported tokens charged to a userId per UTC day (0 disables it).
+AI_USER_RATE = os.getenv('AI_USER_RATE', '20/m')
+AI_IP_RATE = os.getenv('AI_IP_RATE', '60/m')
+AI_DAILY_TOKEN_BUDGET = int(os.getenv('AI_DAILY_TOKEN_BUDGET', '200000'))
+
+# Local stub provider for development and tests, used ahead of real providers
+AI_STUB_PROVIDER = os.getenv('AI_STUB_PROVIDER', 'False') == 'True'
+AI_STUB_LATENCY = float(os.getenv('AI_STUB_LATENCY', '0'))